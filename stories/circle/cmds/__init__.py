@@ -5,15 +5,15 @@ Package containing new and overridden game commands.
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 
-from typing import Union, List
-from zones import make_location, make_item, make_mob
+from typing import Union
+from zones import make_location, make_item, make_mob, circle_zones
 
 from tale import lang, util
 from tale.cmds import wizcmd
 from tale.cmds.wizard import teleport_to
 from tale.errors import ActionRefused, ParseError
 from tale.player import Player
-from tale.base import ParseResult, Location, Living, Item, Exit
+from tale.base import ParseResult, Location, Living, Item, Exit, MudObjRegistry
 
 
 @wizcmd("cvgo")
@@ -32,7 +32,7 @@ def go_cvnum(player: Player, parsed: ParseResult, ctx: util.Context) -> None:
 @wizcmd("cvnum")
 def show_cvnum(player: Player, parsed: ParseResult, ctx: util.Context) -> None:
     """Show the circle-vnum of a location (.) or an object/living,
-    or when you provide a circle-vnum as arg, show the object(s) with that circle-vnum."""
+    or when you provide a circle-vnum as arg, show the room and where all the mobs and items with that circle-vnum are."""
     if not parsed.args:
         raise ParseError("From what should I show the circle-vnum?")
     name = parsed.args[0]
@@ -46,20 +46,17 @@ def show_cvnum(player: Player, parsed: ParseResult, ctx: util.Context) -> None:
             vnum = int(parsed.args[0])
         except ValueError as x:
             raise ActionRefused(str(x))
-        objects = []   # type: List[Union[Location, Living, Item, Exit]]
         try:
-            objects.append(make_item(vnum))
+            room = make_location(vnum)   # type: Location
+            player.tell("Room with circle-vnum %d: %s" % (vnum, room), end=True)
         except KeyError:
             pass
-        try:
-            objects.append(make_location(vnum))
-        except KeyError:
-            pass
-        try:
-            objects.append(make_mob(vnum))
-        except KeyError:
-            pass
-        player.tell("Objects with circle-vnum %d:" % vnum + " " + (lang.join(str(o) for o in objects) or "none"))
+        for kind in (Living, Item):
+            whereabouts = MudObjRegistry.whereabouts(kind, vnum)
+            player.tell("%ss with circle-vnum %d: %d" % (kind.__name__, vnum, MudObjRegistry.count(kind, vnum)), end=True)
+            for location, objects in whereabouts.items():
+                where = "%s, #%d" % (location.name, location.vnum) if location else "<none>"
+                player.tell("  %s  (%s)" % (lang.join(str(o) for o in objects), where), end=True)
         return
     try:
         vnum = obj.circle_vnum   # type: ignore
@@ -88,3 +85,18 @@ def spawn_cvnum(player: Player, parsed: ParseResult, ctx: util.Context) -> None:
     else:
         player.tell("Spawned " + repr(mob) + " (into your current location)")
         mob.move(player.location, actor=player)
+
+
+@wizcmd("czones")
+def show_czones(player: Player, parsed: ParseResult, ctx: util.Context) -> None:
+    """Show the circle zones that are populated, and what their last reset loaded."""
+    player.tell("<bright>Populated zones:</>", end=True)
+    txt = []
+    for vnum in sorted(circle_zones.populated_zones):
+        zone = circle_zones.zones[vnum]
+        resets, mobs, items, shops = circle_zones.reset_stats.get(vnum, (0, 0, 0, 0))
+        if resets:
+            txt.append("  %3d %-30s %3d resets, last: %d mobs, %d items, %d shops" % (vnum, zone.name, resets, mobs, items, shops))
+        else:
+            txt.append("  %3d %-30s not reset yet" % (vnum, zone.name))
+    player.tell("\n".join(txt) or "  none", format=False)
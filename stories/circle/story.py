@@ -36,6 +36,7 @@ class Story(StoryBase):
     config.mud_host = "localhost"
     config.mud_port = 8200
     config.license_file = "messages/license.txt"
+    config.active_region_hops = 3         # mobs further away from players don't wander around
     # story-specific fields follow:
     driver = None     # will be set by init()
 
@@ -7,14 +7,14 @@ Copyright by Irmen de Jong (irmen@razorvine.net)
 
 from types import SimpleNamespace
 from typing import Set, Dict, no_type_check
-from tale.base import Item, Armour, Container, Weapon, Key
+from tale.base import Item, Armour, Container, Weapon, Key, MudObjRegistry
 from tale.items.basic import *
 from tale.items.board import BulletinBoard
 from tale.items.bank import Bank
 from .parse_obj_files import get_objs
 
 
-__all__ = ("converted_items", "make_item", "unconverted_objs")
+__all__ = ("converted_items", "make_item", "unconverted_objs", "count_items")
 
 
 objs = {}    # type: Dict[int, SimpleNamespace]
@@ -164,6 +164,7 @@ def make_item(vnum: int) -> Item:
         kwds = ed["keywords"] - {name}  # remove the item name from the extradesc to avoid doubles
         item.add_extradesc(kwds, ed["text"])
     item.circle_vnum = vnum  # keep the vnum
+    item.prototype = vnum   # so the registry counts the items per circle vnum
     item.aliases = aliases
     if c_obj.cost > 0:
         item.value = c_obj.cost
@@ -173,3 +174,8 @@ def make_item(vnum: int) -> Item:
     # @todo: affects, effects, wear
     converted_items.add(vnum)
     return item
+
+
+def count_items(vnum: int) -> int:
+    """The number of items of the given circle vnum that exist in the world (not the shops' forsale stock)"""
+    return sum(1 for item in MudObjRegistry.instances(Item, vnum) if item.contained_in)
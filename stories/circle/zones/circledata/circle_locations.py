@@ -6,7 +6,7 @@ It also builds the Shops (which are not strictly locations but are most natural
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 from types import SimpleNamespace
-from typing import Dict
+from typing import Dict, Callable
 from tale import mud_context, lang
 from tale.base import Location, Living, ParseResult, Exit, Door
 from tale.errors import ActionRefused, LocationIntegrityError
@@ -17,7 +17,8 @@ from .circle_mobs import make_mob
 from .circle_items import make_item
 
 
-__all__ = ("converted_rooms", "converted_shops", "make_location", "make_exit", "make_shop", "init_circle_locations")
+__all__ = ("converted_rooms", "converted_shops", "make_location", "make_exit", "make_shop", "init_circle_locations",
+           "materialize_location")
 
 
 rooms = {}  # type: Dict[int, SimpleNamespace]
@@ -48,6 +49,7 @@ class PetShop(Location):
 
     def get_pets(self):
         pet_room = make_location(self.circle_vnum + 1)  # Yuck... but circle defines it this way, the pets are in the back room...
+        pet_room.materialize()
         return {pet: pet.stats.level * 300.0 for pet in pet_room.livings}
 
     def handle_verb(self, parsed: ParseResult, actor: Living) -> bool:
@@ -105,11 +107,15 @@ circle_donation_room = 3063    # items and gold donated by wizards end up here a
 circle_pet_shops = {3031}      # special shops, they sell living creatures!
 circle_dump_rooms = {3030}     # special rooms that are a garbage dump and destroy dropped stuff.
 
+zone_populator = None    # type: Callable[[int], None]   # called with the circle zone number when a room of it is materialized
+
 
 def make_location(vnum: int) -> Location:
     """
     Get a Tale location object for the given circle room vnum.
     This performs an on-demand conversion of the circle room data to Tale.
+    The location's exits are created, and its zone is populated, only when the location is
+    materialized: when something enters it for the first time (see materialize_location).
     """
     # @todo deal with location type ('inside') and attributes ('nomob', 'dark', 'death'...)
     try:
@@ -127,33 +133,45 @@ def make_location(vnum: int) -> Location:
         loc.circle_zone = c_room.zone    # type: ignore  # keep the circle zone number
         for ed in c_room.extradesc:
             loc.add_extradesc(ed["keywords"], ed["text"])
-        converted_rooms[vnum] = loc
         for circle_exit in c_room.exits.values():
-            if circle_exit.roomlink >= 0:
-                xt = make_exit(circle_exit)
-                while True:
-                    try:
-                        xt.bind(loc)
-                        break
-                    except LocationIntegrityError as x:
-                        if x.direction in xt.aliases:
-                            # circlemud exit keywords can be duplicated over various exits
-                            # if we have a conflict, just remove the alias from the exit and try again
-                            xt.aliases = xt.aliases - {x.direction}
-                            continue
-                        else:
-                            if loc.exits[x.direction] is xt:
-                                # this can occur, the exit is already bound
-                                break
-                            else:
-                                # in this case a true integrity error occurred
-                                raise
-            else:
+            if circle_exit.roomlink < 0:
                 # add the description of the inaccessible exit to the room's own description.
                 loc.description += " " + circle_exit.desc
+        loc._lazy_loader = materialize_location
+        converted_rooms[vnum] = loc
         return loc
 
 
+def materialize_location(loc: Location) -> None:
+    """
+    Creates the exits of the location (the locations they lead to are created as well, but not yet materialized),
+    and populates the location's zone if this is the first of its rooms that is materialized.
+    """
+    c_room = rooms[loc.circle_vnum]   # type: ignore
+    for circle_exit in c_room.exits.values():
+        if circle_exit.roomlink >= 0:
+            xt = make_exit(circle_exit)
+            while True:
+                try:
+                    xt.bind(loc)
+                    break
+                except LocationIntegrityError as x:
+                    if x.direction in xt.aliases:
+                        # circlemud exit keywords can be duplicated over various exits
+                        # if we have a conflict, just remove the alias from the exit and try again
+                        xt.aliases = xt.aliases - {x.direction}
+                        continue
+                    else:
+                        if loc.exits[x.direction] is xt:
+                            # this can occur, the exit is already bound
+                            break
+                        else:
+                            # in this case a true integrity error occurred
+                            raise
+    if zone_populator:
+        zone_populator(loc.circle_zone)   # type: ignore
+
+
 def make_exit(c_exit: SimpleNamespace) -> Exit:
     """Create an instance of a door or exit for the given circle exit"""
     if c_exit.type in ("normal", "pickproof"):  # @todo other door types? reverse doors? locks/keys?
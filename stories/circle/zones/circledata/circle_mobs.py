@@ -9,14 +9,15 @@ import re
 import random
 from types import SimpleNamespace
 from typing import Type, List, Set, Dict
-from tale.base import Living, Item
-from tale.util import Context, call_periodically, roll_dice
+from tale.base import Living, Item, MudObjRegistry
+from tale.driver import Driver
+from tale.util import Context, roll_dice
 from tale.shop import Shopkeeper
 from tale.errors import ActionRefused
 from .parse_mob_files import get_mobs
 
 
-__all__ = ("converted_mobs", "mobs_with_special", "make_mob", "init_circle_mobs")
+__all__ = ("converted_mobs", "mobs_with_special", "make_mob", "init_circle_mobs", "count_mobs")
 
 
 mobs = {}   # type: Dict[int, SimpleNamespace]
@@ -61,14 +62,18 @@ class CircleMob(Living):
             except ActionRefused:
                 pass
 
-    def do_special(self, ctx: Context) -> None:
-        # The special behavior of the mob. Not all mobs have these flags set!
+    def fast_forward(self, inactive_time: float, ctx: Context) -> None:
+        # A player came near. Rather than replaying the time nobody was around,
+        # a scavenger that was left alone long enough simply picked up the best item in the room.
+        if "scavenger" in self.actions and inactive_time >= 10.0 and "special" in self.actions:
+            self.do_scavenge(ctx)
+
+    def register_special(self, driver: Driver) -> None:
+        # Register the special behavior of the mob, as batched behaviors in the driver. Not all mobs have these flags set!
         if "sentinel" not in self.actions:
-            if random.random() <= 0.333:
-                self.do_wander(ctx)
+            driver.register_behavior(self, "do_wander", 10.0, 0.333)
         if "scavenger" in self.actions:
-            if random.random() < 0.1:
-                self.do_scavenge(ctx)
+            driver.register_behavior(self, "do_scavenge", 10.0, 0.1)
 
 
 # @todo implement the behavior of the various mob classes (see spec_procs.c / castle.c)
@@ -105,7 +110,10 @@ class MGuildmaster(CircleMob):
 
 class MPuff(CircleMob):
     """Puff the dragon"""
-    @call_periodically(10)
+    def register_special(self, driver: Driver) -> None:
+        # Puff's own special replaces the wandering and scavenging
+        driver.register_behavior(self, "do_special", 10.0)
+
     def do_special(self, ctx: Context) -> None:
         r = random.randint(0, 30)
         if r == 0:
@@ -448,6 +456,7 @@ def make_mob(vnum: int, mob_class: Type[CircleMob]=CircleMob) -> Living:
     mob_class = circle_mob_class.get(vnum, mob_class)
     mob = mob_class(name, c_mob.gender, race="human", title=title, descr=c_mob.detaileddesc, short_descr=c_mob.longdesc)
     mob.circle_vnum = vnum  # keep the vnum
+    mob.prototype = vnum   # so the registry counts the mobs per circle vnum
     if hasattr(c_mob, "extradesc"):
         for ed in c_mob.extradesc:
             mob.add_extradesc(ed["keywords"], ed["text"])
@@ -477,3 +486,8 @@ def make_mob(vnum: int, mob_class: Type[CircleMob]=CircleMob) -> Living:
     # @todo actions, affection,...
     converted_mobs.add(vnum)
     return mob
+
+
+def count_mobs(vnum: int) -> int:
+    """The number of mobs of the given circle vnum that are alive in the world"""
+    return sum(1 for mob in MudObjRegistry.instances(Living, vnum) if mob.location)
@@ -0,0 +1,182 @@
+"""
+Populating and resetting the zones of the Circle game, as described by the zone files.
+
+A zone is populated (reset for the first time) when the first of its rooms is materialized.
+After that it is reset again every time its lifespan has passed, depending on its reset mode:
+'never' zones aren't reset, 'deserted' zones only when there are no players in them, 'asap' zones always.
+A reset only replenishes mobs and objects that have fewer instances than their maximum.
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import time
+from typing import Any, Dict, List, Set, Tuple
+from tale.base import Door, Item, Living
+from tale.driver import Driver
+from tale.util import Context
+from .parse_zon_files import ZZone, ZMobile, get_zones
+from .circle_mobs import make_mob, count_mobs, mobs_with_special, MShopkeeper
+from .circle_locations import make_location, make_shop
+from .circle_items import make_item, count_items
+from . import circle_locations
+
+
+__all__ = ("init_circle_zones", "populate_zone", "reset_zone", "pulse_zone", "populated_zones")
+
+
+zones = {}   # type: Dict[int, ZZone]
+shopkeepers = {}     # type: Dict[int, int]   # shopkeeper mob vnum -> shop vnum
+populated_zones = set()    # type: Set[int]
+last_reset = {}    # type: Dict[int, float]   # zone vnum -> time.monotonic() of its last reset
+scheduled_resets = set()     # type: Set[int]   # zones that are due, and have their reset scheduled
+reset_stats = {}    # type: Dict[int, Tuple[int, int, int, int]]  # zone vnum -> number of resets, and mobs, items, shops of the last one
+zone_reset_spacing = 2.0    # seconds between the resets of zones that are due at the same time
+_driver = None   # type: Driver
+
+
+def init_circle_zones(driver: Driver, shop_defs: Dict[int, Any]) -> None:
+    global zones, _driver
+    zones = get_zones()
+    print(len(zones), "zones loaded.")
+    shopkeepers.clear()
+    shopkeepers.update((shop.shopkeeper, vnum) for vnum, shop in shop_defs.items())
+    assert len(shopkeepers) == len(shop_defs), "every shop must have its own shopkeeper"
+    _driver = driver
+    circle_locations.zone_populator = populate_zone
+
+
+def populate_zone(vnum: int) -> None:
+    """Populate a zone by resetting it for the first time. Called when the first room of the zone is materialized."""
+    if vnum not in populated_zones:
+        reset_zone(vnum)
+
+
+def reset_zone(vnum: int, ctx: Context=None) -> None:
+    """
+    Reset the zone: remove the objects it says to remove, load its mobs (with their equipment and inventory)
+    and objects as long as there are fewer of them than their maximum, and set its door states.
+    """
+    zone = zones.get(vnum)
+    if not zone:
+        return
+    first_time = vnum not in populated_zones
+    populated_zones.add(vnum)    # first, because placing the mobs and items materializes the rooms of this zone
+    scheduled_resets.discard(vnum)
+    last_reset[vnum] = time.monotonic()
+    ctx = ctx or Context.from_global()
+    num_shops = num_mobs = num_items = 0
+    for room_vnum, obj_vnum in zone.removes:
+        loc = make_location(room_vnum)
+        for item in [item for item in loc.items if item.prototype == obj_vnum]:
+            loc.remove(item, None)
+            item.destroy(ctx)
+    for mobref in zone.mobs:
+        if count_mobs(mobref.vnum) >= mobref.max_exist:
+            continue
+        mob = make_zone_mob(mobref)
+        num_items += mob.inventory_size
+        if mobref.vnum in shopkeepers:
+            num_shops += 1
+        make_location(mobref.room).insert(mob, None)
+        num_mobs += 1
+    for obj_ref in zone.objects:
+        loc = make_location(obj_ref.room)
+        if count_items(obj_ref.vnum) >= obj_ref.max_exist or \
+                any(item.prototype == obj_ref.vnum for item in loc.items):
+            continue
+        obj = make_item(obj_ref.vnum)
+        loc.insert(obj, None)
+        if obj_ref.contains:
+            items_in_room_obj = []  # type: List[Item]
+            for c_vnum, max_exists in obj_ref.contains:
+                items_in_room_obj.append(make_item(c_vnum))
+            obj.init_inventory(items_in_room_obj)
+            num_items += len(items_in_room_obj)
+        num_items += 1
+    for door_state in zone.doorstates:
+        loc = make_location(door_state.room)
+        loc.materialize()   # to get its exits
+        try:
+            xt = loc.exits[door_state.exit]
+        except KeyError:
+            pass
+        else:
+            if not isinstance(xt, Door):
+                raise TypeError("exit type not door, but asked to set state")
+            if door_state.state == "open":
+                xt.locked = False
+                xt.opened = True
+            elif door_state.state == "closed":
+                xt.locked = False
+                xt.opened = False
+            elif door_state.state == "locked":
+                xt.locked = True
+                xt.opened = False
+            else:
+                raise ValueError("invalid door state: " + door_state.state)
+
+    if first_time:
+        print("Populated zone %d (%s): %d mobs (%d specials), %d items, %d shops" %
+              (zone.vnum, zone.name, num_mobs, len(mobs_with_special), num_items, num_shops))
+    else:
+        # the periodic resets aren't printed on the server console, the czones wizard command shows them
+        reset_stats[vnum] = (reset_stats.get(vnum, (0,))[0] + 1, num_mobs, num_items, num_shops)
+    # the special mobs periodically do something (wander, scavenge...). This is done via the driver's batched
+    # behaviors, which spreads all 300+ special mobs over the server ticks so they don't all act at the same time.
+    for mob in mobs_with_special:
+        mob.register_special(_driver or ctx.driver)
+    mobs_with_special.clear()
+
+
+def make_zone_mob(mobref: ZMobile) -> Living:
+    """Create the mob of a zone reset command, with its equipment and inventory."""
+    if mobref.vnum in shopkeepers:
+        # mob is a shopkeeper, we need to make a shop+shopkeeper rather than a regular mob
+        mob = make_mob(mobref.vnum, mob_class=MShopkeeper)
+        mob.shop = make_shop(shopkeepers[mobref.vnum])   # type: ignore  # the shop it works for
+    else:
+        mob = make_mob(mobref.vnum)
+    # the equipment and inventory are not limited by their maximum, they come with the mob (which is limited already)
+    inventory = []  # type: List[Item]
+    for obj_ref in list(mobref.equip.values()) + mobref.inventory:
+        obj = make_item(obj_ref.vnum)
+        inventory.append(obj)    # @todo actually wield/wear the equipment! instead of putting it in the inventory
+        if obj_ref.contains:
+            obj.init_inventory([make_item(c_vnum) for c_vnum, c_max_exists in obj_ref.contains])
+    if inventory:
+        mob.init_inventory(inventory)
+    if mobref.vnum in shopkeepers:
+        # if it is a shopkeeper, the shop.forsale items should also be present in his inventory
+        if mob.inventory_size < len(mob.shop.forsale):   # type: ignore
+            raise ValueError("shopkeeper %d's inventory missing some shop.forsale items from shop %d" %
+                             (mobref.vnum, mob.shop.circle_vnum))   # type: ignore
+        for item in mob.shop.forsale:  # type: ignore
+            if not any(i for i in mob.inventory if i.title == item.title):
+                raise ValueError("shop.forsale item %d (%s) not in shopkeeper %d's inventory" %
+                                 (item.circle_vnum, item.title, mobref.vnum))
+    return mob
+
+
+def reset_due(zone: ZZone, now: float, occupied_zones: Set[int]) -> bool:
+    """Is it time to reset the (populated) zone?"""
+    if zone.resetmode == "never" or zone.lifespan_minutes <= 0:
+        return False
+    if now - last_reset.get(zone.vnum, now) < zone.lifespan_minutes * 60:
+        return False
+    return zone.resetmode == "asap" or zone.vnum not in occupied_zones
+
+
+def pulse_zone(ctx: Context) -> None:
+    """
+    Called every 10 seconds to handle zone activity: schedules the resets of the zones that are due.
+    When multiple zones are due at the same time, their resets are spread out over the following seconds.
+    """
+    now = time.monotonic()
+    occupied_zones = {getattr(conn.player.location, "circle_zone", None)
+                      for conn in ctx.driver.all_players.values() if conn.player}
+    due = [vnum for vnum in sorted(populated_zones)
+           if vnum not in scheduled_resets and reset_due(zones[vnum], now, occupied_zones)]
+    for delay, vnum in enumerate(due):
+        scheduled_resets.add(vnum)
+        ctx.driver.defer(0.1 + delay * zone_reset_spacing, reset_zone, vnum)
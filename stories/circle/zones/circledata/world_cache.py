@@ -0,0 +1,140 @@
+"""
+Compiled cache of the parsed CircleMUD world data.
+
+Parsing all of the world files takes a good part of the startup time, so the parsed data
+is stored in a binary snapshot file. On the next start that is loaded directly instead,
+as long as the hash of the world files (and of the parsers themselves) is still the same.
+When the world files do have to be parsed, the files are divided over a pool of worker processes.
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import mmap
+import os
+import pickle
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from tale.vfs import VirtualFileSystem
+from . import parse_wld_files, parse_obj_files, parse_mob_files, parse_shp_files, parse_zon_files
+
+
+__all__ = ["load_world", "parse_world", "source_hash"]
+
+
+CACHE_VERSION = 1
+CACHE_HEADER = b"TALE-CIRCLE-WORLD-%d\n" % CACHE_VERSION
+
+# world file kind -> (parser module, name of its dict of parsed data, function that parses them)
+_parsers = {
+    "wld": (parse_wld_files, "_rooms", parse_wld_files.get_rooms),
+    "obj": (parse_obj_files, "_objs", parse_obj_files.get_objs),
+    "mob": (parse_mob_files, "_mobs", parse_mob_files.get_mobs),
+    "shp": (parse_shp_files, "_shops", parse_shp_files.get_shops),
+    "zon": (parse_zon_files, "_zones", parse_zon_files.get_zones)
+}
+
+
+def source_hash(vfs: VirtualFileSystem=None) -> bytes:
+    """The hash of all world files and of the parsers that read them."""
+    vfs = vfs or VirtualFileSystem(root_package="zones.circledata")     # not everythingtext: hash the raw bytes
+    digest = hashlib.sha1(CACHE_HEADER)
+    for kind in sorted(_parsers):
+        module = _parsers[kind][0]
+        with io.open(module.__file__, "rb") as source:
+            digest.update(source.read())   # a changed parser must invalidate the cache as well
+        index = vfs["world/%s/index" % kind].data
+        digest.update(index)
+        for filename in index.decode("ascii").splitlines():
+            if filename == "$":
+                break
+            digest.update(vfs["world/%s/%s" % (kind, filename)].data)
+    return digest.hexdigest().encode("ascii")
+
+
+def read_cache(path: str, digest: bytes) -> Optional[Dict[str, Any]]:
+    """Returns the world data from the cache file, or None if it doesn't exist, is outdated or is unreadable."""
+    header = CACHE_HEADER + digest + b"\n"
+    try:
+        with io.open(path, "rb") as f:
+            with contextlib.closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+                if data[:len(header)] != header:
+                    return None
+                with memoryview(data) as view, view[len(header):] as body:
+                    return pickle.loads(body)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def _parse_file(kind: str, content: str) -> Tuple[List[Any], float]:
+    """Parses a single world file (in a worker process). Returns the parsed records and the time it took."""
+    start = time.perf_counter()
+    parse_file = _parsers[kind][0].parse_file
+    if kind == "zon":
+        records = [parse_file(content)]     # a zone file contains just one zone
+    else:
+        records = parse_file(content.splitlines())
+    return records, time.perf_counter() - start
+
+
+def parse_world(workers: int=None) -> Dict[str, float]:
+    """
+    Parses the world files on a pool of worker processes (as many as there are cpus, by default).
+    The results are put in the parsers' dicts in the same order as the parsers themselves would do that.
+    Returns the time it took to parse each of the world files.
+    """
+    vfs = VirtualFileSystem(root_package="zones.circledata", everythingtext=True)
+    timings = collections.OrderedDict()   # type: Dict[str, float]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        jobs = []
+        for kind in sorted(_parsers):
+            module, name, _ = _parsers[kind]
+            if getattr(module, name):
+                continue   # already parsed
+            for filename in vfs["world/%s/index" % kind].text.splitlines():
+                if filename == "$":
+                    break
+                path = kind + "/" + filename
+                jobs.append((kind, path, executor.submit(_parse_file, kind, vfs["world/" + path].text)))
+        for kind, path, job in jobs:
+            records, timings[path] = job.result()
+            module, name, _ = _parsers[kind]
+            parsed = getattr(module, name)
+            for record in records:
+                parsed[record.vnum if kind == "zon" else record.circle_vnum] = record
+    return timings
+
+
+def load_world(cache: VirtualFileSystem, filename: str="circle_world.cache", workers: int=None) -> bool:
+    """
+    Provides the parsers with the world data from the cache file in the given (writable) vfs, if it is up to date.
+    Otherwise the world files are parsed and a new cache file is written, and False is returned.
+    The parsing is done by parse_world if there's more than one worker (as many as there are cpus, by default).
+    """
+    if all(getattr(module, name) for module, name, _ in _parsers.values()):
+        return True   # already loaded
+    digest = source_hash()
+    world = read_cache(cache.validate_path(filename), digest)
+    if world is None:
+        workers = workers or os.cpu_count() or 1
+        if workers > 1:
+            start = time.perf_counter()
+            timings = parse_world(workers) or {"-": 0.0}
+            slowest = max(timings, key=timings.__getitem__)
+            print("Parsed %d world files on %d processes in %.2f sec (slowest: %s, %.3f sec)." %
+                  (len(timings), workers, time.perf_counter() - start, slowest, timings[slowest]))
+        world = {kind: parse() for kind, (_, _, parse) in _parsers.items()}
+        with cache.open_write_atomic(filename, "application/octet-stream") as out:
+            out.write(CACHE_HEADER + digest + b"\n")
+            pickle.dump(world, out, pickle.HIGHEST_PROTOCOL)
+        return False
+    for kind, (module, name, _) in _parsers.items():
+        parsed = getattr(module, name)
+        if not parsed:
+            parsed.update(world[kind])
+    return True
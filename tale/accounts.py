@@ -5,14 +5,20 @@ Player account code.
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 
+import collections
+import concurrent.futures
+import contextlib
+import copy
 import datetime
 import hashlib
-import random
+import hmac
+import itertools
+import os
 import re
 import sqlite3
-import time
+import threading
 import json
-from typing import Set, Tuple, List, Dict, Any
+from typing import Set, Tuple, List, Dict, Any, Iterator, MutableMapping, Callable
 import serpent
 
 from . import base
@@ -53,17 +59,107 @@ class MudAccounts:
         charstat(account, gender, stat1, stat2,...)
     """
 
-    def __init__(self, databasefile: str) -> None:
+    max_idle_connections = 4    # connections kept open in the pool for reuse
+    cache_size = 500            # number of accounts kept in memory
+    flush_interval = 10.0       # seconds after which the pending login times and story data are written to the database
+    hash_workers = 2            # threads that hash passwords (hashlib releases the GIL while it's hashing)
+    pbkdf2_iterations = 100000
+    scrypt_cost = (2 ** 14, 8, 1)   # n, r, p
+    memorydb_counter = itertools.count(1)
+
+    def __init__(self, databasefile: str, password_hash: str="pbkdf2") -> None:
+        self._hash_params(password_hash)   # check that it's supported
+        self.password_hash = password_hash
         self.sqlite_dbpath = databasefile
+        if databasefile == ":memory:":
+            # every connection to :memory: would get its own empty database, so share a named in-memory database instead
+            self.sqlite_dbpath = "file:tale_accounts_{:d}?mode=memory&cache=shared".format(next(self.memorydb_counter))
+        self._pool = []     # type: List[sqlite3.Connection]
+        self._pool_lock = threading.Lock()
+        # recently used accounts, and the writes that haven't been done yet (write-behind)
+        self._cache = collections.OrderedDict()    # type: MutableMapping[str, Account]
+        self._cache_version = 0     # bumped when cached accounts are invalidated
+        self._pending_logins = {}   # type: Dict[str, datetime.datetime]
+        self._pending_story_data = {}   # type: Dict[str, str]   # serialized story data
+        self._cache_lock = threading.Lock()
+        self._flush_lock = threading.Lock()     # reading accounts from the database waits for a flush that's being written
+        self._flush_timer = None    # type: threading.Timer
+        self._workers = None    # type: concurrent.futures.ThreadPoolExecutor
         self._create_database()
 
-    def _sqlite_connect(self) -> sqlite3.Connection:
+    def _sqlite_open(self) -> sqlite3.Connection:
         urimode = self.sqlite_dbpath.startswith("file:")
-        conn = sqlite3.connect(self.sqlite_dbpath, detect_types=sqlite3.PARSE_DECLTYPES, timeout=5, uri=urimode)
+        # A pooled connection is used by one thread at a time, but not always by the same thread.
+        # The sqlite3 module caches the prepared statements of a connection, so keep the sql strings constant.
+        conn = sqlite3.connect(self.sqlite_dbpath, detect_types=sqlite3.PARSE_DECLTYPES, timeout=5, uri=urimode,
+                               check_same_thread=False, cached_statements=64)
         conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA foreign_keys=ON;")
+        if "mode=memory" not in self.sqlite_dbpath:
+            # readers don't block the writer (and vice versa), and commits don't need to sync the database file
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
         return conn
 
+    @contextlib.contextmanager
+    def _sqlite_connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a database connection from the pool, as a transaction: it's committed at the end,
+        or rolled back if there was an error. The connection returns to the pool afterwards.
+        """
+        with self._pool_lock:
+            conn = self._pool.pop() if self._pool else None
+        if conn is None:
+            conn = self._sqlite_open()
+        try:
+            with conn:
+                yield conn
+        finally:
+            with self._pool_lock:
+                if len(self._pool) < self.max_idle_connections:
+                    self._pool.append(conn)
+                    conn = None
+            if conn:
+                conn.close()
+
+    def submit(self, operation: Callable, *args: Any) -> concurrent.futures.Future:
+        """
+        Run an account operation that hashes a password (valid_password, create, change_password_email)
+        on a worker thread, so that it doesn't hold up the game loop. Returns the Future of the result.
+        A dialog can wait for it with:  result = yield "wait", accounts.submit(...)
+        """
+        with self._pool_lock:
+            if not self._workers:
+                self._workers = concurrent.futures.ThreadPoolExecutor(max_workers=self.hash_workers)
+        return self._workers.submit(operation, *args)
+
+    def close(self) -> None:
+        """
+        Write the pending changes to the database, and close the pooled database connections.
+        If the pending changes can't be written, the connections are still closed and the error is raised.
+        """
+        with self._pool_lock:
+            workers, self._workers = self._workers, None
+        if workers:
+            workers.shutdown()
+        with self._cache_lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        try:
+            self.flush()
+        except sqlite3.Error as x:
+            with self._cache_lock:
+                lost = set(self._pending_logins) | set(self._pending_story_data)
+            print("%s: Error writing to the user accounts database, the changes to these accounts are lost: %s (%r)"
+                  % (mud_context.config.name, ", ".join(sorted(lost)), x))
+            raise
+        finally:
+            with self._pool_lock:
+                pool, self._pool = self._pool, []
+            for conn in pool:
+                conn.close()
+
     def _create_database(self) -> None:
         try:
             with self._sqlite_connect() as conn:
@@ -127,74 +223,144 @@ class MudAccounts:
             print("Error:", repr(x))
             raise SystemExit("Cannot launch mud mode without a user accounts database.")
 
+    # one query for everything of an account: the account itself, its privileges, story data and character stats
+    account_query = """
+        SELECT a.name AS account_name, a.email AS account_email, a.pw_hash AS account_pw_hash, a.pw_salt AS account_pw_salt,
+            a.created AS account_created, a.logged_in AS account_logged_in, a.banned AS account_banned,
+            (SELECT group_concat(p.privilege, ',') FROM Privilege p WHERE p.account=a.id) AS account_privileges,
+            d.format AS account_storydata_format, d.data AS account_storydata, s.*
+        FROM Account a LEFT JOIN StoryData d ON d.account=a.id LEFT JOIN CharStat s ON s.account=a.id """
+
     def get(self, name: str) -> Account:
-        with self._sqlite_connect() as conn:
-            result = conn.execute("SELECT id FROM Account WHERE name=?", (name,)).fetchone()
+        """Returns (a copy of) the account, from the cache if possible"""
+        with self._cache_lock:
+            account = self._cache.get(name)
+            if account:
+                self._cache.move_to_end(name)
+                return copy.deepcopy(account)
+            version = self._cache_version
+        with self._flush_lock, self._sqlite_connect() as conn:
+            result = conn.execute(self.account_query + "WHERE a.name=?", (name,)).fetchone()
             if not result:
                 raise LookupError(name)
-            return self._fetch_account(conn, result["id"])
-
-    def _fetch_account(self, conn: sqlite3.Connection, account_id: int) -> Account:
-        acc = conn.execute("SELECT * FROM Account WHERE id=?", (account_id,)).fetchone()
-        priv_result = conn.execute("SELECT privilege FROM Privilege WHERE account=?", (account_id,)).fetchall()
-        privileges = {pr["privilege"] for pr in priv_result}
-        storydata_result = conn.execute("SELECT format, data FROM StoryData WHERE account=?", (account_id,)).fetchone()
-        if storydata_result:
-            if storydata_result["format"] == "json":
-                storydata = json.loads(storydata_result["data"], encoding="utf-8")
-            elif storydata_result["format"] == "serpent":
-                storydata = serpent.loads(storydata_result["data"])
+            account = self._make_account(result)
+        with self._cache_lock:
+            if version == self._cache_version:
+                self._cache[name] = account
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return copy.deepcopy(account)
+
+    def _invalidate(self, name: str) -> None:
+        with self._cache_lock:
+            self._cache.pop(name, None)
+            self._cache_version += 1
+
+    def _make_account(self, row: sqlite3.Row) -> Account:
+        # (called with the flush lock held, so the pending changes aren't between the dicts and the database)
+        privileges = set(row["account_privileges"].split(",")) if row["account_privileges"] else set()
+        if row["account_storydata_format"]:
+            if row["account_storydata_format"] == "json":
+                storydata = json.loads(row["account_storydata"])
+            elif row["account_storydata_format"] == "serpent":
+                storydata = serpent.loads(row["account_storydata"])
             else:
-                raise ValueError("invalid storydata format in database: " + storydata_result["format"])
+                raise ValueError("invalid storydata format in database: " + row["account_storydata_format"])
             if not isinstance(storydata, dict):
                 raise TypeError("storydata should be a dict")
         else:
             storydata = {}
-        stats_result = dict(conn.execute("SELECT * FROM CharStat WHERE account=?", (account_id,)).fetchone() or {})
-        del stats_result["id"]
-        del stats_result["account"]
         stats = base.Stats()
-        for key, value in stats_result.items():
+        for key in row.keys():
+            if key.startswith("account") or key == "id":
+                continue    # not a stat column
             if hasattr(stats, key):
-                setattr(stats, key, value)
+                setattr(stats, key, row[key])
             else:
                 raise AttributeError("stats doesn't have attribute: " + key)
         stats.set_stats_from_race()   # initialize static stats from races table
-        return Account(acc["name"], acc["email"], acc["pw_hash"], acc["pw_salt"], privileges,
-                       acc["created"], acc["logged_in"], bool(acc["banned"]), stats, storydata)
+        account = Account(row["account_name"], row["account_email"], row["account_pw_hash"], row["account_pw_salt"], privileges,
+                          row["account_created"], row["account_logged_in"], bool(row["account_banned"]), stats, storydata)
+        with self._cache_lock:
+            # the database doesn't have the pending changes yet
+            account.logged_in = self._pending_logins.get(account.name, account.logged_in)
+            if account.name in self._pending_story_data:
+                account.story_data = serpent.loads(self._pending_story_data[account.name])
+        return account
 
     def all_accounts(self, having_privilege: str=None) -> List[Account]:
-        with self._sqlite_connect() as conn:
+        with self._flush_lock, self._sqlite_connect() as conn:
             if having_privilege:
-                result = conn.execute("SELECT a.id FROM Account a INNER JOIN Privilege p ON p.account=a.id AND p.privilege=? "
-                                      "ORDER BY a.name",  (having_privilege,)).fetchall()
+                result = conn.execute(self.account_query + "WHERE a.id IN (SELECT account FROM Privilege WHERE privilege=?) "
+                                      "ORDER BY a.name", (having_privilege,)).fetchall()
             else:
-                result = conn.execute("SELECT id FROM Account ORDER BY name").fetchall()
-            account_ids = [ar["id"] for ar in result]
-            accounts = [self._fetch_account(conn, account_id) for account_id in account_ids]
-            return accounts
+                result = conn.execute(self.account_query + "ORDER BY a.name").fetchall()
+            return [self._make_account(row) for row in result]
 
     def logged_in(self, name: str) -> None:
         timestamp = datetime.datetime.now().replace(microsecond=0)
-        with self._sqlite_connect() as conn:
-            conn.execute("UPDATE Account SET logged_in=? WHERE name=?", (timestamp, name))
+        with self._cache_lock:
+            self._pending_logins[name] = timestamp
+            if name in self._cache:
+                self._cache[name].logged_in = timestamp
+            self._schedule_flush()
 
     def valid_password(self, name: str, password: str) -> None:
-        with self._sqlite_connect() as conn:
-            result = conn.execute("SELECT pw_hash, pw_salt FROM Account WHERE name=?", (name,)).fetchone()
-        if result:
-            stored_hash, stored_salt = result["pw_hash"], result["pw_salt"]
-            pwhash, _ = self._pwhash(password, stored_salt)
-            if pwhash == stored_hash:
+        try:
+            account = self.get(name)
+        except LookupError:
+            pass
+        else:
+            method, params = self._parse_pwhash(account.pw_hash)
+            if hmac.compare_digest(self._compute_pwhash(password, account.pw_salt, method, params), account.pw_hash):
+                if (method, params) != (self.password_hash, self._hash_params(self.password_hash)):
+                    # the password was hashed with an older (or weaker) method, replace it now that we know the password
+                    pwhash, salt = self._pwhash(password, method=self.password_hash)
+                    with self._sqlite_connect() as conn:
+                        conn.execute("UPDATE Account SET pw_hash=?, pw_salt=? WHERE name=?", (pwhash, salt, name))
+                    self._invalidate(name)
                 return
         raise ValueError("Invalid name or password.")
 
-    @staticmethod
-    def _pwhash(password: str, salt: str=None) -> Tuple[str, str]:
+    @classmethod
+    def _pwhash(cls, password: str, salt: str=None, method: str="pbkdf2") -> Tuple[str, str]:
         if not salt:
-            salt = str(random.random() * time.time() + id(password)).replace('.', '')
-        pwhash = hashlib.sha1((salt + password).encode("utf-8")).hexdigest()
-        return pwhash, salt
+            salt = os.urandom(16).hex()
+        return cls._compute_pwhash(password, salt, method, cls._hash_params(method)), salt
+
+    @classmethod
+    def _hash_params(cls, method: str) -> Tuple[int, ...]:
+        if method == "pbkdf2":
+            return (cls.pbkdf2_iterations,)
+        elif method == "scrypt":
+            if not hasattr(hashlib, "scrypt"):
+                raise ValueError("scrypt password hashing is not available on this system")
+            return cls.scrypt_cost
+        elif method == "sha1":
+            return ()
+        raise ValueError("invalid password hash method: " + method)
+
+    @staticmethod
+    def _compute_pwhash(password: str, salt: str, method: str, params: Tuple[int, ...]) -> str:
+        # the stored hash is method$param$param...$hexdigest, except for the original salted sha1 hashes
+        password_bytes, salt_bytes = password.encode("utf-8"), salt.encode("utf-8")
+        if method == "sha1":
+            return hashlib.sha1(salt_bytes + password_bytes).hexdigest()
+        elif method == "pbkdf2":
+            digest = hashlib.pbkdf2_hmac("sha256", password_bytes, salt_bytes, params[0])
+        elif method == "scrypt":
+            n, r, p = params
+            digest = hashlib.scrypt(password_bytes, salt=salt_bytes, n=n, r=r, p=p)     # type: ignore
+        else:
+            raise ValueError("invalid password hash method: " + method)
+        return "$".join([method] + [str(param) for param in params] + [digest.hex()])
+
+    @staticmethod
+    def _parse_pwhash(pwhash: str) -> Tuple[str, Tuple[int, ...]]:
+        if "$" not in pwhash:
+            return "sha1", ()
+        method, *params = pwhash.split("$")[:-1]
+        return method, tuple(int(param) for param in params)
 
     @staticmethod
     def accept_password(password: str) -> str:
@@ -236,7 +402,7 @@ class MudAccounts:
         for p in privileges:
             self.accept_privilege(p)
         created = datetime.datetime.now().replace(microsecond=0)
-        pwhash, salt = self._pwhash(password)
+        pwhash, salt = self._pwhash(password, method=self.password_hash)
         with self._sqlite_connect() as conn:
             result = conn.execute("SELECT COUNT(*) FROM Account WHERE name=?", (name,)).fetchone()[0]
             if result > 0:
@@ -273,24 +439,73 @@ class MudAccounts:
                 raise LookupError("Unknown name.")
             account_id = result["id"]
             if new_password:
-                pwhash, salt = self._pwhash(new_password)
+                pwhash, salt = self._pwhash(new_password, method=self.password_hash)
                 conn.execute("UPDATE Account SET pw_hash=?, pw_salt=? WHERE id=?", (pwhash, salt, account_id))
             if new_email:
                 conn.execute("UPDATE Account SET email=? WHERE id=?", (new_email, account_id))
+        self._invalidate(name)
 
     def save_story_data(self, name: str, story_data: Dict[Any, Any]) -> None:
         if not isinstance(story_data, dict):
             raise TypeError("story data should be a dict")
-        with self._sqlite_connect() as conn:
-            result = conn.execute("SELECT id FROM Account WHERE name=?", (name,)).fetchone()
-            if not result:
-                raise LookupError("Unknown name.")
-            account_id = result["id"]
-            data = serpent.dumps(story_data)
-            result = conn.execute("UPDATE StoryData SET format=?, data=? WHERE id=?", ("serpent", data, account_id))
-            if result.rowcount == 0:
-                # there's no storydata yet, insert it
-                conn.execute("INSERT INTO StoryData(account, format, data) VALUES (?,?,?)", (account_id, "serpent", data))
+        self.get(name)   # raises LookupError if the account doesn't exist
+        data = serpent.dumps(story_data)
+        with self._cache_lock:
+            self._pending_story_data[name] = data
+            if name in self._cache:
+                self._cache[name].story_data = serpent.loads(data)
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        # (called with the cache lock held)
+        if not self._flush_timer:
+            self._flush_timer = threading.Timer(self.flush_interval, self._flush_timer_expired)
+            self._flush_timer.name = "accounts-flush"
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_timer_expired(self) -> None:
+        with self._cache_lock:
+            self._flush_timer = None
+        try:
+            self.flush()
+        except sqlite3.Error as x:
+            print("%s: Error writing to the user accounts database (will retry): %r" % (mud_context.config.name, x))
+            with self._cache_lock:
+                self._schedule_flush()
+
+    def flush(self) -> None:
+        """
+        Write the pending login times and story data to the database, in a single transaction.
+        Accounts aren't read from the database meanwhile, because they would miss the changes that are being written.
+        """
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._cache_lock:
+            logins, self._pending_logins = self._pending_logins, {}
+            story_data, self._pending_story_data = self._pending_story_data, {}
+        if not logins and not story_data:
+            return
+        try:
+            with self._sqlite_connect() as conn:
+                conn.executemany("UPDATE Account SET logged_in=? WHERE name=?", [(ts, name) for name, ts in logins.items()])
+                for name, data in story_data.items():
+                    result = conn.execute("UPDATE StoryData SET format=?, data=? WHERE account=(SELECT id FROM Account WHERE name=?)",
+                                          ("serpent", data, name))
+                    if result.rowcount == 0:
+                        # there's no storydata yet, insert it
+                        conn.execute("INSERT INTO StoryData(account, format, data) SELECT id, ?, ? FROM Account WHERE name=?",
+                                     ("serpent", data, name))
+        except sqlite3.Error:
+            with self._cache_lock:
+                # keep them for the next attempt, unless they've been changed again meanwhile
+                for name, ts in logins.items():
+                    self._pending_logins.setdefault(name, ts)
+                for name, data in story_data.items():
+                    self._pending_story_data.setdefault(name, data)
+            raise
 
     @util.authorized("wizard")
     def update_privileges(self, name: str, privileges: Set[str], actor: player.Player) -> Set[str]:
@@ -305,6 +520,7 @@ class MudAccounts:
             conn.execute("DELETE FROM Privilege WHERE account=?", (account_id,))
             for privilege in privileges:
                 conn.execute("INSERT INTO Privilege(account, privilege) VALUES (?,?)", (account_id, privilege))
+        self._invalidate(name)
         return privileges
 
     @util.authorized("wizard")
@@ -313,6 +529,7 @@ class MudAccounts:
             updated = conn.execute("UPDATE Account SET banned=1 WHERE name=?", (name,)).rowcount
             if updated == 0:
                 raise LookupError("Unknown name.")
+        self._invalidate(name)
 
     @util.authorized("wizard")
     def unban(self, name: str, actor: player.Player) -> None:
@@ -320,6 +537,7 @@ class MudAccounts:
             updated = conn.execute("UPDATE Account SET banned=0 WHERE name=?", (name,)).rowcount
             if updated == 0:
                 raise LookupError("Unknown name.")
+        self._invalidate(name)
 
     blocked_names = """irmen
 me
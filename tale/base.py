@@ -39,11 +39,12 @@ import builtins
 import copy
 import random
 import re
-from weakref import WeakValueDictionary
-from collections import defaultdict, OrderedDict
+from weakref import WeakValueDictionary, WeakKeyDictionary, WeakSet
+from collections import defaultdict, OrderedDict, ChainMap
+from collections.abc import Mapping
 from textwrap import dedent
 from types import ModuleType
-from typing import Iterable, Any, Sequence, Optional, Set, Dict, Union, FrozenSet, Tuple, List, Type, no_type_check
+from typing import Iterable, Any, Sequence, Optional, Set, Dict, Union, FrozenSet, Tuple, List, Type, Iterator, Callable, no_type_check
 
 from . import lang
 from . import mud_context
@@ -164,6 +165,10 @@ class MudObjRegistry:
     all_livings = WeakValueDictionary()     # type: WeakValueDictionary[int, Living]
     all_locations = WeakValueDictionary()   # type: WeakValueDictionary[int, Location]
     all_exits = WeakValueDictionary()       # type: WeakValueDictionary[int, Exit]
+    wiretapped = WeakValueDictionary()      # type: WeakValueDictionary[int, Union[Location, Living]]   # objects that have a wiretap topic
+    # secondary indexes of the objects that exist (and haven't been destroyed), kept up to date by track_vnum and forget:
+    by_class = WeakKeyDictionary()          # type: WeakKeyDictionary[type, WeakSet[MudObject]]   # doesn't keep (story) classes alive
+    by_prototype = defaultdict(WeakSet)     # type: Dict[Tuple[type, Any], WeakSet[MudObject]]   # (base class, prototype) -> objects
 
     @staticmethod
     def track_vnum(instance: Any, fix_clones: bool=False):
@@ -180,6 +185,10 @@ class MudObjRegistry:
             MudObjRegistry.all_locations[instance.vnum] = instance    # type: ignore
         else:
             raise TypeError("weird MudObj subtype: " + str(type(instance)))
+        MudObjRegistry.by_class.setdefault(type(instance), WeakSet()).add(instance)
+        prototype = instance.__dict__.get("_prototype")    # a clone is made from the same prototype as the original
+        if prototype is not None:
+            MudObjRegistry.by_prototype[(MudObjRegistry.base_class(instance), prototype)].add(instance)
         if fix_clones:
             # the 'clone' command consumes too many vnums because of the way deepcopy works.
             # try to find the double registration and remove it.
@@ -201,6 +210,75 @@ class MudObjRegistry:
                         if existing is instance:
                             del MudObjRegistry.all_locations[pid]
 
+    @staticmethod
+    def base_class(instance: Any) -> type:
+        """The base class (Item, Living, Exit or Location) of the object, prototypes are unique per base class."""
+        for base_class in (Item, Living, Exit, Location):
+            if isinstance(instance, base_class):
+                return base_class
+        raise TypeError("weird MudObj subtype: " + str(type(instance)))
+
+    @staticmethod
+    def set_prototype(instance: 'MudObject', prototype: Any) -> None:
+        """Record the prototype the object was made from (use its prototype property for this)."""
+        base_class = MudObjRegistry.base_class(instance)
+        previous = instance.__dict__.get("_prototype")
+        if previous is not None:
+            MudObjRegistry.by_prototype[(base_class, previous)].discard(instance)
+        instance._prototype = prototype
+        if prototype is not None:
+            MudObjRegistry.by_prototype[(base_class, prototype)].add(instance)
+
+    @staticmethod
+    def forget(instance: 'MudObject') -> None:
+        """Remove a destroyed object from the secondary indexes, so it is no longer counted (even if it isn't garbage yet)."""
+        MudObjRegistry.by_class.get(type(instance), set()).discard(instance)
+        prototype = instance.__dict__.get("_prototype")
+        if prototype is not None:
+            MudObjRegistry.by_prototype[(MudObjRegistry.base_class(instance), prototype)].discard(instance)
+
+    @staticmethod
+    def count(base_class: type, prototype: Any) -> int:
+        """The number of objects of the base class (Item, Living...) that were made from the given prototype."""
+        instances = MudObjRegistry.by_prototype.get((base_class, prototype))
+        return len(instances) if instances else 0
+
+    @staticmethod
+    def instances(base_class: type, prototype: Any) -> List['MudObject']:
+        """The objects of the base class (Item, Living...) that were made from the given prototype."""
+        return list(MudObjRegistry.by_prototype.get((base_class, prototype), ()))
+
+    @staticmethod
+    def count_class(cls: type, subclasses: bool=False) -> int:
+        """The number of objects of exactly the given class (or including its subclasses)."""
+        if subclasses:
+            return sum(len(instances) for c, instances in list(MudObjRegistry.by_class.items()) if issubclass(c, cls))
+        instances = MudObjRegistry.by_class.get(cls)
+        return len(instances) if instances else 0
+
+    @staticmethod
+    def instances_of_class(cls: type, subclasses: bool=False) -> List['MudObject']:
+        """The objects of exactly the given class (or including its subclasses)."""
+        if subclasses:
+            return [obj for c, instances in list(MudObjRegistry.by_class.items()) if issubclass(c, cls) for obj in instances]
+        return list(MudObjRegistry.by_class.get(cls, ()))
+
+    @staticmethod
+    def whereabouts(base_class: type, prototype: Any) -> Dict[Optional['Location'], List['MudObject']]:
+        """
+        Where the objects that were made from the prototype are: location -> objects.
+        The location of an item is the location of whoever or whatever contains it.
+        """
+        result = defaultdict(list)  # type: Dict[Optional[Location], List[MudObject]]
+        for obj in MudObjRegistry.instances(base_class, prototype):
+            if isinstance(obj, Location):
+                result[obj].append(obj)
+            elif isinstance(obj, Exit):
+                result[None].append(obj)
+            else:
+                result[obj.location].append(obj)     # type: ignore
+        return result
+
     @classmethod
     @no_type_check
     def create_object(cls, objclass: Type, *vargs, **kwargs) -> Any:
@@ -234,6 +312,59 @@ class MudObjRegistry:
             return objclass(*vargs, **kwargs)
 
 
+class NameIndex(Mapping):
+    """
+    Lookup of the objects in a container by their name and by each of their aliases.
+    The container keeps it up to date when objects are inserted or removed, and objects
+    notify their container when their name or aliases change (by assigning, not mutating, the aliases set).
+    If multiple objects share a name, the one that was indexed last is found.
+    """
+    def __init__(self) -> None:
+        self.names = {}   # type: Dict[str, List[MudObject]]
+        self.keys_of = {}   # type: Dict[MudObject, Tuple[str, ...]]
+
+    def __getitem__(self, name: str) -> 'MudObject':
+        return self.names[name][-1]
+
+    def __contains__(self, name: Any) -> bool:
+        return name in self.names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, obj: 'MudObject') -> None:
+        if obj in self.keys_of:
+            self.remove(obj)
+        keys = tuple({obj.name}.union(obj.aliases))
+        self.keys_of[obj] = keys
+        for key in keys:
+            self.names.setdefault(key, []).append(obj)
+
+    def remove(self, obj: 'MudObject') -> None:
+        for key in self.keys_of.pop(obj, ()):
+            objects = self.names[key]
+            objects.remove(obj)
+            if not objects:
+                del self.names[key]
+
+    def update(self, obj: 'MudObject') -> None:
+        """re-index an object that changed its names (ignored if it is not in the index)"""
+        if obj in self.keys_of:
+            self.add(obj)
+
+    def rebuild(self, objects: Iterable['MudObject']) -> None:
+        self.clear()
+        for obj in objects:
+            self.add(obj)
+
+    def clear(self) -> None:
+        self.names.clear()
+        self.keys_of.clear()
+
+
 class MudObject:
     """
     Root class of all objects in the mud world
@@ -266,10 +397,11 @@ class MudObject:
 
     def __init__(self, name: str, title: str = None, *, descr: str = None, short_descr: str = None) -> None:
         self._extradesc = None  # type: Dict[str,str]
+        self._aliases = set()  # type: Set[str]
         self.name = self._description = self._title = self._short_description = None  # type: str
         self.init_names(name, title, descr, short_descr)
-        self.aliases = set()  # type: Set[str]
         # any custom verbs that need to be recognised (verb->docstring mapping), verb handling is done via handle_verb() callbacks.
+        # (assign a new dict to change them on an object that's already placed somewhere, so the driver notices the change)
         self.verbs = {}  # type: Dict[str, str]
         # register all periodical tagged methods
         self.story_data = {}  # type: Dict[Any, Any]   # not used by Tale itself, story can put custom data here. Use builtin types only.
@@ -284,6 +416,18 @@ class MudObject:
         """
         pass
 
+    @property
+    def prototype(self) -> Any:
+        """
+        The template this object was made from, for instance the object number in a zone file, or None.
+        All objects made from the same prototype can be found and counted via the MudObjRegistry.
+        """
+        return self.__dict__.get("_prototype")
+
+    @prototype.setter
+    def prototype(self, prototype: Any) -> None:
+        MudObjRegistry.set_prototype(self, prototype)
+
     @property
     def title(self) -> str:
         return self._title
@@ -326,6 +470,33 @@ class MudObject:
         self._description = dedent(descr).strip() if descr else ""
         self._short_description = short_descr.strip() if short_descr else ""
         self._extradesc = {}   # maps keyword to description
+        self._names_changed()
+
+    @property
+    def aliases(self) -> Set[str]:
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, value: Set[str]) -> None:
+        self._aliases = value
+        self._names_changed()
+
+    def _names_changed(self) -> None:
+        """the name or the aliases changed, the container holding the object should update its name index"""
+        pass
+
+    @property
+    def verbs(self) -> Dict[str, str]:
+        return self._verbs
+
+    @verbs.setter
+    def verbs(self, value: Dict[str, str]) -> None:
+        self._verbs = value
+        self._verbs_changed()
+
+    def _verbs_changed(self) -> None:
+        """the custom verbs changed, the container holding the object should invalidate its cached verbs"""
+        pass
 
     def _check_title(self, title: str) -> None:
         w = title.partition(" ")[0].lower()
@@ -344,6 +515,8 @@ class MudObject:
         """Common cleanup code that needs to be called when the object is destroyed"""
         assert isinstance(ctx, util.Context)
         mud_context.driver.remove_deferreds(self)
+        mud_context.driver.remove_behaviors(self)
+        MudObjRegistry.forget(self)
 
     def wiz_clone(self, actor: 'Living') -> 'MudObject':
         """clone the thing (performed by a wizard)"""
@@ -431,6 +604,18 @@ class Item(MudObject):
     def __contains__(self, item: 'Item') -> bool:
         raise ActionRefused("You can't look inside of that.")
 
+    def _names_changed(self) -> None:
+        if isinstance(self.contained_in, Location):
+            self.contained_in._item_names.update(self)
+        elif isinstance(self.contained_in, Living):
+            self.contained_in._inventory_names.update(self)
+
+    def _verbs_changed(self) -> None:
+        if isinstance(self.contained_in, Location):
+            self.contained_in._verbs_version += 1
+        elif isinstance(self.contained_in, Living):
+            self.contained_in._inventory_verbs = None
+
     @property
     def location(self) -> Optional['Location']:
         if not self.contained_in:
@@ -589,15 +774,53 @@ class Location(MudObject):
     """
     def __init__(self, name: str, descr: str=None) -> None:
         self.name = name
+        self._living_names = NameIndex()   # the livings by name and alias (for the parser)
+        self._item_names = NameIndex()     # the items by name and alias (for the parser)
+        self._verbs_version = 0   # bumped whenever the custom verbs available in this location might have changed
+        self._custom_verbs = (-1, frozenset())   # type: Tuple[int, FrozenSet[str]]  # (version, verbs) cache
         self.livings = set()  # type: Set[Living] # set of livings in this location
         self.items = set()    # type: Set[Item] # set of all items in the room
         self.exits = {}       # type: Dict[str, Exit] # dictionary of all exits: exit_direction -> Exit object with target & descr
+        self._wiretap = None  # type: pubsub.Topic  # only exists while someone is (or was recently) tapping this location
+        self._lazy_loader = None   # type: Callable[[Location], None]  # set while (the state of) this location isn't loaded yet
         super().__init__(name, descr=descr)
         self.name = name      # make sure we preserve the case; base object overwrites it in lowercase
 
     def __contains__(self, obj: Union['Living', Item]) -> bool:
         return obj in self.livings or obj in self.items
 
+    @property
+    def livings(self) -> Set['Living']:
+        return self._livings
+
+    @livings.setter
+    def livings(self, value: Set['Living']) -> None:
+        # replacing the whole set is allowed, but to add or remove a single living, use insert() and remove()
+        self._livings = value
+        self._living_names.rebuild(value)
+        self._verbs_version += 1
+
+    @property
+    def items(self) -> Set[Item]:
+        return self._items
+
+    @items.setter
+    def items(self, value: Set[Item]) -> None:
+        # replacing the whole set is allowed, but to add or remove a single item, use insert() and remove()
+        self._items = value
+        self._item_names.rebuild(value)
+        self._verbs_version += 1
+
+    def materialize(self) -> None:
+        """
+        Apply the saved state of this location (and the things in it), if loading it was postponed when a game was loaded,
+        or let the story create the location's contents if it does that on demand (the _lazy_loader is called for this).
+        This happens automatically when something enters or leaves, or when it becomes part of the active region.
+        """
+        loader, self._lazy_loader = self._lazy_loader, None
+        if loader:
+            loader(self)
+
     def init_inventory(self, objects: Iterable[Union[Item, 'Living']]) -> None:
         """Set the location's initial item and livings 'inventory'"""
         if len(self.items) > 0 or len(self.livings) > 0:
@@ -612,7 +835,31 @@ class Location(MudObject):
                 living.location = _limbo
         self.livings.clear()
         self.items.clear()
+        self._living_names.clear()
+        self._item_names.clear()
         self.exits.clear()
+        self._verbs_version += 1
+
+    def _verbs_changed(self) -> None:
+        self._verbs_version += 1
+
+    def custom_verbs(self) -> FrozenSet[str]:
+        """
+        The custom verbs of this location and of the livings, items and exits in it (not those of items carried by livings).
+        The result is cached until something enters or leaves the location or the verbs of one of those are replaced.
+        """
+        version, verbs = self._custom_verbs
+        if version != self._verbs_version:
+            all_verbs = set(self.verbs)
+            for living in self.livings:
+                all_verbs.update(living.verbs)
+            for item in self.items:
+                all_verbs.update(item.verbs)
+            for exit in self.exits.values():
+                all_verbs.update(exit.verbs)
+            verbs = frozenset(all_verbs)
+            self._custom_verbs = (self._verbs_version, verbs)
+        return verbs
 
     def add_exits(self, exits: Iterable['Exit']) -> None:
         """Adds every exit from the sequence as an exit to this room."""
@@ -622,8 +869,18 @@ class Location(MudObject):
             # the exit may have aliases defined that it wants to be known as also.
 
     def get_wiretap(self) -> pubsub.Topic:
-        """get a wiretap for this location"""
-        return pubsub.topic(("wiretap-location", "%s#%d" % (self.name, self.vnum)))  # type: ignore
+        """get a wiretap for this location (the topic is only created when someone asks for it)"""
+        if self._wiretap is None:
+            self._wiretap = pubsub.topic(("wiretap-location", "%s#%d" % (self.name, self.vnum)))  # type: ignore
+            MudObjRegistry.wiretapped[self.vnum] = self
+        return self._wiretap
+
+    def drop_wiretap(self) -> None:
+        """remove the wiretap topic of this location, if it has one"""
+        if self._wiretap is not None:
+            self._wiretap.destroy()
+            self._wiretap = None
+            MudObjRegistry.wiretapped.pop(self.vnum, None)
 
     def tell(self, room_msg: str, exclude_living: 'Living'=None, specific_targets: Set[Union[ParsedWhoType]]=None,
              specific_target_msg: str="") -> None:
@@ -643,9 +900,8 @@ class Location(MudObject):
                 living.tell(specific_target_msg)
             else:
                 living.tell(room_msg)
-        if room_msg:
-            tap = self.get_wiretap()
-            tap.send((self.name, room_msg))
+        if room_msg and self._wiretap is not None and self._wiretap.subscribers:
+            self._wiretap.send((self.name, room_msg))
 
     def message_nearby_locations(self, message: str) -> None:
         """
@@ -759,24 +1015,34 @@ class Location(MudObject):
     def insert(self, obj: Union['Living', Item], actor: Optional['Living']) -> None:
         """Add item to the contents of the location (either a Living or an Item)"""
         assert obj is not None
+        if self._lazy_loader:
+            self.materialize()
         if isinstance(obj, Living):
             self.livings.add(obj)
+            self._living_names.add(obj)
         elif isinstance(obj, Item):
             self.items.add(obj)
+            self._item_names.add(obj)
         else:
             raise TypeError("can only add Living or Item")
         obj.location = self
+        self._verbs_version += 1
 
     def remove(self, obj: Union['Living', Item], actor: Optional['Living']) -> None:
         """Remove obj from this location (either a Living or an Item)"""
         assert obj is not None
+        if self._lazy_loader:
+            self.materialize()
         if obj in self.livings:
             self.livings.remove(obj)  # type: ignore
+            self._living_names.remove(obj)
         elif obj in self.items:
             self.items.remove(obj)    # type: ignore
+            self._item_names.remove(obj)
         else:
             return   # just ignore an object that wasn't present in the first place
         obj.location = None
+        self._verbs_version += 1
 
     def handle_verb(self, parsed: ParseResult, actor: 'Living') -> bool:
         """
@@ -931,11 +1197,14 @@ class Living(MudObject):
         self.init_gender(gender)
         self.soul = Soul()
         self.location = _limbo  # type: Location  # set transitional location
+        self._wiretap = None  # type: pubsub.Topic  # only exists while someone is (or was recently) tapping this living
         self.privileges = set()  # type: Set[str] # probably only used for Players though
         self.aggressive = False
         self.money = 0.0  # the currency is determined by util.MoneyFormatter set in the driver
         self.default_verb = "examine"
         self.__inventory = set()   # type: Set[Item]
+        self._inventory_names = NameIndex()   # the inventory by name and alias (for the parser)
+        self._inventory_verbs = None   # type: FrozenSet[str]   # cached custom verbs of the carried items
         self.previous_commandline = None   # type: str
         self._previous_parse = None  # type: ParseResult
         self.teleported_from = None   # type: Location   # used by teleport/return commands
@@ -957,6 +1226,23 @@ class Living(MudObject):
         for item in items:
             self.insert(item, self)
 
+    def _names_changed(self) -> None:
+        if self.location:
+            self.location._living_names.update(self)
+
+    def _verbs_changed(self) -> None:
+        if self.location:
+            self.location._verbs_version += 1
+
+    def inventory_verbs(self) -> FrozenSet[str]:
+        """The custom verbs of the items this living carries (cached until the inventory changes)"""
+        if self._inventory_verbs is None:
+            verbs = set()   # type: Set[str]
+            for item in self.__inventory:
+                verbs.update(item.verbs)
+            self._inventory_verbs = frozenset(verbs)
+        return self._inventory_verbs
+
     def __contains__(self, item: Union['Living', Item, Location]) -> bool:
         return item in self.__inventory
 
@@ -983,6 +1269,8 @@ class Living(MudObject):
                     raise ActionRefused("It's probably not a good idea to give things to %s." % self.title)
                 raise
         self.__inventory.add(item)
+        self._inventory_names.add(item)
+        self._inventory_verbs = None
         item.contained_in = self
 
     def remove(self, item: Union['Living', Item], actor: Optional['Living']) -> None:
@@ -992,18 +1280,32 @@ class Living(MudObject):
             raise ActionRefused("You can't do that.")
         if actor is self or actor is not None and "wizard" in actor.privileges:
             self.__inventory.remove(item)
+            self._inventory_names.remove(item)
+            self._inventory_verbs = None
             item.contained_in = None
         else:
             raise ActionRefused("You can't take %s from %s." % (item.title, self.title))
 
+    def fast_forward(self, inactive_time: float, ctx: util.Context) -> None:
+        """
+        Called when a player comes near again, after this living has been outside of the driver's active region
+        (where its batched behaviors were suspended) for the given number of seconds.
+        Override this to cheaply catch up on what the living would have done meanwhile. The default does nothing.
+        """
+        pass
+
     def destroy(self, ctx: util.Context) -> None:
         super().destroy(ctx)
         if self.location and self in self.location.livings:
             self.location.livings.remove(self)
+            self.location._living_names.remove(self)
+            self.location._verbs_version += 1
         self.location = None
         for item in self.__inventory:
             item.destroy(ctx)
         self.__inventory.clear()
+        self._inventory_names.clear()
+        self._inventory_verbs = None
         # @todo: remove attack status, etc.
         self.soul = None   # truly die ;-)
 
@@ -1012,8 +1314,10 @@ class Living(MudObject):
         if make_clone:
             # avoid deepcopying the location
             location, self.location = self.location, None
+            wiretap, self._wiretap = self._wiretap, None
             duplicate = copy.deepcopy(self)
             self.location = location
+            self._wiretap = wiretap
             MudObjRegistry.track_vnum(duplicate, fix_clones=True)   # deepcopy overwrites initially given vnum so make a new one
             mud_context.driver.register_periodicals(duplicate)
         else:
@@ -1044,8 +1348,18 @@ class Living(MudObject):
             actor.tell("Money in possession: %s." % ctx.driver.moneyfmt.display(self.money))
 
     def get_wiretap(self) -> pubsub.Topic:
-        """get a wiretap for this living"""
-        return pubsub.topic(("wiretap-living", "%s#%d" % (self.name, self.vnum)))  # type: ignore
+        """get a wiretap for this living (the topic is only created when someone asks for it)"""
+        if self._wiretap is None:
+            self._wiretap = pubsub.topic(("wiretap-living", "%s#%d" % (self.name, self.vnum)))  # type: ignore
+            MudObjRegistry.wiretapped[self.vnum] = self
+        return self._wiretap
+
+    def drop_wiretap(self) -> None:
+        """remove the wiretap topic of this living, if it has one"""
+        if self._wiretap is not None:
+            self._wiretap.destroy()
+            self._wiretap = None
+            MudObjRegistry.wiretapped.pop(self.vnum, None)
 
     def tell(self, message: str, *, end: bool=False, format: bool=True) -> 'Living':
         """
@@ -1061,8 +1375,8 @@ class Living(MudObject):
         Note: end and format parameters are ignored for Livings but may be
         useful when this function is called on a subclass such as Player.
         """
-        tap = self.get_wiretap()
-        tap.send((self.name, str(message)))
+        if self._wiretap is not None and self._wiretap.subscribers:
+            self._wiretap.send((self.name, str(message)))
         return self
 
     def tell_later(self, message: str) -> None:
@@ -1471,6 +1785,7 @@ class Exit(MudObject):
             direction = directions[0]
             aliases = set(directions[1:])
         self.target = None  # type: Location
+        self._origins = WeakSet()   # type: WeakSet[Location]  # the locations the exit is bound to
         if isinstance(target_location, Location):
             self.target = target_location
             self._target_str = ""
@@ -1520,6 +1835,12 @@ class Exit(MudObject):
             if direction in location.exits:
                 raise LocationIntegrityError("exit already exists: '%s' in %s" % (direction, location), direction, self, location)
             location.exits[direction] = self
+        self._origins.add(location)
+        location._verbs_version += 1
+
+    def _verbs_changed(self) -> None:
+        for location in getattr(self, "_origins", ()):
+            location._verbs_version += 1
 
     def _bind_target(self, game_zones_module: ModuleType) -> None:
         """
@@ -1619,7 +1940,9 @@ class Door(Exit):
             status += "and locked."
         else:
             status += "and unlocked."
-        return self.__description_prefix + " " + status
+        if self.__description_prefix:
+            return self.__description_prefix + " " + status
+        return status
 
     @description.setter
     def description(self, value: str) -> None:
@@ -2024,20 +2347,9 @@ class Soul:
             unparsed = unparsed[len(verb):].lstrip()
         include_flag = True
         collect_message = False
-        all_livings = {}  # livings in the room (including player) by name + aliases
-        all_items = {}  # all items in the room or player's inventory, by name + aliases
-        for living in player.location.livings:
-            all_livings[living.name] = living
-            for alias in living.aliases:
-                all_livings[alias] = living
-        for item in player.location.items:
-            all_items[item.name] = item
-            for alias in item.aliases:
-                all_items[alias] = item
-        for item in player.inventory:
-            all_items[item.name] = item
-            for alias in item.aliases:
-                all_items[alias] = item
+        all_livings = player.location._living_names  # livings in the room (including player) by name + aliases
+        # items in the player's inventory or the room, by name + aliases
+        all_items = ChainMap(player._inventory_names, player.location._item_names)
         previous_word = None
         words_enumerator = enumerate(words)
         for index, word in words_enumerator:
@@ -2302,8 +2614,8 @@ class Soul:
             return False
         return True
 
-    def check_name_with_spaces(self, words: Sequence[str], startindex: int, all_livings: Dict[str, Living],
-                               all_items: Dict[str, Item], all_exits: Dict[str, Exit]) \
+    def check_name_with_spaces(self, words: Sequence[str], startindex: int, all_livings: Mapping[str, Living],
+                               all_items: Mapping[str, Item], all_exits: Mapping[str, Exit]) \
             -> Tuple[Optional[ParsedWhoType], Optional[str], int]:
         """
         Searches for a name used in sentence where the name consists of multiple words (separated by space).
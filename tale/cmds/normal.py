@@ -1656,7 +1656,9 @@ def do_change_pw(player: Player, parsed: base.ParseResult, ctx: util.Context) ->
     current_pw = yield "input-noecho", "Type your current password."
     new_pw = yield "input-noecho", ("Type your new password.", MudAccounts.accept_password)
     try:
-        ctx.driver.mud_accounts.change_password_email(player.name, current_pw, new_password=new_pw)
+        accounts = ctx.driver.mud_accounts
+        changed = yield "wait", accounts.submit(accounts.change_password_email, player.name, current_pw, new_pw)
+        changed.result()
         player.tell("Password updated.")
     except ValueError as x:
         raise ActionRefused("<it>%s</it>" % x)
@@ -1671,7 +1673,9 @@ def do_change_email(player: Player, parsed: base.ParseResult, ctx: util.Context)
     current_pw = yield "input-noecho", "Type your current password."
     new_email = yield "input", ("Type your new email address.", MudAccounts.accept_email)
     try:
-        ctx.driver.mud_accounts.change_password_email(player.name, current_pw, new_email=new_email)
+        accounts = ctx.driver.mud_accounts
+        changed = yield "wait", accounts.submit(accounts.change_password_email, player.name, current_pw, None, new_email)
+        changed.result()
         player.tell("Email address updated.")
     except ValueError as x:
         raise ActionRefused("<it>%s</it>" % x)
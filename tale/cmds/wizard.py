@@ -9,6 +9,7 @@ import datetime
 import gc
 import importlib
 import inspect
+import itertools
 import os
 import platform
 import sys
@@ -462,6 +463,11 @@ def do_server(player: Player, parsed: base.ParseResult, ctx: util.Context) -> No
         txt.append("Game time:      %s" % ctx.clock)
     txt.append("Players:        %d" % len(ctx.driver.all_players))
     txt.append("Deferreds:      %d" % len(driver.deferreds))
+    txt.append("Behaviors:      %d  (last tick: %d triggered in %.1f ms)"
+               % (len(driver.behaviors), driver.behaviors.last_count, driver.behaviors.last_duration * 1000))
+    if driver.resources:
+        cached, cache_size, hits, misses = driver.resources.cache_info()
+        txt.append("Resources:      %d cached (%d kb), %d hits, %d misses" % (cached, cache_size // 1024, hits, misses))
     txt.append("Loop tick:      %.1f sec" % config.server_tick_time)
     if config.server_tick_method == TickMethod.TIMER:
         avg_loop_duration = sum(driver.server_loop_durations) / len(driver.server_loop_durations)
@@ -469,10 +475,10 @@ def do_server(player: Player, parsed: base.ParseResult, ctx: util.Context) -> No
     elif config.server_tick_method == TickMethod.COMMAND:
         txt.append("Loop duration:  n/a (command driven)")
     txt.append("Number of objects:")
-    txt.append("  locations: %d" % len(list(base.MudObjRegistry.all_locations.keys())))
-    txt.append("  livings:   %d" % len(list(base.MudObjRegistry.all_livings.keys())))
-    txt.append("  items:     %d" % len(list(base.MudObjRegistry.all_items.keys())))
-    txt.append("  exits:     %d" % len(list(base.MudObjRegistry.all_exits.keys())))
+    txt.append("  locations: %d" % base.MudObjRegistry.count_class(base.Location, subclasses=True))
+    txt.append("  livings:   %d" % base.MudObjRegistry.count_class(base.Living, subclasses=True))
+    txt.append("  items:     %d" % base.MudObjRegistry.count_class(base.Item, subclasses=True))
+    txt.append("  exits:     %d" % base.MudObjRegistry.count_class(base.Exit, subclasses=True))
     txt.append("  python:    %d" % len(gc.get_objects()))
     player.tell("\n".join(txt), format=False)
 
@@ -496,16 +502,21 @@ def do_events(player: Player, parsed: base.ParseResult, ctx: util.Context) -> No
 
 @wizcmd("pubsub")
 def do_pubsub(player: Player, parsed: base.ParseResult, ctx: util.Context) -> None:
-    """Give an overview of the pubsub topics."""
+    """Give an overview of the pubsub topics, with their pending messages and dispatch statistics."""
     pending = pubsub.pending()
+    stats = pubsub.stats()
     player.tell("<bright>Pending pubsub messages overview.</> Active topics (from %d total):" % len(pending))
     total_pending = 0
-    txt = ["<ul>  topic                                            <dim>|</><ul>#pending<dim>|</><ul>idle sec.<dim>|</><ul>subs</>"]
+    txt = ["<ul>  topic                                            <dim>|</><ul>#pending<dim>|</><ul>idle sec.<dim>|</><ul>subs"
+           "<dim>|</><ul>ev/sec <dim>|</><ul>max q. <dim>|</><ul>dispatch ms<dim>|</><ul>dropped</>"]
     for topic in sorted(pending, key=lambda t: str(t)):
         num_pending, idle_time, subbers = pending[topic]
         total_pending += num_pending
-        if num_pending or subbers or idle_time < 10:
-            txt.append("%-50.50s <dim>|</>  %3d   <dim>|</>  %4d   <dim>|</> %d" % (topic, num_pending, int(idle_time), subbers))
+        if (num_pending or subbers or idle_time < 10) and topic in stats:
+            tstats = stats[topic]
+            txt.append("%-50.50s <dim>|</>  %3d   <dim>|</>  %4d   <dim>|</> %2d <dim>|</> %5.1f <dim>|</> %5d <dim>|</> %9.1f <dim>|</> %d"
+                       % (topic, num_pending, int(idle_time), subbers, tstats.events_per_sec, tstats.max_queue_depth,
+                          tstats.dispatch_time * 1000.0, tstats.dropped))
     txt.append(("total pending:  " + str(total_pending)).rjust(56))
     txt.append("")
     player.tell("\n".join(txt), format=False)
@@ -652,25 +663,26 @@ def do_show_vnum(player: Player, parsed: base.ParseResult, ctx: util.Context) ->
         player.tell("All known " + name + ": (limiting to 100)", end=True)
         count = 0
         if name == "items":
-            for vnum, item in list(base.MudObjRegistry.all_items.items())[:100]:
+            for vnum, item in itertools.islice(base.MudObjRegistry.all_items.items(), 100):
                 location = "%s, #%d" % (item.location.name, item.location.vnum) if item.location else ""  # type: ignore
                 player.tell("%d - %s  (%s)" % (vnum, item.name, location), end=True)
                 count += 1
         elif name == "livings":
-            for vnum, living in list(base.MudObjRegistry.all_livings.items())[:100]:
+            for vnum, living in itertools.islice(base.MudObjRegistry.all_livings.items(), 100):
                 location = "%s, #%d" % (living.location.name, living.location.vnum) if living.location else ""  # type: ignore
                 is_player = "[player]" if isinstance(living, Player) else ""
                 player.tell("%d - %s  %s (%s)" % (vnum, living.name, is_player, location), end=True)
                 count += 1
         elif name == "locations":
-            for vnum, loc in list(base.MudObjRegistry.all_locations.items())[:100]:
+            for vnum, loc in itertools.islice(base.MudObjRegistry.all_locations.items(), 100):
                 player.tell("%d - %s" % (vnum, loc.name), end=True)
                 count += 1
         elif name == "exits":
-            for vnum, exit in list(base.MudObjRegistry.all_exits.items())[:100]:
+            for vnum, exit in itertools.islice(base.MudObjRegistry.all_exits.items(), 100):
                 player.tell("%d - %s, target: %s" % (vnum, exit.name, exit.target.name), end=True)
                 count += 1
-        player.tell("Count: %d" % count)
+        base_class = {"items": base.Item, "livings": base.Living, "locations": base.Location, "exits": base.Exit}[name]
+        player.tell("Count: %d  (total: %d)" % (count, base.MudObjRegistry.count_class(base_class, subclasses=True)))
         return
     else:
         try:
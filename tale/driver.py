@@ -17,9 +17,11 @@ import random
 import sys
 import threading
 import time
+import weakref
 from functools import total_ordering
-from types import ModuleType
-from typing import Sequence, Union, Tuple, Any, Dict, Callable, Iterable, Generator, Set, List, MutableSequence, Optional
+from types import ModuleType, MappingProxyType
+from typing import Sequence, Union, Tuple, Any, Dict, Callable, Iterable, Generator, Set, List, MutableSequence, Optional, Iterator, \
+    FrozenSet, Mapping, MutableMapping
 
 import appdirs
 
@@ -35,6 +37,9 @@ topic_pending_actions = pubsub.topic("driver-pending-actions")
 topic_pending_tells = pubsub.topic("driver-pending-tells")
 topic_async_dialogs = pubsub.topic("driver-async-dialogs")
 
+# (the versions it was built from, command verbs, custom verbs, all verbs) per (privileges, location vnum)
+VerbTableType = Tuple[Tuple[int, int], Mapping[str, Callable], FrozenSet[str], FrozenSet[str]]
+
 
 class Commands:
     """
@@ -43,6 +48,12 @@ class Commands:
     def __init__(self) -> None:
         self.commands_per_priv = {None: {}}    # type: Dict[str, Dict[str, Callable]]
         self.no_soul_parsing = set()   # type: Set[str]
+        self.version = 0    # bumped on every change to the commands
+        self._per_privileges = {}   # type: Dict[FrozenSet[str], Mapping[str, Callable]]
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._per_privileges.clear()
 
     def add(self, verb: str, func: Callable, privilege: str=None) -> None:
         self.validatefunc(func)
@@ -50,12 +61,14 @@ class Commands:
             if verb in commands:
                 raise ValueError("command defined more than once: " + verb)
         self.commands_per_priv.setdefault(privilege, {})[verb] = func
+        self._changed()
 
     def override(self, verb: str, func: Callable, privilege: str=None) -> Callable:
         self.validatefunc(func)
         if verb in self.commands_per_priv[privilege]:
             existing = self.commands_per_priv[privilege][verb]
             self.commands_per_priv[privilege][verb] = func
+            self._changed()
             return existing
         raise LookupError("command not defined: " + verb)
 
@@ -63,11 +76,16 @@ class Commands:
         if not hasattr(func, "is_tale_command_func"):
             raise ValueError("the function '%s' is not a proper command function (did you forget the decorator?)" % func.__name__)
 
-    def get(self, privileges: Iterable[str]) -> Dict[str, Callable]:
-        result = dict(self.commands_per_priv[None])  # always include the cmds for None
-        for priv in privileges:
-            if priv in self.commands_per_priv:
-                result.update(self.commands_per_priv[priv])
+    def get(self, privileges: Iterable[str]) -> Mapping[str, Callable]:
+        """The (read-only) mapping of the commands available with the given privileges. It is cached per privilege set."""
+        privileges = frozenset(privileges)
+        result = self._per_privileges.get(privileges)
+        if result is None:
+            commands = dict(self.commands_per_priv[None])  # always include the cmds for None
+            for priv in privileges:
+                if priv in self.commands_per_priv:
+                    commands.update(self.commands_per_priv[priv])
+            result = self._per_privileges[privileges] = MappingProxyType(commands)
         return result
 
     def adjust_available_commands(self, server_mode: GameMode) -> None:
@@ -83,6 +101,7 @@ class Commands:
                     del verbdefs.VERBS[cmd]
                 if getattr(func, "no_soul_parse", False):
                     self.no_soul_parsing.add(cmd)
+        self._changed()
 
 
 @total_ordering
@@ -126,6 +145,7 @@ class Deferred:
         self.vargs = vargs
         self.kwargs = kwargs
         self.periodical = periodical
+        self._resolved_action = None   # type: Callable  # cache of the callable, not serialized
 
     def __eq__(self, other):
         if self.__class__ == other.__class__:
@@ -151,21 +171,12 @@ class Deferred:
 
     def __call__(self, *args: Any, **kwargs: Any) -> None:
         self.kwargs = self.kwargs or {}
-        if callable(self.action):
-            func = self.action
-        else:
-            # deferred action is stored as the name of the function to call,
-            # so we need to obtain the actual function from the owner object.
-            if isinstance(self.owner, str):
-                if self.owner.startswith("module:"):
-                    # the owner refers to a module
-                    self.owner = sys.modules[self.owner[7:]]
-                else:
-                    raise RuntimeError("invalid owner specifier: " + self.owner)
-            func = getattr(self.owner, self.action)
+        func = self._resolved_action
+        if func is None:
+            func = self._resolved_action = self._resolve_action()
         if self.periodical and hasattr(func, "_tale_periodically") and not func._tale_periodically:
             return  # no longer marked as periodical
-        if "ctx" in inspect.signature(func).parameters:
+        if accepts_ctx(func):
             self.kwargs["ctx"] = kwargs["ctx"]  # add a 'ctx' keyword argument to the call for convenience
         func(*self.vargs, **self.kwargs)
         if self.periodical and (not hasattr(func, "_tale_periodically") or func._tale_periodically):
@@ -183,6 +194,278 @@ class Deferred:
             del self.action
             del self.kwargs
             del self.vargs
+            self._resolved_action = None
+
+    def _resolve_action(self) -> Callable:
+        if callable(self.action):
+            return self.action
+        # deferred action is stored as the name of the function to call,
+        # so we need to obtain the actual function from the owner object.
+        if isinstance(self.owner, str):
+            if self.owner.startswith("module:"):
+                # the owner refers to a module
+                self.owner = sys.modules[self.owner[7:]]
+            else:
+                raise RuntimeError("invalid owner specifier: " + self.owner)
+        return getattr(self.owner, self.action)
+
+
+_accepts_ctx_cache = weakref.WeakKeyDictionary()   # type: weakref.WeakKeyDictionary[Callable, bool]
+
+
+def accepts_ctx(func: Callable) -> bool:
+    """Does the function (or method) have a 'ctx' parameter? The answer is cached per function, as long as it exists."""
+    key = getattr(func, "__func__", func)   # for methods, cache on the underlying function
+    try:
+        return _accepts_ctx_cache[key]
+    except KeyError:
+        pass
+    except TypeError:
+        return "ctx" in inspect.signature(func).parameters     # can't be weakly referenced (a builtin), don't cache it
+    result = _accepts_ctx_cache[key] = "ctx" in inspect.signature(func).parameters
+    return result
+
+
+class DeferredQueue:
+    """
+    The pending deferreds, organized as a bucketed timer wheel keyed by game time.
+    Every bucket holds the deferreds that are due within the same 'resolution' seconds of game time,
+    and a bucket whose time has passed is emptied as a whole. Only the keys of the (relatively few)
+    non-empty buckets are kept in a heap, so scheduling a deferred is effectively O(1).
+    An owner index makes removing all deferreds of an object proportional to the number of deferreds it owns.
+    Note: this is not thread-safe by itself, the driver guards access with its deferreds_lock.
+    """
+    epoch = datetime.datetime(1, 1, 1)
+
+    def __init__(self, resolution: int=1) -> None:
+        assert resolution >= 1
+        self.resolution = resolution
+        self.buckets = {}   # type: Dict[int, Dict[int, Deferred]]  # bucket key -> {id(deferred): deferred}
+        self.bucket_keys = []   # type: List[int]  # heapq, may contain keys of buckets that have since been emptied
+        self.owners = {}   # type: Dict[int, Dict[int, Deferred]]   # id(owner) -> {id(deferred): deferred}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Deferred]:
+        """iterates over all pending deferreds, in no particular order"""
+        for bucket in list(self.buckets.values()):
+            yield from list(bucket.values())
+
+    def bucket_key(self, due_gametime: datetime.datetime) -> int:
+        delta = due_gametime - self.epoch
+        return (delta.days * 86400 + delta.seconds) // self.resolution
+
+    def push(self, deferred: Deferred) -> None:
+        key = self.bucket_key(deferred.due_gametime)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+            heapq.heappush(self.bucket_keys, key)
+        if id(deferred) not in bucket:
+            bucket[id(deferred)] = deferred
+            self.owners.setdefault(id(deferred.owner), {})[id(deferred)] = deferred
+            self.size += 1
+
+    def pop_due(self, game_time: datetime.datetime) -> List[Deferred]:
+        """Removes and returns the deferreds that are due at the given game time, sorted on their due time."""
+        now_key = self.bucket_key(game_time)
+        due = []    # type: List[Deferred]
+        while self.bucket_keys and self.bucket_keys[0] <= now_key:
+            key = self.bucket_keys[0]
+            bucket = self.buckets.get(key)
+            if bucket is not None and key == now_key:
+                # the current bucket is probably only partially due
+                for deferred in [d for d in bucket.values() if d.due_gametime <= game_time]:
+                    del bucket[id(deferred)]
+                    due.append(deferred)
+                if bucket:
+                    break
+            elif bucket is not None:
+                due.extend(bucket.values())
+            heapq.heappop(self.bucket_keys)
+            self.buckets.pop(key, None)
+        for deferred in due:
+            owned = self.owners[id(deferred.owner)]
+            del owned[id(deferred)]
+            if not owned:
+                del self.owners[id(deferred.owner)]
+        self.size -= len(due)
+        due.sort()
+        return due
+
+    def remove_owner(self, owner: Any) -> None:
+        """Removes all deferreds of the given owner object."""
+        owned = self.owners.pop(id(owner), None)
+        if owned:
+            for deferred in owned.values():
+                key = self.bucket_key(deferred.due_gametime)
+                bucket = self.buckets[key]
+                del bucket[id(deferred)]
+                if not bucket:
+                    del self.buckets[key]   # its key is skipped in the heap later
+            self.size -= len(owned)
+
+    def clear(self) -> None:
+        self.buckets.clear()
+        self.bucket_keys = []
+        self.owners.clear()
+        self.size = 0
+
+
+class BehaviorBatch:
+    """
+    A periodic behavior (a method name) that many objects share, executed for all of them in one pass.
+    The objects are spread over a ring of slots, one slot per server tick of the period; the slot an
+    object is put in is its (randomly jittered) due time. Every tick, the next slot in the ring is processed,
+    so each object is handled once per period while the work is evenly divided over the ticks.
+    The chance that the behavior triggers is stored per object, the random rolls for a slot are drawn in one go.
+    """
+    def __init__(self, method_name: str, period_ticks: int) -> None:
+        assert period_ticks >= 1
+        self.method_name = method_name
+        self.slots = [[] for _ in range(period_ticks)]   # type: List[List[Any]]
+        self.chances = [[] for _ in range(period_ticks)]    # type: List[List[float]]
+        self.positions = {}   # type: Dict[int, Tuple[int, int]]   # id(obj) -> (slot, index)
+        self.current_slot = 0
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, obj: Any) -> bool:
+        return id(obj) in self.positions
+
+    def add(self, obj: Any, chance: float) -> None:
+        if id(obj) in self.positions:
+            slot, index = self.positions[id(obj)]
+            self.chances[slot][index] = chance
+            return
+        slot = random.randrange(len(self.slots))
+        self.positions[id(obj)] = (slot, len(self.slots[slot]))
+        self.slots[slot].append(obj)
+        self.chances[slot].append(chance)
+
+    def remove(self, obj: Any) -> None:
+        position = self.positions.pop(id(obj), None)
+        if position:
+            # swap the last object of the slot into the hole, to keep the arrays compact
+            slot, index = position
+            objects, chances = self.slots[slot], self.chances[slot]
+            last_obj, last_chance = objects.pop(), chances.pop()
+            if last_obj is not obj:
+                objects[index] = last_obj
+                chances[index] = last_chance
+                self.positions[id(last_obj)] = (slot, index)
+
+    def due_objects(self) -> List[Any]:
+        """Advance the ring to the next slot, returns the objects for which the behavior triggers this tick."""
+        objects, chances = self.slots[self.current_slot], self.chances[self.current_slot]
+        self.current_slot = (self.current_slot + 1) % len(self.slots)
+        rnd = random.random
+        rolls = [rnd() for _ in range(len(objects))]
+        return [obj for obj, chance, roll in zip(objects, chances, rolls) if roll < chance]
+
+
+class Behaviors:
+    """
+    Registry of the batched periodic behaviors, that the driver runs every server tick.
+    Use this instead of a @call_periodically method (which is a separate deferred for every object)
+    for behaviors that a lot of objects have, such as wandering mobs.
+    """
+    def __init__(self) -> None:
+        self.batches = {}   # type: Dict[Tuple[str, int], BehaviorBatch]
+        self.last_duration = 0.0
+        self.last_count = 0
+
+    def __len__(self) -> int:
+        return sum(len(batch) for batch in self.batches.values())
+
+    def add(self, obj: Any, method_name: str, period_ticks: int, chance: float=1.0) -> None:
+        if not callable(getattr(obj, method_name, None)):
+            raise ValueError("object has no behavior method " + method_name)
+        batch = self.batches.get((method_name, period_ticks))
+        if batch is None:
+            batch = self.batches[(method_name, period_ticks)] = BehaviorBatch(method_name, period_ticks)
+        batch.add(obj, chance)
+
+    def remove(self, obj: Any, method_name: str=None) -> None:
+        """Remove the object from the given behavior, or from all behaviors if no method name is given."""
+        for (name, _), batch in self.batches.items():
+            if method_name is None or name == method_name:
+                batch.remove(obj)
+
+    def run(self, ctx: util.Context, active_region: 'ActiveRegion'=None) -> None:
+        start = time.perf_counter()
+        self.last_count = 0
+        for batch in list(self.batches.values()):
+            for obj in batch.due_objects():
+                if obj not in batch:
+                    continue   # removed (destroyed) in the meantime by another behavior
+                if active_region is not None:
+                    location = obj if isinstance(obj, base.Location) else obj.location
+                    if location not in active_region:
+                        continue   # suspended, there are no players nearby
+                self.last_count += 1
+                try:
+                    getattr(obj, batch.method_name)(ctx)
+                except StoryCompleted:
+                    raise    # handled elsewhere (IF)
+                except Exception:
+                    print("\n* Exception while executing behavior {0} of {1}:".format(batch.method_name, obj), file=sys.stderr)
+                    print("".join(util.format_traceback()), file=sys.stderr)
+                    print("(Please report this problem)", file=sys.stderr)
+        self.last_duration = time.perf_counter() - start
+
+
+class ActiveRegion:
+    """
+    The locations within a number of exits ('hops') from any connected player: the part of the world
+    that is actively simulated. Batched behaviors of objects outside of it are suspended.
+    When a location becomes part of the active region again, the livings in it get the
+    chance to cheaply catch up on the time they were left alone (Living.fast_forward).
+    """
+    def __init__(self, hops: int) -> None:
+        assert hops >= 0
+        self.hops = hops
+        self.locations = set()   # type: Set[base.Location]
+        self.player_locations = frozenset()   # type: FrozenSet[base.Location]
+        self.inactive_since = {}   # type: Dict[base.Location, float]
+        self.started = time.time()
+
+    def __contains__(self, location: base.Location) -> bool:
+        return location in self.locations
+
+    def update(self, player_locations: Iterable[base.Location]) -> Dict[base.Location, float]:
+        """
+        Recalculate the region (only if the players moved, or a location in it isn't materialized).
+        The locations are materialized as the region is expanded, because a location that is
+        created on demand doesn't have its exits until then.
+        Returns the locations that became active, with the number of seconds they have been inactive.
+        """
+        player_locations = frozenset(loc for loc in player_locations if loc is not None)
+        if player_locations == self.player_locations and not any(loc._lazy_loader for loc in self.locations):
+            return {}
+        self.player_locations = player_locations
+        region = set(player_locations)
+        frontier = list(player_locations)
+        for location in frontier:
+            location.materialize()
+        for _ in range(self.hops):
+            next_frontier = []
+            for location in frontier:
+                for neighbor in list(location.nearby(no_traps=False)):
+                    if neighbor not in region:
+                        neighbor.materialize()
+                        region.add(neighbor)
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        now = time.time()
+        for location in self.locations - region:
+            self.inactive_since[location] = now
+        activated = {location: now - self.inactive_since.pop(location, self.started) for location in region - self.locations}
+        self.locations = region
+        return activated
 
 
 class Driver(pubsub.Listener):
@@ -191,13 +474,19 @@ class Driver(pubsub.Listener):
     Reads story file and config, initializes game state.
     Handles main game loop, player connections, and loading/saving of game state.
     """
+    verb_tables_max_size = 256    # number of (privileges, location) verb tables that are cached
+
     def __init__(self) -> None:
         self.unbound_exits = []    # type: List[base.Exit]
-        self.deferreds = []   # type: List[Deferred]  # heapq
+        self.deferreds = DeferredQueue()
+        self.behaviors = Behaviors()
+        self.active_region = None   # type: ActiveRegion
         self.deferreds_lock = threading.Lock()
+        self.wakeup = threading.Event()   # signaled when there's something for the main loop to do (player input, driver events)
         self.server_started = datetime.datetime.now().replace(microsecond=0)
         self.server_loop_durations = collections.deque(maxlen=10)    # type: MutableSequence[float]
         self.commands = Commands()
+        self._verb_tables = collections.OrderedDict()  # type: MutableMapping[Tuple[FrozenSet[str], int], VerbTableType]
         self.all_players = {}   # type: Dict[str, player.PlayerConnection]  # maps playername to player connection object
         self.zones = None       # type: ModuleType
         self.moneyfmt = None    # type: util.MoneyFormatter
@@ -215,6 +504,8 @@ class Driver(pubsub.Listener):
         topic_pending_actions.subscribe(self)
         topic_pending_tells.subscribe(self)
         topic_async_dialogs.subscribe(self)
+        for t in (topic_pending_actions, topic_pending_tells, topic_async_dialogs):
+            t.wakeup = self.wakeup
 
     def is_running(self):
         return not self._stop_mainloop
@@ -297,6 +588,8 @@ class Driver(pubsub.Listener):
             self.story.config.gametime_to_realtime = 1
         assert self.story.config.server_tick_time > 0
         assert self.story.config.max_wait_hours >= 0
+        if self.story.config.active_region_hops is not None:
+            self.active_region = ActiveRegion(self.story.config.active_region_hops)
         self.game_clock = util.GameDateTime(self.story.config.epoch or self.server_started, self.story.config.gametime_to_realtime)
         # convert textual exit strings to actual exit object bindings
         for x in self.unbound_exits:
@@ -357,6 +650,7 @@ class Driver(pubsub.Listener):
         Flushes any pending output to the players, then closes down.
         """
         self._stop_mainloop = True
+        self.wakeup.set()
         for conn in self.all_players.values():
             conn.write_output()
             conn.destroy()
@@ -396,9 +690,18 @@ class Driver(pubsub.Listener):
                 assert conn not in self.waiting_for_input, "can only run one async dialog at the same time"
                 conn.io.dont_echo_next_cmd = why == "input-noecho"  # this avoids echoing of the password
                 self.waiting_for_input[conn] = (dialog, validator, why != "input-noecho")
+            elif why == "wait":
+                # wait for the background work (a concurrent.futures.Future) to finish, the dialog then continues with the future.
+                # meanwhile the player's input is refused.
+                self.waiting_for_input[conn] = (dialog, self._input_while_waiting, True)
+                what.add_done_callback(lambda future: topic_async_dialogs.send((conn, dialog, future)))
             else:
                 raise ValueError("invalid generator wait reason: " + why)
 
+    @staticmethod
+    def _input_while_waiting(text: str) -> str:
+        raise ValueError("One moment please...")
+
     def print_game_intro(self, conn: Optional[player.PlayerConnection]) -> None:
         try:
             # print game banner as supplied by the game
@@ -436,8 +739,7 @@ class Driver(pubsub.Listener):
     def _rename_player(self, player: player.Player, name_info: charbuilder.PlayerNaming) -> None:
         conn = self.all_players[player.name]
         del self.all_players[player.name]
-        old_wiretap = player.get_wiretap()
-        old_wiretap.destroy()
+        player.drop_wiretap()
         self.all_players[name_info.name] = conn
         name_info.apply_to(player)
 
@@ -473,7 +775,7 @@ class Driver(pubsub.Listener):
         """
         Do everything that the server needs to do every tick (timer configurable in story)
         1) game clock
-        2) deferreds
+        2) deferreds and batched behaviors
         3) pending pubsub events
         4) write buffered output
         5) verify validity and idle state of connected players
@@ -482,13 +784,8 @@ class Driver(pubsub.Listener):
         self.game_clock.add_realtime(datetime.timedelta(seconds=self.story.config.server_tick_time))
         ctx = util.Context(self, self.game_clock, self.story.config, None)
 
-        due_deferreds = []
         with self.deferreds_lock:
-            while self.deferreds:
-                deferred = self.deferreds[0]
-                if deferred.due_gametime > self.game_clock.clock:
-                    break
-                due_deferreds.append(heapq.heappop(self.deferreds))
+            due_deferreds = self.deferreds.pop_due(self.game_clock.clock)
         for deferred in due_deferreds:
             try:
                 deferred(ctx=ctx)  # call the deferred and provide a context object
@@ -499,6 +796,9 @@ class Driver(pubsub.Listener):
                 print("".join(util.format_traceback()), file=sys.stderr)
                 print("(Please report this problem)", file=sys.stderr)
         del due_deferreds
+        if self.active_region:
+            self._update_active_region(ctx)
+        self.behaviors.run(ctx, self.active_region)
 
         pubsub.sync()
         for name, conn in list(self.all_players.items()):
@@ -509,12 +809,27 @@ class Driver(pubsub.Listener):
                 # disconnect corrupt player connection
                 self.disconnect_player(conn)
         # clean up idle wiretap topics
-        topicinfo = pubsub.pending()
-        for topicname in topicinfo:
-            if isinstance(topicname, tuple) and topicname[0].startswith("wiretap-"):
-                events, idle_time, subbers = topicinfo[topicname]
-                if events == 0 and not subbers and idle_time > 30:
-                    pubsub.topic(topicname).destroy()
+        for obj in list(base.MudObjRegistry.wiretapped.values()):
+            tap = obj.get_wiretap()
+            if not tap.events and tap.idle_time > 30 and not any(subber() for subber in tap.subscribers):
+                obj.drop_wiretap()
+
+    def _update_active_region(self, ctx: util.Context) -> None:
+        activated = self.active_region.update(conn.player.location for conn in self.all_players.values() if conn.player)
+        for location, inactive_time in activated.items():
+            for living in list(location.livings):
+                try:
+                    living.fast_forward(inactive_time, ctx)
+                except StoryCompleted:
+                    raise    # handled elsewhere (IF)
+                except Exception:
+                    print("\n* Exception while fast-forwarding {0}:".format(living), file=sys.stderr)
+                    print("".join(util.format_traceback()), file=sys.stderr)
+                    print("(Please report this problem)", file=sys.stderr)
+
+    def is_active_location(self, location: base.Location) -> bool:
+        """Is the location in the active region (near a player)? Always true if the story doesn't use an active region."""
+        return self.active_region is None or location in self.active_region
 
     def disconnect_idling(self, conn: player.PlayerConnection) -> None:
         raise NotImplementedError
@@ -537,8 +852,7 @@ class Driver(pubsub.Listener):
         player = conn.player
         # We pass in all 'external verbs' (non-soul verbs) so it will do the
         # parsing for us even if it's a verb the soul doesn't recognise by itself.
-        command_verbs = self.commands.get(player.privileges)
-        custom_verbs = set(self.current_custom_verbs(player))
+        command_verbs, custom_verbs, all_verbs = self.verb_table(player)
         try:
             if _verb in self.commands.no_soul_parsing:
                 # don't use the soul to parse it further
@@ -546,7 +860,6 @@ class Driver(pubsub.Listener):
                 raise errors.NonSoulVerb(base.ParseResult(_verb, unparsed=_rest.strip()))
             else:
                 # Parse the command by using the soul.
-                all_verbs = set(command_verbs) | custom_verbs
                 parsed = player.parse(cmd, external_verbs=all_verbs)
             # If parsing went without errors, it's a soul verb, handle it as a socialize action
             player.turns += 1
@@ -636,6 +949,31 @@ class Driver(pubsub.Listener):
                 module.init(self)   # type: ignore
         return importlib.import_module("zones")
 
+    def verb_table(self, player: player.Player) -> Tuple[Mapping[str, Callable], FrozenSet[str], FrozenSet[str]]:
+        """
+        Returns the verbs the player can use right now: (command verbs mapping to their function,
+        custom verbs, all of those verbs together). The tables of the most recently used privilege sets and locations
+        (by vnum) are cached, and rebuilt when the commands or the custom verbs in the location have changed.
+        Only the verbs of the items the player carries are merged in on every call (that's usually none at all).
+        """
+        location = player.location
+        key = (frozenset(player.privileges), location.vnum)
+        versions = (self.commands.version, location._verbs_version)
+        cached = self._verb_tables.get(key)
+        if cached is None or cached[0] != versions:
+            command_verbs = self.commands.get(key[0])
+            custom_verbs = location.custom_verbs()
+            cached = self._verb_tables[key] = (versions, command_verbs, custom_verbs, frozenset(command_verbs) | custom_verbs)
+        self._verb_tables.move_to_end(key)
+        while len(self._verb_tables) > self.verb_tables_max_size:
+            self._verb_tables.popitem(last=False)
+        _, command_verbs, custom_verbs, all_verbs = cached
+        inventory_verbs = player.inventory_verbs()
+        if inventory_verbs:
+            custom_verbs = custom_verbs | inventory_verbs
+            all_verbs = all_verbs | inventory_verbs
+        return command_verbs, custom_verbs, all_verbs
+
     def current_custom_verbs(self, player: player.Player) -> Dict[str, str]:
         """returns dict of the currently recognised custom verbs (verb->helptext mapping)"""
         verbs = player.verbs.copy()
@@ -742,7 +1080,7 @@ class Driver(pubsub.Listener):
         if "ctx" in deferred.kwargs:
             raise errors.TaleError("you cannot enqueue a Deferred that already has a 'ctx' kwarg (serialization issues)")
         with self.deferreds_lock:
-            heapq.heappush(self.deferreds, deferred)
+            self.deferreds.push(deferred)
 
     def pubsub_event(self, topicname: pubsub.TopicNameType, event: Union[Callable, Tuple[player.PlayerConnection, str]]) -> None:
         if topicname == "driver-pending-actions":
@@ -753,17 +1091,36 @@ class Driver(pubsub.Listener):
             event()
         elif topicname == "driver-async-dialogs":
             assert type(event) is tuple
-            conn, dialog = event  # type: ignore
+            conn, dialog, message = event if len(event) == 3 else event + (None,)   # type: ignore
             assert type(conn) is player.PlayerConnection
             assert inspect.isgenerator(dialog)
-            self._continue_dialog(conn, dialog, None)
+            if message is not None:
+                # the dialog was waiting for something to finish
+                if self.waiting_for_input.get(conn, (None,))[0] is not dialog:
+                    return
+                del self.waiting_for_input[conn]
+                if not conn.player:
+                    return   # disconnected meanwhile
+            self._continue_dialog(conn, dialog, message)
         else:
             raise ValueError("unknown topic: " + str(topicname))
 
     def remove_deferreds(self, owner: str) -> None:
         with self.deferreds_lock:
-            self.deferreds = [d for d in self.deferreds if d.owner is not owner]
-            heapq.heapify(self.deferreds)
+            self.deferreds.remove_owner(owner)
+
+    def register_behavior(self, obj: base.MudObject, method_name: str, period: float, chance: float=1.0) -> None:
+        """
+        Add the object to a batched periodic behavior: every 'period' seconds (real time, rounded to whole server ticks)
+        the given method is called with a ctx argument, with the given chance (0..1).
+        All objects sharing the same behavior and period are processed together, in one pass per server tick.
+        The object is removed from its behaviors automatically when it is destroyed.
+        """
+        tick_time = self.story.config.server_tick_time if self.story else 1.0
+        self.behaviors.add(obj, method_name, max(1, int(round(period / tick_time))), chance)
+
+    def remove_behaviors(self, obj: base.MudObject, method_name: str=None) -> None:
+        self.behaviors.remove(obj, method_name)
 
     def register_periodicals(self, obj: base.MudObject) -> None:
         for func, period in util.get_periodicals(obj).items():
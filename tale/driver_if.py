@@ -8,7 +8,7 @@ Copyright by Irmen de Jong (irmen@razorvine.net)
 import sys
 import time
 import threading
-from typing import Generator, Optional, Union
+from typing import Generator, Optional
 from .story import GameMode, TickMethod, StoryConfig
 from . import base
 from . import charbuilder
@@ -40,6 +40,8 @@ class IFDriver(driver.Driver):
         if web:
             self.io_type = "web"
         self.wizard_override = wizard_override
+        self.savegame_checkpoint = None     # type: Optional[savegames.SaveCheckpoint]
+        self.savegame_writer = None     # type: Optional[savegames.SavegameWriter]
 
     def start_main_loop(self):
         if self.io_type == "web":
@@ -77,20 +79,57 @@ class IFDriver(driver.Driver):
     def do_save(self, player: Player) -> None:
         if not self.story.config.savegames_enabled:
             raise errors.ActionRefused("It is not possible to save your progress.")
-        serializer = savegames.TaleSerializer()
+        writer = self.savegame_writer
+        if writer and writer.is_alive():
+            raise errors.ActionRefused("The game is still being saved (%s, %d%%), try again in a moment."
+                                       % (writer.stage, writer.progress * 100))
+        serializer = savegames.TaleSerializer(self.story.config.savegame_codec, self.story.config.savegame_compression)
+        for location in list(base.MudObjRegistry.all_locations.values()):
+            location.materialize()     # still postponed after loading the game
         all_locations = [loc for loc in base.MudObjRegistry.all_locations.values()]
         all_items = [i for i in base.MudObjRegistry.all_items.values() if i.contained_in]
         all_livings = [l for l in base.MudObjRegistry.all_livings.values() if l.location]
         all_exits = list(base.MudObjRegistry.all_exits.values())
-        savedata = serializer.serialize(self.story.config, player, all_items, all_livings, all_locations, all_exits,
-                                        self.deferreds, self.game_clock)
+        # only the snapshot is taken here, encoding and writing it is done in the background
+        snapshot = serializer.snapshot(self.story.config, player, all_items, all_livings, all_locations, all_exits,
+                                       list(self.deferreds), self.game_clock)
         del all_locations, all_exits, all_items, all_livings
-        self.user_resources[util.storyname_to_filename(self.story.config.name) + ".savegame"] = savedata
-        player.tell("Game saved.")
+        checkpoint = self.savegame_checkpoint
+        if checkpoint is None or checkpoint.num_deltas >= self.story.config.savegame_max_deltas:
+            # a full savegame, this also compacts any deltas written earlier
+            checkpoint = self.savegame_checkpoint = savegames.SaveCheckpoint(snapshot)
+            delta = False
+        else:
+            # only the objects of which the saved state changed since the previous save
+            snapshot = checkpoint.delta(snapshot)
+            checkpoint.num_deltas += 1
+            delta = True
+        savegame_filename = util.storyname_to_filename(self.story.config.name) + ".savegame"
+        self.savegame_writer = savegames.SavegameWriter(serializer, self.user_resources, savegame_filename, snapshot, checkpoint,
+                                                        delta, lambda writer: self._savegame_written(writer, player))
+        self.savegame_writer.start()
+        player.tell("Saving the game...")
         if self.story.config.display_gametime:
             player.tell("Game time: %s" % self.game_clock)
         player.tell("\n")
 
+    def _savegame_written(self, writer: savegames.SavegameWriter, player: Player) -> None:
+        # this is called from the savegame writer thread
+        if writer.error:
+            self.savegame_checkpoint = None     # don't know what's on disk now, so the next save writes a full savegame again
+            player.tell_later("<it>Saving the game failed:</> " + str(writer.error))
+        else:
+            player.tell_later("Game saved.")
+
+    def wait_for_savegame(self) -> None:
+        """wait until the savegame that is being written in the background (if any) is completely written"""
+        if self.savegame_writer:
+            self.savegame_writer.join()
+
+    def _stop_driver(self) -> None:
+        self.wait_for_savegame()
+        super()._stop_driver()
+
     def connect_player(self, player_io_type: str, line_delay: int) -> PlayerConnection:
         connection = PlayerConnection()
         connect_name = "<connecting_%d>" % id(connection)  # unique temporary name
@@ -295,11 +334,22 @@ class IFDriver(driver.Driver):
         # at this time, game loading/saving is only supported in single player IF mode.
         assert len(self.all_players) == 1
         conn = list(self.all_players.values())[0]
+        self.wait_for_savegame()
         try:
-            savegame = self.user_resources[util.storyname_to_filename(self.story.config.name) + ".savegame"].data
+            savegame_filename = util.storyname_to_filename(self.story.config.name) + ".savegame"
+            savegame = self.user_resources[savegame_filename].data
             deserializer = savegames.TaleDeserializer()
-            state = deserializer.deserialize(savegame)
+            reader = deserializer.reader(savegame)
+            checksum = savegames.TaleSerializer.checksum(savegame)
             del savegame
+            try:
+                deltas = self.user_resources[savegame_filename + ".delta"].data
+            except FileNotFoundError:
+                pass
+            else:
+                for delta in deserializer.deserialize_deltas(deltas, checksum):
+                    reader.apply_delta(delta)
+                del deltas
         except (ValueError, TypeError) as x:
             print("There was a problem loading the saved game data:")
             print(type(x).__name__, x)
@@ -312,58 +362,31 @@ class IFDriver(driver.Driver):
             existing_player.tell("Failed to load save game data: " + str(x), end=True)
             return None
         else:
-            savegame_version = state["story_config"]["version"]
-            if savegame_version != self.story.config.version:
+            lazy_hops = self.story.config.savegame_lazy_hops if self.active_region else 0
+            story_config = deserializer.recreate_classes(reader.value("story_config"), None)
+            assert isinstance(story_config, StoryConfig)
+            if story_config.version != self.story.config.version:
                 existing_player.tell("\n")
                 existing_player.tell("<it>Note: the saved game data is from a different version of the game and may cause problems.</>")
                 existing_player.tell("We'll attempt to load it anyway. (Current game version: %s / Saved game data version: %s). "
-                                     % (self.story.config.version, savegame_version), end=True)
-            objects_finder = SavegameExistingObjectsFinder()
+                                     % (self.story.config.version, story_config.version), end=True)
+            self.story.config = story_config
 
-            clock = deserializer.recreate_classes(state.pop("clock"), None)
+            clock = deserializer.recreate_classes(reader.value("clock"), None)
             assert isinstance(clock, util.GameDateTime)
             self.game_clock = clock
 
-            story_config = deserializer.recreate_classes(state.pop("story_config"), None)
-            assert isinstance(story_config, StoryConfig)
-            self.story.config = story_config
-
-            exits_data = list(sorted(state.pop("exits"), key=lambda d: d.get("vnum")))
-            saved_exits = deserializer.recreate_classes(exits_data, objects_finder)
-            assert all(isinstance(e, base.Exit) for e in saved_exits)
-
-            items_data = list(sorted(state.pop("items"), key=lambda d: d.get("vnum")))
-            saved_items_info = deserializer.recreate_classes(items_data, objects_finder)
-            # link items contained in other items
-            for item_info in saved_items_info:
-                item = item_info["item"]
-                assert isinstance(item, base.Item)
-                if item_info["contains"]:
-                    if isinstance(item, base.Container):
-                        contained = {objects_finder.resolve_item_ref(*i_ref) for i_ref in item_info["contains"]}
-                        item.init_inventory(contained)
-                    else:
-                        raise errors.TaleError("can't put stuff in an item that isn't a Container")
-
-            loc_data = list(sorted(state.pop("locations"), key=lambda d: d.get("vnum")))
-            saved_locs = deserializer.recreate_classes(loc_data, objects_finder)
-            assert all(isinstance(l, base.Location) for l in saved_locs)
-
-            livings_data = list(sorted(state.pop("livings"), key=lambda d: d.get("vnum")))
-            saved_livings_info = deserializer.recreate_classes(livings_data, objects_finder)
-            for living_info in saved_livings_info:
-                living = living_info["living"]
-                assert isinstance(living, base.Living)
-                if living_info["inventory"]:
-                    contained = {objects_finder.resolve_item_ref(*i_ref) for i_ref in living_info["inventory"]}
-                    living.init_inventory(contained)
-                loc = objects_finder.resolve_location_ref(*living_info["location"])
-                if living.location and living.location is not loc:
-                    living.location.remove(living, living)
-                # we can't yet set following because it might still point to a non-existing player object. Do that later.
-                loc.insert(living, living)
-
-            saved_player_info = deserializer.recreate_classes(state.pop("player"), None)
+            player_data = reader.value("player")
+            deferreds_data = reader.value("deferreds")
+            loader = savegames.SavegameLoader(reader, deserializer)
+            objects_finder = loader.finder
+            if lazy_hops > 0:
+                # the player and the deferreds may refer to things that are far away in the freshly started world
+                loader.postpone_far_locations(objects_finder.resolve_location_ref(*player_data["location"]), lazy_hops,
+                                              [player_data["inventory"], deferreds_data], existing_player.location)
+            saved_livings_info = loader.load()
+
+            saved_player_info = deserializer.recreate_classes(player_data, None)
             saved_player = saved_player_info["player"]
             assert isinstance(saved_player, Player)
             base.MudObjRegistry.all_livings[saved_player.vnum] = saved_player   # type: ignore  # overwrite intermediate player object
@@ -384,22 +407,20 @@ class IFDriver(driver.Driver):
 
             # creatures that follow other creatures (or the player).
             # hook this up here at the end otherwise it may point to a non-existing player object.
-            for living_info in saved_livings_info:
-                if living_info["following"]:
-                    living = living_info["living"]
-                    assert isinstance(living, base.Living)
-                    living.following = objects_finder.resolve_living_ref(*living_info["following"])
+            loader.link_following(saved_livings_info)
 
-            saved_deferreds = deserializer.recreate_classes(state.pop("deferreds"), objects_finder)
+            saved_deferreds = deserializer.recreate_classes(deferreds_data, objects_finder)
             assert all(isinstance(d, driver.Deferred) for d in saved_deferreds)
-            self.deferreds = []
+            self.deferreds.clear()
             for d in saved_deferreds:
                 self._enqueue_deferred(d)
 
             # done, check
-            assert len(state) == 0, "everything must have been converted"
+            assert len(reader.values) == 0, "everything must have been converted"
+            loader.install()
 
             self.waiting_for_input = {}   # can't keep the old waiters around
+            self.savegame_checkpoint = None     # the next save writes a full savegame again
             saved_player.tell("\n")
             saved_player.tell("Game loaded.")
             if self.story.config.display_gametime:
@@ -409,48 +430,3 @@ class IFDriver(driver.Driver):
                 saved_player.privileges.add("wizard")
             return saved_player
 
-
-class SavegameExistingObjectsFinder:
-    def resolve_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> base.MudObject:
-        if baseclassname == "tale.base.Item":
-            return self.resolve_item_ref(vnum, name, classname, baseclassname)
-        elif baseclassname == "tale.base.Location":
-            return self.resolve_location_ref(vnum, name, classname, baseclassname)
-        elif baseclassname == "tale.base.Living":
-            return self.resolve_living_ref(vnum, name, classname, baseclassname)
-        else:
-            raise errors.TaleError("invalid base class for resolve_ref: " + baseclassname)
-
-    def resolve_location_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> base.Location:
-        loc = base.MudObjRegistry.all_locations.get(vnum, None)
-        if not loc:
-            raise LookupError("location vnum not found: " + str(vnum))
-        if loc.name != name or savegames.qual_baseclassname(loc) != baseclassname:
-            raise errors.TaleError("location inconsistency for vnum " + str(vnum))
-        return loc
-
-    def resolve_living_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> base.Living:
-        liv = base.MudObjRegistry.all_livings.get(vnum, None)
-        if not liv:
-            raise LookupError("living vnum not found: " + str(vnum))
-        if liv.name != name:
-            if savegames.qual_baseclassname(liv) != baseclassname:
-                if baseclassname == "tale.player.Player":
-                    return liv  # special case when the living is the Player
-                raise errors.TaleError("living inconsistency for vnum " + str(vnum))
-        return liv
-
-    def resolve_item_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> base.Item:
-        item = base.MudObjRegistry.all_items.get(vnum, None)
-        if not item:
-            raise LookupError("item vnum not found: " + str(vnum))
-        if item.name != name or savegames.qual_baseclassname(item) != baseclassname:
-            raise errors.TaleError("item inconsistency for vnum " + str(vnum))
-        return item
-
-    def resolve_exit(self, vnum: int, name: str, classname: str, baseclassname: str) -> Union[base.Exit, base.Door]:
-        assert baseclassname == "tale.base.Exit"
-        exit = base.MudObjRegistry.all_exits[vnum]
-        if exit.name != name or savegames.qual_baseclassname(exit) != baseclassname:
-            raise errors.TaleError("exit/door inconsistency for vnum " + str(vnum))
-        return exit
@@ -19,7 +19,7 @@ from . import lang
 from . import pubsub
 from . import util
 from .player import PlayerConnection, Player
-from .tio.mud_browser_io import TaleMudWsgiApp
+from .tio.mud_browser_io import TaleMudWsgiApp, MudHttpIo
 
 
 class MudDriver(driver.Driver):
@@ -32,25 +32,34 @@ class MudDriver(driver.Driver):
         self.game_mode = GameMode.MUD
         self.restricted = restricted   # restricted mud mode? (no new players allowed)
         self.mud_accounts = None   # type: accounts.MudAccounts
+        self.previous_server_tick = 0.0
 
     def start_main_loop(self):
         # Driver runs as main thread, wsgi webserver runs in background thread
         accounts_db_file = self.user_resources.validate_path("useraccounts.sqlite")
-        self.mud_accounts = accounts.MudAccounts(accounts_db_file)
+        self.mud_accounts = accounts.MudAccounts(accounts_db_file, self.story.config.mud_password_hash)
         base._limbo.init_inventory([LimboReaper()])  # add the grim reaper to Limbo
         wsgi_server = TaleMudWsgiApp.create_app_server(self, use_ssl=False, ssl_certs=None)    # you can enable SSL here
         wsgi_thread = threading.Thread(name="wsgi", target=wsgi_server.serve_forever)
         wsgi_thread.daemon = True
         wsgi_thread.start()
+        self._print_server_intro(wsgi_server.use_ssl, wsgi_server.server_address)
+        self._main_loop_wrapper(None)   # this doesn't return!
+
+    def _stop_driver(self) -> None:
+        super()._stop_driver()
+        if self.mud_accounts:
+            self.mud_accounts.close()
+
+    def _print_server_intro(self, use_ssl: bool, server_address: Tuple[str, int]) -> None:
         self.print_game_intro(None)
         if self.restricted:
             print("\n* Restricted mode: no new players allowed *\n")
-        protocol = "https" if wsgi_server.use_ssl else "http"
-        hostname, port = wsgi_server.server_address
+        protocol = "https" if use_ssl else "http"
+        hostname, port = server_address[:2]
         if hostname.startswith("127.0"):
             hostname = "localhost"
         print("Access the game on this web server url:   %s://%s:%d/tale/" % (protocol, hostname, port), end="\n\n")
-        self._main_loop_wrapper(None)   # this doesn't return!
 
     def show_motd(self, player: Player, notify_no_motd: bool=False) -> None:
         """Prints the Message-Of-The-Day file, if present."""
@@ -81,8 +90,7 @@ class MudDriver(driver.Driver):
         connect_name = "<connecting_%d>" % id(connection)  # unique temporary name
         new_player = Player(connect_name, "n", race="elemental", descr="This player is still connecting to the game.")
         connection.player = new_player
-        from .tio.mud_browser_io import MudHttpIo
-        connection.io = MudHttpIo(connection)
+        connection.io = self._create_player_io(connection)
         self.all_players[new_player.name] = connection
         connection.clear_screen()
         self.print_game_intro(connection)
@@ -96,6 +104,9 @@ class MudDriver(driver.Driver):
         driver.topic_async_dialogs.send((connection, self._login_dialog_mud(connection)))
         return connection
 
+    def _create_player_io(self, connection: PlayerConnection) -> MudHttpIo:
+        return MudHttpIo(connection)
+
     def disconnect_idling(self, conn: PlayerConnection) -> None:
         idle_limit = 3 * 60 * 60 if "wizard" in conn.player.privileges else 30 * 60
         if conn.idle_time > idle_limit:
@@ -156,7 +167,8 @@ class MudDriver(driver.Driver):
             else:
                 break
         stats = base.Stats.from_race(race, gender=gender[0])
-        self.mud_accounts.create(name, password, email, stats, privileges={"wizard"})
+        created = yield "wait", self.mud_accounts.submit(self.mud_accounts.create, name, password, email, stats, {"wizard"})
+        created.result()
         conn.output("<it>Okay, your admin account is ready. You can try logging in.</it>\n")
         conn.output("\n")
         yield from self._login_dialog_mud(conn)  # continue with the normal login dialog
@@ -198,7 +210,9 @@ class MudDriver(driver.Driver):
                     conn.player.tell("\n<bright>Your account has not been created!</>", end=True)
                     conn.player.tell("-- -- -- --", end=True)
                     continue
-                self.mud_accounts.create(name_info.name, name_info.password, name_info.email, name_info.stats)
+                created = yield "wait", self.mud_accounts.submit(self.mud_accounts.create, name_info.name, name_info.password,
+                                                                 name_info.email, name_info.stats)
+                created.result()
                 self.mud_accounts.save_story_data(name_info.name, name_info.story_data)
                 del name_info
                 conn.player.tell("\n<bright>Your new account has been created!</>  Go ahead and log in with it.", end=True)
@@ -208,8 +222,9 @@ class MudDriver(driver.Driver):
             # ask and validate the password.
             try:
                 password = yield "input-noecho", "Please type in your password."
-                self.mud_accounts.valid_password(name, password)
+                verified = yield "wait", self.mud_accounts.submit(self.mud_accounts.valid_password, name, password)
                 del password
+                verified.result()
             except ValueError as x:
                 conn.output("<it>%s</it>" % x)
                 continue
@@ -246,6 +261,7 @@ class MudDriver(driver.Driver):
             raise errors.SecurityViolation("unsuccessful login should have been handled")
 
         # login was succesful!!!
+        self.mud_accounts.logged_in(account.name)
 
         if existing_player:
             # take the place of already logged in player (that was disconnected perhaps?)
@@ -257,6 +273,8 @@ class MudDriver(driver.Driver):
                 if not name.startswith("_") and name not in ("vnum", "soul", "input_is_available", "teleported_from", "transcript"):
                     state[name] = value
             state["title"] = existing_player.title
+            state["aliases"] = existing_player.aliases
+            state["verbs"] = existing_player.verbs
             state["description"] = existing_player.description
             state["short_description"] = existing_player.short_description
             state["inventory"] = existing_player.inventory
@@ -322,71 +340,77 @@ class MudDriver(driver.Driver):
         The game loop, for the multiplayer MUD mode.
         Until the server is shut down, it processes player input, and prints the resulting output.
         """
-        loop_duration = 0.0
-        previous_server_tick = 0.0
         while not self._stop_mainloop:
-            pubsub.sync("driver-async-dialogs")
+            self._main_loop_flush_output()
+            # Server tick goes on a timer. Sleep until it is due, unless something else needs attention
+            # before that: player input and driver events (async dialogs, pending tells) signal the wakeup event.
+            # Deferreds are only ever processed in the server tick, so the tick deadline covers those as well.
+            wait_time = self._main_loop_wait_time()
+            if wait_time > 0:
+                self.wakeup.wait(wait_time)
+            self.wakeup.clear()
+            self._main_loop_process()
+
+    def _main_loop_flush_output(self) -> None:
+        pubsub.sync("driver-async-dialogs")
+        for conn in self.all_players.values():
+            conn.write_output()
+            if conn not in self.waiting_for_input:
+                conn.write_input_prompt()
+
+    def _main_loop_wait_time(self) -> float:
+        """the number of seconds until the next server tick is due"""
+        return self.previous_server_tick + self.story.config.server_tick_time - time.time()
+
+    def _main_loop_process(self) -> None:
+        """process the pending player input, and run the server tick if it is due"""
+        loop_start = time.time()
+        for conn in list(self.all_players.values()):
+            if conn.player.input_is_available.is_set():
+                conn.need_new_input_prompt = True
+                try:
+                    if conn in self.waiting_for_input:
+                        # this connection is processing direct input, rather than regular commands
+                        dialog, validator, echo_input = self.waiting_for_input.pop(conn)
+                        response = conn.player.get_pending_input()[0]
+                        if validator:
+                            try:
+                                response = validator(response)
+                            except ValueError as x:
+                                prompt = conn.last_output_line
+                                conn.io.dont_echo_next_cmd = not echo_input
+                                conn.output(str(x) or "That is not a valid answer.")
+                                conn.output_no_newline(prompt)   # print the input prompt again
+                                self.waiting_for_input[conn] = (dialog, validator, echo_input)   # reschedule
+                                continue
+                        self._continue_dialog(conn, dialog, response)
+                    else:
+                        # normal command processing
+                        self._server_loop_process_player_input(conn)
+                except (KeyboardInterrupt, EOFError):
+                    continue
+                except errors.SessionExit:
+                    self.story.goodbye(conn.player)
+                    driver.topic_pending_tells.send(lambda conn=conn: self.disconnect_player(conn))
+                except Exception:
+                    tb = "".join(util.format_traceback())
+                    txt = "\n<bright><rev>* internal error (please report this):</>\n" + tb
+                    conn.player.tell(txt, format=False)
+                    conn.player.tell("<rev><it>Please report this problem.</>")
+        try:
+            pubsub.sync("driver-pending-tells")
+            # server TICK
+            now = time.time()
+            if now - self.previous_server_tick >= self.story.config.server_tick_time:
+                self._server_tick()
+                self.previous_server_tick = now
+            loop_duration = time.time() - loop_start
+            self.server_loop_durations.append(loop_duration)
+        except errors.StoryCompleted:
+            print("StoryCompleted raised! But that should never happen in a MUD!")
             for conn in self.all_players.values():
-                conn.write_output()
-                if conn not in self.waiting_for_input:
-                    conn.write_input_prompt()
-
-            # server tick goes on a timer
-            wait_time = max(0.01, self.story.config.server_tick_time - loop_duration)
-            while wait_time > 0:
-                if any(conn.player.input_is_available.is_set() for conn in self.all_players.values()):
-                    # there was player input, abort the wait loop and deal with it
-                    break
-                sub_wait = min(0.1, wait_time)  # keep things responsive
-                time.sleep(sub_wait)
-                wait_time -= sub_wait
-
-            loop_start = time.time()
-            for conn in list(self.all_players.values()):
-                if conn.player.input_is_available.is_set():
-                    conn.need_new_input_prompt = True
-                    try:
-                        if conn in self.waiting_for_input:
-                            # this connection is processing direct input, rather than regular commands
-                            dialog, validator, echo_input = self.waiting_for_input.pop(conn)
-                            response = conn.player.get_pending_input()[0]
-                            if validator:
-                                try:
-                                    response = validator(response)
-                                except ValueError as x:
-                                    prompt = conn.last_output_line
-                                    conn.io.dont_echo_next_cmd = not echo_input
-                                    conn.output(str(x) or "That is not a valid answer.")
-                                    conn.output_no_newline(prompt)   # print the input prompt again
-                                    self.waiting_for_input[conn] = (dialog, validator, echo_input)   # reschedule
-                                    continue
-                            self._continue_dialog(conn, dialog, response)
-                        else:
-                            # normal command processing
-                            self._server_loop_process_player_input(conn)
-                    except (KeyboardInterrupt, EOFError):
-                        continue
-                    except errors.SessionExit:
-                        self.story.goodbye(conn.player)
-                        driver.topic_pending_tells.send(lambda conn=conn: self.disconnect_player(conn))
-                    except Exception:
-                        tb = "".join(util.format_traceback())
-                        txt = "\n<bright><rev>* internal error (please report this):</>\n" + tb
-                        conn.player.tell(txt, format=False)
-                        conn.player.tell("<rev><it>Please report this problem.</>")
-            try:
-                pubsub.sync("driver-pending-tells")
-                # server TICK
-                now = time.time()
-                if now - previous_server_tick >= self.story.config.server_tick_time:
-                    self._server_tick()
-                    previous_server_tick = now
-                loop_duration = time.time() - loop_start
-                self.server_loop_durations.append(loop_duration)
-            except errors.StoryCompleted:
-                print("StoryCompleted raised! But that should never happen in a MUD!")
                 conn.player.tell("<rev>StoryCompleted event in MUD mode - should NOT happen</> - Please report this error")
-                raise
+            raise
 
 
 class LimboReaper(base.Living):
@@ -0,0 +1,65 @@
+"""
+Mud driver (multi user server) running on a single asyncio event loop.
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import asyncio
+from typing import Optional
+
+from . import accounts
+from . import base
+from . import driver
+from .driver_mud import MudDriver, LimboReaper
+from .player import PlayerConnection
+from .tio.mud_async_io import AsyncTaleMudWsgiApp, AsyncMudHttpIo, LoopEvent
+
+
+class AsyncMudDriver(MudDriver):
+    """
+    Variant of the Mud driver that runs the game loop and the web server together on one asyncio event loop.
+    Browser connections don't tie up a server thread each (as they do with the threading wsgi server),
+    so a single process can keep many more players connected at the same time.
+    """
+    def __init__(self, restricted=False) -> None:
+        super().__init__(restricted)
+        self.loop = None    # type: asyncio.AbstractEventLoop
+
+    def start_main_loop(self):
+        accounts_db_file = self.user_resources.validate_path("useraccounts.sqlite")
+        self.mud_accounts = accounts.MudAccounts(accounts_db_file, self.story.config.mud_password_hash)
+        base._limbo.init_inventory([LimboReaper()])  # add the grim reaper to Limbo
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # player input and driver events now have to wake up a coroutine rather than a thread
+        self.wakeup = LoopEvent(self.loop)    # type: ignore
+        for t in (driver.topic_pending_actions, driver.topic_pending_tells, driver.topic_async_dialogs):
+            t.wakeup = self.wakeup    # type: ignore
+        server = AsyncTaleMudWsgiApp.create_app_server(self, use_ssl=False, ssl_certs=None)    # you can enable SSL here
+        server.start(self.loop)
+        self._print_server_intro(server.use_ssl, server.server_address)
+        try:
+            self._main_loop_wrapper(None)   # this doesn't return!
+        finally:
+            server.close(self.loop)
+            self.loop.close()
+
+    def _create_player_io(self, connection: PlayerConnection) -> AsyncMudHttpIo:
+        return AsyncMudHttpIo(connection, self.loop)
+
+    def main_loop(self, conn: Optional[PlayerConnection]) -> None:
+        """
+        The game loop, for the multiplayer MUD mode on an asyncio event loop.
+        The web server's requests are handled on the same loop while the game loop is waiting.
+        """
+        self.loop.run_until_complete(self.async_main_loop())
+
+    async def async_main_loop(self) -> None:
+        while not self._stop_mainloop:
+            self._main_loop_flush_output()
+            # same as the threaded main loop, but the wait lets the event loop run the web server meanwhile
+            wait_time = self._main_loop_wait_time()
+            await self.wakeup.wait(max(0.0, wait_time))     # type: ignore
+            self.wakeup.clear()
+            self._main_loop_process()
@@ -27,6 +27,7 @@ def run_from_cmdline(cmdline: Sequence[str]) -> None:
     parser.add_argument('-m', '--mode', type=str, help='game mode, default=if', default="if", choices=["if", "mud"])
     parser.add_argument('-i', '--gui', help='gui interface', action='store_true')
     parser.add_argument('-w', '--web', help='web browser interface', action='store_true')
+    parser.add_argument('-a', '--asyncio', help='run the mud server on a single asyncio event loop', action='store_true')
     parser.add_argument('-r', '--restricted', help='restricted mud mode; do not allow new players', action='store_true')
     parser.add_argument('-z', '--wizard', help='force wizard mode on if story character (for debug purposes)', action='store_true')
     args = parser.parse_args(cmdline)
@@ -37,8 +38,12 @@ def run_from_cmdline(cmdline: Sequence[str]) -> None:
             from .driver_if import IFDriver
             driver = IFDriver(screen_delay=args.delay, gui=args.gui, web=args.web, wizard_override=args.wizard)
         elif game_mode == GameMode.MUD:
-            from .driver_mud import MudDriver
-            driver = MudDriver(args.restricted)  # type: ignore
+            if args.asyncio:
+                from .driver_mud_async import AsyncMudDriver
+                driver = AsyncMudDriver(args.restricted)  # type: ignore
+            else:
+                from .driver_mud import MudDriver
+                driver = MudDriver(args.restricted)  # type: ignore
         else:
             raise ValueError("invalid game mode")
         driver.start(args.game)
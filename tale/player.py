@@ -161,6 +161,8 @@ class Player(base.Living, pubsub.Listener):
             self.transcript.write("\n\n>> %s\n" % cmd)
         self.input_is_available.set()
         self.last_input_time = time.time()
+        if mud_context.driver:
+            mud_context.driver.wakeup.set()   # let the driver's main loop know there's work to do
 
     @property
     def idle_time(self) -> float:
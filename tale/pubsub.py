@@ -30,17 +30,23 @@ Currently defined pubsub topics used by the Tale driver:
 
 """
 
+import collections
 import threading
 import time
 import weakref
-from typing import Dict, List, Tuple, Union, Optional, Set, Any
+from typing import Dict, List, Tuple, Union, Optional, Set, Any, NamedTuple, FrozenSet
 
 TopicNameType = Union[str, Tuple]
 
-__all__ = ["topic", "unsubscribe_all", "Listener"]
+__all__ = ["topic", "unsubscribe_all", "Listener", "TopicStats"]
 
 all_topics = {}  # type: Dict[TopicNameType, Topic]
 __topic_lock = threading.Lock()
+_subscriptions_lock = threading.Lock()
+_subscriptions = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[Listener, Set[TopicNameType]]  # reverse index
+
+TopicStats = NamedTuple("TopicStats", [("events_per_sec", float), ("total_events", int), ("max_queue_depth", int),
+                                       ("dispatch_time", float), ("dropped", int)])
 
 
 class Listener:
@@ -57,20 +63,50 @@ class Listener:
 class Topic:
     """
     A pubsub topic to send/receive events. You get these from the topic function.
+    Sending is lock free and can be done from any thread: the pending events are kept in a deque.
+    By default there is no limit on the number of pending events. If the topic is given a max_pending,
+    the oldest events are dropped when more than that are waiting.
     """
-    def __init__(self, name: TopicNameType) -> None:
+    rate_interval = 5.0     # seconds over which the events/sec rate is measured
+
+    def __init__(self, name: TopicNameType, max_pending: int=None) -> None:
         self.name = name
-        self.subscribers = set()  # type: Set[weakref.ReferenceType[Listener]]
-        self.events = []  # type: List[Any]
+        self.subscribers = frozenset()  # type: FrozenSet[weakref.ReferenceType[Listener]]   # replaced (not mutated) on every change
+        self.events = collections.deque(maxlen=max_pending)  # type: collections.deque
         self.last_event = time.time()  # type: float
+        self.wakeup = None  # type: Optional[threading.Event]  # if set, this event is signaled on every send
+        # statistics
+        self.total_events = 0
+        self.max_queue_depth = 0
+        self.dispatch_time = 0.0
+        self.dropped = 0
+        self.events_per_sec = 0.0
+        self._rate_start = self.last_event
+        self._rate_count = 0
 
     @property
     def idle_time(self) -> float:
         return time.time() - self.last_event
 
+    @property
+    def max_pending(self) -> Optional[int]:
+        return self.events.maxlen
+
+    @max_pending.setter
+    def max_pending(self, value: Optional[int]) -> None:
+        # replacing the deque while other threads are sending would lose their events, so only allow it up front
+        if self.total_events:
+            raise RuntimeError("the max_pending of a topic can only be changed before events are sent to it")
+        self.events = collections.deque(maxlen=value)
+
     def destroy(self) -> None:
         self.sync()
         del all_topics[self.name]
+        with _subscriptions_lock:
+            for subber_ref in self.subscribers:
+                subscriber = subber_ref()
+                if subscriber is not None:
+                    _subscriptions.get(subscriber, set()).discard(self.name)
         self.name = "<defunct>"
         del self.subscribers
         del self.events
@@ -78,23 +114,50 @@ class Topic:
     def subscribe(self, subscriber: Listener) -> None:
         if not isinstance(subscriber, Listener):
             raise TypeError("subscriber must be a Listener")
-        self.subscribers.add(weakref.ref(subscriber))
+        with _subscriptions_lock:
+            self.subscribers = self.subscribers | {weakref.ref(subscriber)}
+            _subscriptions.setdefault(subscriber, set()).add(self.name)
 
     def unsubscribe(self, subscriber: Listener) -> None:
-        self.subscribers.discard(weakref.ref(subscriber))
+        with _subscriptions_lock:
+            self.subscribers = self.subscribers - {weakref.ref(subscriber)}
+            _subscriptions.get(subscriber, set()).discard(self.name)
 
     def send(self, event: Any, synchronous: bool=False) -> Optional[List[Any]]:
-        self.events.append(event)
-        self.last_event = time.time()
+        events = self.events
+        depth = len(events) + 1
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        if events.maxlen is not None and depth > events.maxlen:
+            self.dropped += 1   # the deque discards the oldest event
+        events.append(event)
+        now = self.last_event = time.time()
+        self.total_events += 1
+        self._rate_count += 1
+        if now - self._rate_start >= self.rate_interval:
+            self.events_per_sec = self._rate_count / (now - self._rate_start)
+            self._rate_start = now
+            self._rate_count = 0
+        if self.wakeup:
+            self.wakeup.set()
         if synchronous:
             return self.sync()
         return None
 
     def sync(self) -> List[Any]:
-        events, self.events = self.events, []
-        results = []
-        for event in events:
-            results.extend(self.__sync_event(event))
+        # only process the events that are pending now, new ones sent meanwhile wait for the next sync
+        events = self.events
+        results = []  # type: List[Any]
+        num_events = len(events)
+        if num_events:
+            start = time.perf_counter()
+            for _ in range(num_events):
+                try:
+                    event = events.popleft()
+                except IndexError:
+                    break   # another thread synced them already
+                results.extend(self.__sync_event(event))
+            self.dispatch_time += time.perf_counter() - start
         return results
 
     def __sync_event(self, event: Any) -> List[Any]:
@@ -109,13 +172,26 @@ class Topic:
                     pass
         return results
 
+    def stats(self) -> TopicStats:
+        rate = self.events_per_sec
+        elapsed = time.time() - self._rate_start
+        if elapsed >= self.rate_interval:
+            rate = self._rate_count / elapsed   # the rate hasn't been updated by send() lately
+        return TopicStats(rate, self.total_events, self.max_queue_depth, self.dispatch_time, self.dropped)
 
-def topic(name: TopicNameType) -> Topic:
-    """Create a topic object (singleton). Name can be a string or a tuple."""
+
+def topic(name: TopicNameType, max_pending: int=None) -> Topic:
+    """
+    Create a topic object (singleton). Name can be a string or a tuple.
+    The max_pending limit of the pending events is only used if the topic doesn't exist yet (default: unlimited).
+    """
+    instance = all_topics.get(name)
+    if instance is not None:
+        return instance
     with __topic_lock:
         if name in all_topics:
             return all_topics[name]
-        instance = all_topics[name] = Topic(name)
+        instance = all_topics[name] = Topic(name, max_pending)
         return instance
 
 
@@ -131,12 +207,21 @@ def sync(topic: TopicNameType=None) -> List:
 
 def pending(topicname: TopicNameType=None) -> Dict[TopicNameType, Tuple[int, float, int]]:
     """Return a dictionary from topic name to tuple (number of pending events, idle time, num subbers)"""
-    with __topic_lock:
-        topics = [all_topics[topicname]] if topicname else list(all_topics.values())
-        return {t.name: (len(t.events), t.idle_time, len(t.subscribers)) for t in topics}
+    topics = [all_topics[topicname]] if topicname else list(all_topics.values())
+    return {t.name: (len(t.events), t.idle_time, len(t.subscribers)) for t in topics}
+
+
+def stats(topicname: TopicNameType=None) -> Dict[TopicNameType, TopicStats]:
+    """Return a dictionary from topic name to its dispatch statistics"""
+    topics = [all_topics[topicname]] if topicname else list(all_topics.values())
+    return {t.name: t.stats() for t in topics}
 
 
 def unsubscribe_all(subscriber: Listener) -> None:
     """unsubscribe the given subscriber object from all topics that it may have been subscribed to."""
-    for topic in list(all_topics.values()):
-        topic.unsubscribe(subscriber)
+    with _subscriptions_lock:
+        topicnames = _subscriptions.pop(subscriber, set())
+    for name in topicnames:
+        t = all_topics.get(name)
+        if t is not None:
+            t.unsubscribe(subscriber)
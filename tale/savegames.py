@@ -1,15 +1,24 @@
+import collections
 import datetime
+import decimal
+import enum
 import importlib
 import gzip
-from typing import Any, Tuple, List, Optional, Dict, Type, Sequence, Union
+import lzma
+import struct
+import threading
+import uuid
+import zlib
+from typing import Any, Tuple, List, Optional, Dict, Type, Sequence, Union, Set, Callable, Iterator
 
-from .base import Item, Location, Living, Exit, Door, MudObject, MudObjRegistry, Stats, _limbo
+from .base import Item, Container, Location, Living, Exit, Door, MudObject, MudObjRegistry, Stats, _limbo
 from .story import StoryConfig, MoneyType, GameMode, TickMethod
 from .player import Player
 from .errors import TaleError, ActionRefused
 from .hints import HintSystem
 from .driver import Deferred
 from .util import GameDateTime
+from .vfs import VirtualFileSystem
 from .shop import ShopBehavior, Shopkeeper
 import serpent
 
@@ -43,40 +52,430 @@ def qual_baseclassname(obj: MudObject) -> str:
         raise ValueError("cannot determine Tale base class", obj)
 
 
+_ref_baseclassnames = frozenset(qual_classname(c, cls=True) for c in (Location, Exit, Player, Living, Item))
+
+
+def is_mudobj_ref(value: Any) -> bool:
+    """is the (literal) value shaped exactly like a reference made by mudobj_ref?"""
+    return type(value) is tuple and len(value) == 4 and type(value[0]) is int and type(value[1]) is str \
+        and type(value[2]) is str and value[3] in _ref_baseclassnames
+
+
+class SaveCheckpoint:
+    """
+    Remembers the state of the objects in the savegame on disk (the full snapshot plus the deltas written after it),
+    as a digest of the saved record of every object. The next save can then be a delta that only contains the
+    objects whose state is different, without the game code having to tell which objects it changed.
+    """
+    kinds = ("items", "livings", "locations", "exits")
+
+    def __init__(self, snapshot: Dict[str, Any]) -> None:
+        self.num_deltas = 0
+        self.checksum = 0     # of the full savegame, set once it has been written
+        self.digests = {kind: self.digests_of(snapshot[kind]) for kind in self.kinds}   # type: Dict[str, Dict[int, int]]
+
+    @staticmethod
+    def digests_of(records: Sequence[Dict[str, Any]]) -> Dict[int, int]:
+        # (a set with the same elements can be listed in another order, that only means the object is saved again)
+        return {record["vnum"]: hash(repr(record)) for record in records}
+
+    def delta(self, snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reduce a full snapshot to a delta: only the objects whose state differs from the previous checkpoint,
+        plus the vnums of the objects that are gone. The story config, clock, deferreds and the player are always included.
+        The checkpoint then remembers the state of the new snapshot.
+        """
+        delta = dict(snapshot)
+        removed = {}
+        for kind in self.kinds:
+            saved, digests = self.digests[kind], self.digests_of(snapshot[kind])
+            delta[kind] = [record for record in snapshot[kind] if saved.get(record["vnum"]) != digests[record["vnum"]]]
+            removed[kind] = sorted(saved.keys() - digests.keys())
+            self.digests[kind] = digests
+        delta["removed"] = removed
+        return delta
+
+
+StateFunction = Callable[[Any], Dict[str, Any]]
+
+
+class BinaryCodec:
+    """
+    Compact binary savegame format, as an alternative to serpent's Python literal text.
+    All strings (attribute names and class names included) and all references to other mud objects
+    are interned in two tables in front of the data, and the state of every object is a length-prefixed record.
+    It encodes the plain data of a snapshot (see TaleSerializer.snapshot) and decoding produces the same plain data
+    as serpent.loads does for the text format, so the code that recreates the objects doesn't care which format was used.
+    """
+    magic = b"TALEBIN1"
+    compressions = {"": b"n", "zlib": b"z", "lzma": b"x"}
+
+    def __init__(self, compression: str="zlib") -> None:
+        if compression not in self.compressions:
+            raise ValueError("invalid savegame compression: " + compression)
+        self.compression = compression
+
+    def encode(self, data: Any) -> bytes:
+        strings = {}    # type: Dict[str, int]
+        refs = {}       # type: Dict[Tuple[int, str, str, str], int]
+        out = bytearray()
+        write = out.extend
+        pack_i = struct.Struct(">I").pack
+        pack_q = struct.Struct(">q").pack
+        pack_d = struct.Struct(">d").pack
+        pack_ref = struct.Struct(">qIII").pack
+
+        def string(s: str) -> bytes:
+            index = strings.get(s)
+            if index is None:
+                index = strings[s] = len(strings)
+            return pack_i(index)
+
+        def ref(r: Tuple[int, str, str, str]) -> bytes:
+            index = refs.get(r)
+            if index is None:
+                for s in r[1:]:
+                    string(s)
+                index = refs[r] = len(refs)
+            return pack_i(index)
+
+        def sequence(tag: bytes, obj: Any) -> None:
+            write(tag + pack_i(len(obj)))
+            for elt in obj:
+                encode(elt)
+
+        def encode(obj: Any) -> None:
+            t = type(obj)
+            if t is str:
+                index = strings.get(obj)
+                if index is None:
+                    index = strings[obj] = len(strings)
+                write(b"s" + pack_i(index))
+            elif t is dict:
+                if "__class__" in obj:
+                    # the state of an object, make it a record
+                    write(b"o\0\0\0\0")
+                    start = len(out)
+                write(b"d" + pack_i(len(obj)))
+                for key, value in obj.items():
+                    encode(key)
+                    encode(value)
+                if "__class__" in obj:
+                    out[start - 4:start] = pack_i(len(out) - start)
+            elif t is int:
+                if -0x8000000000000000 <= obj <= 0x7fffffffffffffff:
+                    write(b"i" + pack_q(obj))
+                else:
+                    write(b"I" + string(str(obj)))
+            elif t is tuple and len(obj) == 4 and type(obj[0]) is int and type(obj[1]) is type(obj[2]) is type(obj[3]) is str:
+                write(b"r" + ref(obj))     # shaped like a mudobj_ref, these occur many times over
+            elif obj is None:
+                write(b"N")
+            elif t is bool:
+                write(b"T" if obj else b"F")
+            elif t is float:
+                write(b"f" + pack_d(obj))
+            elif t is list:
+                sequence(b"l", obj)
+            elif t is tuple:
+                sequence(b"t", obj)
+            elif t is set or t is frozenset:
+                sequence(b"e" if obj else b"t", obj)    # serpent writes an empty set as (), do the same
+            elif t is bytes:
+                write(b"b" + pack_i(len(obj)) + obj)
+            # the remaining immutable types are written in the same way as serpent does:
+            elif isinstance(obj, enum.Enum):
+                encode(obj.value)
+            elif isinstance(obj, datetime.date):
+                encode(obj.isoformat())
+            elif isinstance(obj, (datetime.time, decimal.Decimal, uuid.UUID)):
+                encode(str(obj))
+            elif isinstance(obj, datetime.timedelta):
+                encode(obj.total_seconds())
+            else:
+                raise TypeError("cannot encode " + str(t) + " in a binary savegame, it's not plain data")
+
+        encode(data)
+        tables = bytearray(pack_i(len(strings)))
+        for s in strings:
+            encoded = s.encode("utf-8")
+            tables.extend(pack_i(len(encoded)) + encoded)
+        tables.extend(pack_i(len(refs)))
+        for vnum, name, classname, baseclassname in refs:
+            tables.extend(pack_ref(vnum, strings[name], strings[classname], strings[baseclassname]))
+        payload = bytes(tables + out)
+        if self.compression == "zlib":
+            payload = zlib.compress(payload)
+        elif self.compression == "lzma":
+            payload = lzma.compress(payload)
+        return self.magic + self.compressions[self.compression] + payload
+
+    def decode(self, data: bytes) -> Any:
+        decoder = BinaryDecoder(data)
+        return decoder.decode(decoder.start)[0]
+
+
+class BinaryDecoder:
+    """
+    Decodes (parts of) the data of a binary savegame. Because every object record is prefixed with its length,
+    records can be skipped without decoding them, to be decoded individually later.
+    """
+    unpack_i = struct.Struct(">I").unpack_from
+    unpack_q = struct.Struct(">q").unpack_from
+    unpack_d = struct.Struct(">d").unpack_from
+    ref_struct = struct.Struct(">qIII")
+    fixed_sizes = {b"s": 4, b"i": 8, b"r": 4, b"f": 8, b"I": 4, b"N": 0, b"T": 0, b"F": 0}
+
+    def __init__(self, data: bytes) -> None:
+        magic = BinaryCodec.magic
+        if not data.startswith(magic):
+            raise ValueError("not a binary savegame")
+        compression = data[len(magic):len(magic) + 1]
+        payload = data[len(magic) + 1:]
+        if compression == b"z":
+            payload = zlib.decompress(payload)
+        elif compression == b"x":
+            payload = lzma.decompress(payload)
+        elif compression != b"n":
+            raise ValueError("invalid savegame compression")
+        self.payload = payload
+        self.strings = []    # type: List[str]
+        self.refs = []       # type: List[Tuple[int, str, str, str]]
+        count, = self.unpack_i(payload, 0)
+        pos = 4
+        for _ in range(count):
+            size, = self.unpack_i(payload, pos)
+            self.strings.append(payload[pos + 4:pos + 4 + size].decode("utf-8"))
+            pos += 4 + size
+        count, = self.unpack_i(payload, pos)
+        pos += 4
+        for _ in range(count):
+            vnum, name, classname, baseclassname = self.ref_struct.unpack_from(payload, pos)
+            self.refs.append((vnum, self.strings[name], self.strings[classname], self.strings[baseclassname]))
+            pos += self.ref_struct.size
+        self.start = pos     # where the data begins
+
+    def decode(self, pos: int) -> Tuple[Any, int]:
+        """decode the value at the given position, returns it and the position after it"""
+        payload = self.payload
+        tag = payload[pos:pos + 1]
+        pos += 1
+        if tag == b"s":
+            return self.strings[self.unpack_i(payload, pos)[0]], pos + 4
+        elif tag == b"o":
+            return self.decode(pos + 4)     # the record length is only needed to skip over it
+        elif tag == b"d":
+            count, = self.unpack_i(payload, pos)
+            pos += 4
+            result = {}
+            decode = self.decode
+            for _ in range(count):
+                key, pos = decode(pos)
+                result[key], pos = decode(pos)
+            return result, pos
+        elif tag == b"i":
+            return self.unpack_q(payload, pos)[0], pos + 8
+        elif tag == b"r":
+            return self.refs[self.unpack_i(payload, pos)[0]], pos + 4
+        elif tag == b"N":
+            return None, pos
+        elif tag == b"T":
+            return True, pos
+        elif tag == b"F":
+            return False, pos
+        elif tag == b"f":
+            return self.unpack_d(payload, pos)[0], pos + 8
+        elif tag in (b"l", b"t", b"e"):
+            count, = self.unpack_i(payload, pos)
+            pos += 4
+            elements = []
+            decode = self.decode
+            for _ in range(count):
+                value, pos = decode(pos)
+                elements.append(value)
+            if tag == b"t":
+                return tuple(elements), pos
+            elif tag == b"e":
+                return set(elements), pos
+            return elements, pos
+        elif tag == b"I":
+            return int(self.strings[self.unpack_i(payload, pos)[0]]), pos + 4
+        elif tag == b"b":
+            size, = self.unpack_i(payload, pos)
+            return payload[pos + 4:pos + 4 + size], pos + 4 + size
+        raise ValueError("invalid binary savegame data at " + str(pos - 1))
+
+    def skip(self, pos: int) -> int:
+        """returns the position after the value at the given position, without decoding it"""
+        payload = self.payload
+        tag = payload[pos:pos + 1]
+        pos += 1
+        size = self.fixed_sizes.get(tag)
+        if size is not None:
+            return pos + size
+        if tag == b"o" or tag == b"b":
+            return pos + 4 + self.unpack_i(payload, pos)[0]
+        count, = self.unpack_i(payload, pos)
+        pos += 4
+        if tag == b"d":
+            count *= 2
+        elif tag not in (b"l", b"t", b"e"):
+            raise ValueError("invalid binary savegame data at " + str(pos - 5))
+        for _ in range(count):
+            pos = self.skip(pos)
+        return pos
+
+    def items(self, pos: int) -> Dict[Any, int]:
+        """the keys of the dict (or record) at the given position, with the positions of their (not yet decoded) values"""
+        if self.payload[pos:pos + 1] == b"o":
+            pos += 5
+        if self.payload[pos:pos + 1] != b"d":
+            raise ValueError("no dict at " + str(pos))
+        count, = self.unpack_i(self.payload, pos + 1)
+        pos += 5
+        result = {}
+        for _ in range(count):
+            key, pos = self.decode(pos)
+            result[key] = pos
+            pos = self.skip(pos)
+        return result
+
+    def elements(self, pos: int) -> List[int]:
+        """the positions of the (not yet decoded) elements of the list, tuple or set at the given position"""
+        tag = self.payload[pos:pos + 1]
+        if tag not in (b"l", b"t", b"e"):
+            raise ValueError("no sequence at " + str(pos))
+        count, = self.unpack_i(self.payload, pos + 1)
+        pos += 5
+        result = []
+        for _ in range(count):
+            result.append(pos)
+            pos = self.skip(pos)
+        return result
+
+
 class TaleSerializer:
     xor_key = 0x5c    # please do not hack the save files
+    delta_magic = b"TALEDELTA1"
+    codecs = ("serpent", "binary")
 
-    def __init__(self):
-        serpent.register_class(Player, self.serialize_player)
-        serpent.register_class(ShopBehavior, self.serialize_shopbehavior)
-        serpent.register_class(Location, self.serialize_location)
-        serpent.register_class(Stats, self.serialize_stats)
-        serpent.register_class(Item, self.serialize_item)
-        serpent.register_class(Living, self.serialize_living)
-        serpent.register_class(Exit, self.serialize_exit)
-        serpent.register_class(Deferred, self.serialize_deferred)
+    def __init__(self, codec: str="serpent", compression: str="zlib") -> None:
+        if codec not in self.codecs:
+            raise ValueError("invalid savegame codec: " + codec)
+        self.codec = codec
+        self.state_functions = [
+            (Player, self.player_state),
+            (ShopBehavior, self.shopbehavior_state),
+            (Location, self.location_state),
+            (Stats, self.stats_state),
+            (Item, self.item_state),
+            (Living, self.living_state),
+            (Exit, self.exit_state),
+            (Deferred, self.deferred_state)
+        ]   # type: List[Tuple[Type, StateFunction]]
+        self.type_states = {}   # type: Dict[Type, Optional[StateFunction]]
         self.serializer = serpent.Serializer(indent=True, module_in_classname=True)
+        self.binary = BinaryCodec(compression)
+
+    @staticmethod
+    def checksum(savegame: bytes) -> int:
+        """checksum of a full savegame, the deltas refer to it to make sure they're applied to the right savegame"""
+        return zlib.crc32(savegame)
+
+    def encode(self, snapshot: Dict[str, Any]) -> bytes:
+        """Encode the plain data of a snapshot. This doesn't touch any game object, so it can run in another thread."""
+        if self.codec == "binary":
+            return self.binary.encode(snapshot)
+        return self.obfuscate(self.serializer.serialize(snapshot))
+
+    def state_function(self, clazz: Type) -> Optional[StateFunction]:
+        try:
+            return self.type_states[clazz]
+        except KeyError:
+            for base, function in self.state_functions:
+                if issubclass(clazz, base):
+                    self.type_states[clazz] = function
+                    return function
+            self.type_states[clazz] = None
+            return None
+
+    def plain(self, obj: Any) -> Any:
+        """
+        Convert the object to plain data: a deep copy that consists only of builtin types (and immutable
+        things like dates and enums), with the game objects replaced by their state dicts.
+        """
+        t = type(obj)
+        if t is str or t is int or t is float or t is bool or obj is None or t is bytes:
+            return obj
+        if t is dict:
+            return {self.plain(k): self.plain(v) for k, v in obj.items()}
+        if t is list:
+            return [self.plain(x) for x in obj]
+        if t is tuple:
+            return tuple(self.plain(x) for x in obj)
+        if t is set or t is frozenset:
+            return {self.plain(x) for x in obj}
+        state_function = self.state_function(t)
+        if state_function:
+            return self.plain(state_function(obj))
+        if isinstance(obj, (enum.Enum, datetime.date, datetime.time, datetime.timedelta, decimal.Decimal, uuid.UUID)):
+            return obj
+        if isinstance(obj, (bytearray, memoryview)):
+            return bytes(obj)
+        if isinstance(obj, collections.UserString):
+            return str(obj)
+        if isinstance(obj, (dict, collections.UserDict)):
+            return self.plain(dict(obj))
+        if isinstance(obj, tuple):
+            return self.plain(tuple(obj))
+        if isinstance(obj, (list, collections.deque, collections.UserList)):
+            return self.plain(list(obj))
+        if isinstance(obj, (set, frozenset)):
+            return self.plain(set(obj))
+        # any other object is treated the same as serpent does: its __getstate__ or its vars, plus the class name
+        getstate = getattr(t, "__getstate__", None)
+        if getstate is not None and getstate is not getattr(object, "__getstate__", None):
+            state = obj.__getstate__()
+            if not isinstance(state, dict):
+                raise TypeError("don't know how to save " + str(t))
+            state = dict(state)
+        else:
+            state = dict(vars(obj))
+        state.setdefault("__class__", qual_classname(obj))
+        return self.plain(state)
 
     def serialize(self, story: StoryConfig, player: Player, items: Sequence[Item], livings: Sequence[Living],
                   locations: Sequence[Location], exits: Sequence[Exit],
-                  deferreds: Sequence[Deferred], clock: GameDateTime):
+                  deferreds: Sequence[Deferred], clock: GameDateTime) -> bytes:
+        return self.encode(self.snapshot(story, player, items, livings, locations, exits, deferreds, clock))
+
+    def snapshot(self, story: StoryConfig, player: Player, items: Sequence[Item], livings: Sequence[Living],
+                 locations: Sequence[Location], exits: Sequence[Exit],
+                 deferreds: Sequence[Deferred], clock: GameDateTime) -> Dict[str, Any]:
+        """
+        Capture the complete game state as plain data that no longer shares anything mutable with the game objects.
+        This has to be done on the game thread, but the (much slower) encoding and writing can then be done elsewhere.
+        """
         livings = [l for l in livings if l is not player]
         if _limbo not in locations:
             locations = list(locations)
             locations.append(_limbo)
-        if any(i not in items for i in player.inventory):
+        # sets of the object ids, to check the consistency in linear time
+        item_ids, living_ids = {id(i) for i in items}, {id(l) for l in livings}
+        location_ids, exit_ids = {id(loc) for loc in locations}, {id(e) for e in exits}
+        if any(id(i) not in item_ids for i in player.inventory):
             raise ValueError("missing item (from player inventory)")
-        if any(i not in items for living in livings for i in living.inventory):
+        if any(id(i) not in item_ids for living in livings for i in living.inventory):
             raise ValueError("missing item (from living inventory)")
-        if any(i not in items for loc in locations for i in loc.items):
+        if any(id(i) not in item_ids for loc in locations for i in loc.items):
             raise ValueError("missing item (from locations)")
-        if any(l is not player and l not in livings for loc in locations for l in loc.livings):
+        if any(l is not player and id(l) not in living_ids for loc in locations for l in loc.livings):
             raise ValueError("missing living (from locations)")
-        if any(living.location is not None and living.location not in locations for living in livings):
+        if any(living.location is not None and id(living.location) not in location_ids for living in livings):
             raise ValueError("missing location (from livings)")
-        if player.location is not None and player.location not in locations:
+        if player.location is not None and id(player.location) not in location_ids:
             raise ValueError("missing location (from player)")
-        if any(e not in exits for loc in locations for e in loc.exits.values()):
+        if any(id(e) not in exit_ids for loc in locations for e in loc.exits.values()):
             raise ValueError("missing exit (from location)")
         data = {
             # "story_version": story.version,
@@ -90,8 +489,14 @@ class TaleSerializer:
             "deferreds": deferreds,
             "player": player,
         }
-        serialized = self.serializer.serialize(data)
-        return self.obfuscate(serialized)
+        return self.plain(data)
+
+    def delta_record(self, payload: bytes, base_checksum: int) -> bytes:
+        """
+        Wrap an encoded delta (see SaveCheckpoint.delta) in a self-delimiting record, that is meant to be appended
+        to the delta file that belongs to the full savegame with the given checksum.
+        """
+        return self.delta_magic + struct.pack(">II", base_checksum, len(payload)) + payload
 
     def obfuscate(self, data: bytes) -> bytes:
         data = gzip.compress(data)
@@ -101,26 +506,31 @@ class TaleSerializer:
         state["__class__"] = qual_classname(obj)
         state["__base_class__"] = qual_baseclassname(obj)
         state["title"] = obj.title
+        state["aliases"] = obj.aliases
+        state["verbs"] = obj.verbs
         state["descr"] = obj.description
         state["short_descr"] = obj.short_description
         state["extra_desc"] = obj.extra_desc
 
     def add_inventory_property(self, state: Dict[str, Any], obj: MudObject) -> None:
-        try:
-            inv = obj.inventory     # type: ignore
-        except (AttributeError, ActionRefused):
-            pass   # this thing doesn't have inventory
+        if isinstance(obj, Container):
+            inv = Container.inventory.fget(obj)     # also the contents of a closed box
         else:
-            state["inventory"] = {mudobj_ref(m) for m in inv}
+            try:
+                inv = obj.inventory     # type: ignore
+            except (AttributeError, ActionRefused):
+                return   # this thing doesn't have inventory
+        state["inventory"] = {mudobj_ref(m) for m in inv}
 
-    def serialize_shopbehavior(self, obj: ShopBehavior, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def shopbehavior_state(self, obj: ShopBehavior) -> Dict[str, Any]:
         state = dict(vars(obj))
         state["__class__"] = qual_classname(obj)
         state["forsale"] = {mudobj_ref(i) for i in state["forsale"]}
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_deferred(self, obj: Deferred, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def deferred_state(self, obj: Deferred) -> Dict[str, Any]:
         state = dict(vars(obj))
+        del state["_resolved_action"]   # just a cache
         state["__class__"] = qual_classname(obj)
         if not isinstance(state["owner"], str):
             try:
@@ -128,9 +538,9 @@ class TaleSerializer:
             except Exception:
                 # owner is not a regular mudobj
                 state["owner"] = "class:" + qual_classname(state["owner"])
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_stats(self, obj: Stats, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def stats_state(self, obj: Stats) -> Dict[str, Any]:
         state = {
             "__class__": qual_classname(obj),
             "race": obj.race,
@@ -144,9 +554,9 @@ class TaleSerializer:
             "alignment": obj.alignment
             # the other attributes are re-initialized from the races table
         }
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_player(self, obj: Player, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def player_state(self, obj: Player) -> Dict[str, Any]:
         state = dict(vars(obj))
         # remove stuff we don't want to serialize at all
         unserialized_attrs = {"subjective", "possessive", "objective", "teleported_from", "soul",
@@ -169,9 +579,9 @@ class TaleSerializer:
         state["location"] = mudobj_ref(state["location"])
         state["inventory"] = {mudobj_ref(thing) for thing in obj.inventory}
         state["following"] = mudobj_ref(state["following"])
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_item(self, obj: Item, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def item_state(self, obj: Item) -> Dict[str, Any]:
         if obj.contained_in and obj not in obj.contained_in:
             raise TaleError("item {} containment inconsistency".format(obj))
         state = dict(vars(obj))
@@ -183,9 +593,9 @@ class TaleSerializer:
                 del state[name]
         self.add_basic_properties(state, obj)  # basic properties
         self.add_inventory_property(state, obj)  # inventory (of Container subtype)
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_living(self, obj: Living, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def living_state(self, obj: Living) -> Dict[str, Any]:
         if obj.location and obj.location is not _limbo and obj not in obj.location:
             raise TaleError("living {} location inconsistency".format(obj))
         state = dict(vars(obj))
@@ -206,9 +616,9 @@ class TaleSerializer:
         state["location"] = mudobj_ref(state["location"])
         state["inventory"] = {mudobj_ref(thing) for thing in obj.inventory}
         state["following"] = mudobj_ref(state["following"])
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_exit(self, obj: Exit, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def exit_state(self, obj: Exit) -> Dict[str, Any]:
         state = dict(vars(obj))
         # remove stuff we don't want to serialize at all
         for name in list(state):
@@ -219,9 +629,9 @@ class TaleSerializer:
         if "linked_door" in state:
             # it's probably a Door, and linked_door referes to another door (cyclic)
             state["linked_door"] = mudobj_ref(state["linked_door"])
-        ser._serialize(state, out, indentlevel)
+        return state
 
-    def serialize_location(self, obj: Location, ser: serpent.Serializer, out: List[str], indentlevel: int) -> None:
+    def location_state(self, obj: Location) -> Dict[str, Any]:
         state = dict(vars(obj))
         # remove stuff we don't want to serialize at all
         for name in list(state):
@@ -229,14 +639,140 @@ class TaleSerializer:
                 del state[name]
         self.add_basic_properties(state, obj)
         # livings and items, and the exits, present in this location:
-        state["livings"] = {mudobj_ref(l) for l in state["livings"]}
-        state["items"] = {mudobj_ref(i) for i in state["items"]}
+        state["livings"] = {mudobj_ref(l) for l in obj.livings}
+        state["items"] = {mudobj_ref(i) for i in obj.items}
         state["exits"] = {mudobj_ref(e) for e in state["exits"].values()}
-        ser._serialize(state, out, indentlevel)
+        return state
+
+
+class SavegameWriter(threading.Thread):
+    """
+    Encodes a snapshot of the game state and writes it to the savegame files, in the background.
+    A full savegame replaces the previous one atomically, so a crash halfway never corrupts the savegame
+    that is already there. A delta is appended to the delta file (a truncated record is ignored when loading).
+    The stage and progress attributes tell how far it is. When it's finished (or failed) it calls on_done with itself.
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self, serializer: TaleSerializer, resources: VirtualFileSystem, filename: str, snapshot: Dict[str, Any],
+                 checkpoint: SaveCheckpoint, delta: bool, on_done: Callable[['SavegameWriter'], None]) -> None:
+        super().__init__(name="savegame-writer", daemon=True)
+        self.serializer = serializer
+        self.resources = resources
+        self.filename = filename
+        self.snapshot = snapshot
+        self.checkpoint = checkpoint
+        self.delta = delta
+        self.on_done = on_done
+        self.stage = "waiting"
+        self.progress = 0.0
+        self.error = None   # type: Exception
+
+    def run(self) -> None:
+        try:
+            self.stage = "encoding"
+            data = self.serializer.encode(self.snapshot)
+            self.snapshot = None
+            self.progress = 0.5
+            self.stage = "writing"
+            if self.delta:
+                data = self.serializer.delta_record(data, self.checkpoint.checksum)
+                with self.resources.open_write(self.filename + ".delta", mimetype="application/octet-stream", append=True) as out:
+                    self.write(out, data)
+            else:
+                with self.resources.open_write_atomic(self.filename, mimetype="application/octet-stream") as out:
+                    self.write(out, data)
+                self.checkpoint.checksum = self.serializer.checksum(data)
+                del self.resources[self.filename + ".delta"]    # these belong to the previous savegame
+            self.stage = "done"
+            self.progress = 1.0
+        except Exception as x:
+            self.error = x
+            self.stage = "failed"
+        finally:
+            self.on_done(self)
+
+    def write(self, out: Any, data: bytes) -> None:
+        for start in range(0, len(data), self.chunk_size):
+            out.write(data[start:start + self.chunk_size])
+            self.progress = 0.5 + 0.5 * min(len(data), start + self.chunk_size) / len(data)
+
+
+class SavegameReader:
+    """
+    Access to the contents of a savegame (and the deltas merged into it) one object record at a time.
+    The records are looked up by kind ("items", "livings", "locations", "exits") and vnum.
+    For the binary format a record is only decoded when it is taken, so the literal tree of the
+    whole world never has to be in memory at once. The serpent text format has to be parsed in one go.
+    """
+    def __init__(self, data: bytes, deserializer: 'TaleDeserializer') -> None:
+        # the records and values are either decoded already, or they are the position of their binary data
+        self.records = {kind: {} for kind in SaveCheckpoint.kinds}   # type: Dict[str, Dict[int, Any]]
+        self.values = {}    # type: Dict[str, Any]
+        self.encoded = set()     # type: Set[Tuple[str, int]]   # the (kind, vnum) of the records that are still encoded
+        if data.startswith(BinaryCodec.magic):
+            self.decoder = BinaryDecoder(data)   # type: Optional[BinaryDecoder]
+            for name, pos in self.decoder.items(self.decoder.start).items():
+                if name in self.records:
+                    records = self.records[name]
+                    for record_pos in self.decoder.elements(pos):
+                        vnum = self.decoder.decode(self.decoder.items(record_pos)["vnum"])[0]
+                        records[vnum] = record_pos
+                        self.encoded.add((name, vnum))
+                else:
+                    self.values[name] = self.decoder.decode(pos)[0]
+        else:
+            self.decoder = None
+            state = deserializer.deserialize(data)
+            for kind, records in self.records.items():
+                for record in state.pop(kind):
+                    records[record["vnum"]] = record
+            self.values = state
+
+    def value(self, name: str) -> Any:
+        """take one of the other values from the savegame: story_config, clock, player, deferreds"""
+        return self.values.pop(name)
+
+    def vnums(self, kind: str) -> List[int]:
+        return sorted(self.records[kind])
+
+    def __contains__(self, kind_and_vnum: Tuple[str, int]) -> bool:
+        kind, vnum = kind_and_vnum
+        return vnum in self.records[kind]
+
+    def take(self, kind: str, vnum: int) -> Dict[str, Any]:
+        """decode the record and remove it from the reader (as it is used to recreate the object)"""
+        record = self.records[kind].pop(vnum)
+        if (kind, vnum) in self.encoded:
+            self.encoded.remove((kind, vnum))
+            record = self.decoder.decode(record)[0]
+        return record
+
+    def fields(self, kind: str, vnum: int, names: Set[str]) -> Dict[str, Any]:
+        """decode just some of the fields of a record, leaving it in the reader"""
+        record = self.records[kind][vnum]
+        if (kind, vnum) in self.encoded:
+            positions = self.decoder.items(record)
+            return {name: self.decoder.decode(positions[name])[0] for name in names if name in positions}
+        return {name: record[name] for name in names if name in record}
+
+    def apply_delta(self, delta: Dict[str, Any]) -> None:
+        """Merge a (deserialized) delta into the savegame"""
+        removed = delta.pop("removed")
+        for kind, records in self.records.items():
+            for vnum in removed[kind]:
+                records.pop(vnum, None)
+                self.encoded.discard((kind, vnum))
+            for record in delta.pop(kind):
+                records[record["vnum"]] = record
+                self.encoded.discard((kind, record["vnum"]))
+        self.values.update(delta)
 
 
 class TaleDeserializer:
-    def deserialize(self, data):
+    def deserialize(self, data: bytes) -> Any:
+        if data.startswith(BinaryCodec.magic):
+            return BinaryCodec().decode(data)
         return serpent.loads(self.deobfuscate(data))
 
     def deobfuscate(self, data: bytes) -> bytes:
@@ -244,6 +780,31 @@ class TaleDeserializer:
             return data
         return gzip.decompress(bytes(b ^ TaleSerializer.xor_key for b in data[9:]))
 
+    def deserialize_deltas(self, data: bytes, base_checksum: int) -> List[Dict[str, Any]]:
+        """
+        Deserialize the records of a delta file, in the order they were written.
+        Records that don't belong to the full savegame with the given checksum are skipped
+        (they are left over from an interrupted save), and so is a truncated last record.
+        """
+        deltas = []
+        magic = TaleSerializer.delta_magic
+        header_size = len(magic) + 8
+        pos = 0
+        while pos + header_size <= len(data):
+            if data[pos:pos + len(magic)] != magic:
+                raise ValueError("invalid savegame delta record")
+            checksum, size = struct.unpack(">II", data[pos + len(magic):pos + header_size])
+            pos += header_size
+            if pos + size > len(data):
+                break   # the game was interrupted while it was writing this one
+            if checksum == base_checksum:
+                deltas.append(self.deserialize(data[pos:pos + size]))
+            pos += size
+        return deltas
+
+    def reader(self, data: bytes) -> 'SavegameReader':
+        return SavegameReader(data, self)
+
     def recreate_classes(self, literal, existing_object_lookup):
         t = type(literal)
         if t is set:
@@ -330,10 +891,7 @@ class TaleDeserializer:
         try:
             item = existing_object_lookup.resolve_item_ref(data["vnum"], data["name"], data["__class__"], data["__base_class__"])
             if item.contained_in:
-                wizard = Living("wizard", "m")
-                wizard.privileges.add("wizard")
-                item.contained_in.remove(item, wizard)   # will be hooked up later again
-                assert item.contained_in is None
+                self.detach_item(item)   # will be hooked up later again
         except LookupError:
             # create new item
             itemclass = self.lookup_class(data["__class__"])
@@ -356,10 +914,7 @@ class TaleDeserializer:
         try:
             money = existing_object_lookup.resolve_item_ref(data["vnum"], data["name"], data["__class__"], data["__base_class__"])
             if money.contained_in:
-                wizard = Living("wizard", "m")
-                wizard.privileges.add("wizard")
-                money.contained_in.remove(money, wizard)   # will be hooked up later again
-                assert money.contained_in is None
+                self.detach_item(money)   # will be hooked up later again
         except LookupError:
             # create new money item
             itemclass = self.lookup_class(data["__class__"])
@@ -378,6 +933,15 @@ class TaleDeserializer:
             "contains": None
         }
 
+    def detach_item(self, item: Item) -> None:
+        wizard = Living("wizard", "m")
+        wizard.privileges.add("wizard")
+        if isinstance(item.contained_in, Container):
+            Container.remove(item.contained_in, item, wizard)    # also when it's in a closed box
+        else:
+            item.contained_in.remove(item, wizard)
+        assert item.contained_in is None
+
     def make_Living(self, data: Dict, existing_object_lookup) -> Dict[str, Any]:
         try:
             living = existing_object_lookup.resolve_living_ref(data["vnum"], data["name"], data["__class__"], data["__base_class__"])
@@ -513,3 +1077,202 @@ class TaleDeserializer:
                 else:
                     raise TypeError("{}.{} has different type".format(obj.__class__, name))
             setattr(obj, name, value)
+
+
+class SavegameLoader:
+    """
+    Recreates the objects from a savegame one record at a time, on top of the objects of the freshly started story.
+    Loading the locations that are far away from the player can be postponed: the saved state of such a location,
+    and of the items and livings in it, is only applied when it is first needed (see Location.materialize).
+    That is only done for locations that still contain the very same things as in the savegame, and of which
+    nothing ended up somewhere else, so everything is in the same place as when it would have been loaded right away.
+    """
+    def __init__(self, reader: SavegameReader, deserializer: TaleDeserializer) -> None:
+        self.reader = reader
+        self.deserializer = deserializer
+        self.finder = SavegameExistingObjectsFinder()
+        self.postponed = {}    # type: Dict[int, Tuple[Set[int], Set[int]]]   # location vnum -> vnums of the items and livings in it
+
+    def postpone_far_locations(self, start: Location, hops: int, references: List[Any], other: Location=None) -> None:
+        """
+        Postpone loading the locations that are more than the given number of exits away from the start location
+        (and aren't the other location). References are other saved values that will be loaded right away
+        such as the player's inventory, things they refer to are never postponed.
+        """
+        near = {start, other}
+        frontier = [start]
+        for _ in range(hops):
+            frontier = [neighbor for location in frontier for neighbor in location.nearby(no_traps=False) if neighbor not in near]
+            near.update(frontier)
+        owners = {}     # type: Dict[int, int]   # vnum of an item or living -> vnum of the postponed location it is in
+        for location in list(MudObjRegistry.all_locations.values()):
+            if location in near or ("locations", location.vnum) not in self.reader:
+                continue
+            saved = self.reader.fields("locations", location.vnum, {"items", "livings"})
+            if {ref[0] for ref in saved["items"]} != {i.vnum for i in location.items} or \
+                    {ref[0] for ref in saved["livings"]} != {l.vnum for l in location.livings}:
+                continue
+            self.postponed[location.vnum] = self.contents(location)
+            for vnums in self.postponed[location.vnum]:
+                owners.update(dict.fromkeys(vnums, location.vnum))
+        # Whatever is held by something that is loaded right away, can't be in a postponed location.
+        # That location has to be loaded right away as well then (which, in turn, can hold other things).
+        claimed = set()    # type: Set[int]
+        claims = list(self.references(references))
+        pending = [(kind, vnum) for kind in ("items", "livings", "locations")
+                   for vnum in self.reader.vnums(kind) if not self.is_postponed(kind, vnum, owners)]
+        while pending or claims:
+            for kind, vnum in pending:
+                claims.extend(self.references(self.reader.fields(kind, vnum, {"inventory", "items", "livings"})))
+            pending = []
+            for vnum in claims:
+                claimed.add(vnum)
+                location_vnum = owners.get(vnum)
+                if location_vnum in self.postponed:
+                    items, livings = self.postponed.pop(location_vnum)
+                    pending.append(("locations", location_vnum))
+                    pending.extend(("items", v) for v in items if ("items", v) in self.reader)
+                    pending.extend(("livings", v) for v in livings if ("livings", v) in self.reader)
+            claims = []
+        # Something that is nowhere in the loaded part, has moved into a postponed location. Don't postpone anything then.
+        for kind in ("items", "livings"):
+            if any(vnum not in claimed and not self.is_postponed(kind, vnum, owners) for vnum in self.reader.vnums(kind)):
+                self.postponed.clear()
+                return
+
+    def is_postponed(self, kind: str, vnum: int, owners: Dict[int, int]) -> bool:
+        if kind == "locations":
+            return vnum in self.postponed
+        return owners.get(vnum) in self.postponed
+
+    @staticmethod
+    def contents(location: Location) -> Tuple[Set[int], Set[int]]:
+        """the vnums of all items (also those inside other things) and livings in the location"""
+        livings = {living.vnum for living in location.livings}
+        items = set()   # type: Set[int]
+        todo = list(location.items)
+        for living in location.livings:
+            todo.extend(living.inventory)
+        while todo:
+            item = todo.pop()
+            items.add(item.vnum)
+            if isinstance(item, Container):
+                todo.extend(Container.inventory.fget(item))     # also when it's a closed box
+        return items, livings
+
+    @staticmethod
+    def references(value: Any) -> Iterator[int]:
+        """the vnums of the objects referred to in the (literal) saved value"""
+        if is_mudobj_ref(value):
+            yield value[0]
+        elif isinstance(value, (list, tuple, set)):
+            for v in value:
+                yield from SavegameLoader.references(v)
+        elif isinstance(value, dict):
+            for v in value.values():
+                yield from SavegameLoader.references(v)
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Load all exits and everything that isn't postponed. Returns the livings info to link up the followers later."""
+        for vnum in self.reader.vnums("exits"):
+            exit = self.deserializer.recreate_classes(self.reader.take("exits", vnum), self.finder)
+            assert isinstance(exit, Exit)
+        postponed_vnums = set()     # type: Set[int]
+        for items, livings in self.postponed.values():
+            postponed_vnums |= items | livings
+        return self.load_records([v for v in self.reader.vnums("items") if v not in postponed_vnums],
+                                 [v for v in self.reader.vnums("locations") if v not in self.postponed],
+                                 [v for v in self.reader.vnums("livings") if v not in postponed_vnums])
+
+    def load_records(self, item_vnums: List[int], location_vnums: List[int], living_vnums: List[int]) -> List[Dict[str, Any]]:
+        saved_items_info = [self.deserializer.recreate_classes(self.reader.take("items", vnum), self.finder)
+                            for vnum in item_vnums if ("items", vnum) in self.reader]
+        # link items contained in other items
+        for item_info in saved_items_info:
+            item = item_info["item"]
+            assert isinstance(item, Item)
+            if item_info["contains"]:
+                if isinstance(item, Container):
+                    contained = {self.finder.resolve_item_ref(*i_ref) for i_ref in item_info["contains"]}
+                    item.init_inventory(contained)
+                else:
+                    raise TaleError("can't put stuff in an item that isn't a Container")
+        for vnum in location_vnums:
+            loc = self.deserializer.recreate_classes(self.reader.take("locations", vnum), self.finder)
+            assert isinstance(loc, Location)
+        saved_livings_info = [self.deserializer.recreate_classes(self.reader.take("livings", vnum), self.finder)
+                              for vnum in living_vnums if ("livings", vnum) in self.reader]
+        for living_info in saved_livings_info:
+            living = living_info["living"]
+            assert isinstance(living, Living)
+            if living_info["inventory"]:
+                contained = {self.finder.resolve_item_ref(*i_ref) for i_ref in living_info["inventory"]}
+                living.init_inventory(contained)
+            loc = self.finder.resolve_location_ref(*living_info["location"])
+            if living.location and living.location is not loc:
+                living.location.remove(living, living)
+            # we can't yet set following because it might still point to a non-existing player object. Do that later.
+            loc.insert(living, living)
+        return saved_livings_info
+
+    def link_following(self, saved_livings_info: List[Dict[str, Any]]) -> None:
+        for living_info in saved_livings_info:
+            if living_info["following"]:
+                living = living_info["living"]
+                assert isinstance(living, Living)
+                living.following = self.finder.resolve_living_ref(*living_info["following"])
+
+    def install(self) -> None:
+        """Let the postponed locations load their saved state when they're needed"""
+        for vnum in self.postponed:
+            MudObjRegistry.all_locations[vnum]._lazy_loader = self.materialize
+
+    def materialize(self, location: Location) -> None:
+        items, livings = self.postponed.pop(location.vnum)
+        self.link_following(self.load_records(sorted(items), [location.vnum], sorted(livings)))
+
+
+class SavegameExistingObjectsFinder:
+    def resolve_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> MudObject:
+        if baseclassname == "tale.base.Item":
+            return self.resolve_item_ref(vnum, name, classname, baseclassname)
+        elif baseclassname == "tale.base.Location":
+            return self.resolve_location_ref(vnum, name, classname, baseclassname)
+        elif baseclassname == "tale.base.Living":
+            return self.resolve_living_ref(vnum, name, classname, baseclassname)
+        else:
+            raise TaleError("invalid base class for resolve_ref: " + baseclassname)
+
+    def resolve_location_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> Location:
+        loc = MudObjRegistry.all_locations.get(vnum, None)
+        if not loc:
+            raise LookupError("location vnum not found: " + str(vnum))
+        if loc.name != name or qual_baseclassname(loc) != baseclassname:
+            raise TaleError("location inconsistency for vnum " + str(vnum))
+        return loc
+
+    def resolve_living_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> Living:
+        liv = MudObjRegistry.all_livings.get(vnum, None)
+        if not liv:
+            raise LookupError("living vnum not found: " + str(vnum))
+        if liv.name != name:
+            if qual_baseclassname(liv) != baseclassname:
+                if baseclassname == "tale.player.Player":
+                    return liv  # special case when the living is the Player
+                raise TaleError("living inconsistency for vnum " + str(vnum))
+        return liv
+
+    def resolve_item_ref(self, vnum: int, name: str, classname: str, baseclassname: str) -> Item:
+        item = MudObjRegistry.all_items.get(vnum, None)
+        if not item:
+            raise LookupError("item vnum not found: " + str(vnum))
+        if item.name != name or qual_baseclassname(item) != baseclassname:
+            raise TaleError("item inconsistency for vnum " + str(vnum))
+        return item
+
+    def resolve_exit(self, vnum: int, name: str, classname: str, baseclassname: str) -> Union[Exit, Door]:
+        assert baseclassname == "tale.base.Exit"
+        exit = MudObjRegistry.all_exits[vnum]
+        if exit.name != name or qual_baseclassname(exit) != baseclassname:
+            raise TaleError("exit/door inconsistency for vnum " + str(vnum))
+        return exit
@@ -64,12 +64,18 @@ class StoryConfig:
         self.startlocation_player = ""       # name of the location where a player starts the game in
         self.startlocation_wizard = ""       # name of the location where a wizard player starts the game in
         self.savegames_enabled = True        # allow savegames?
+        self.savegame_max_deltas = 10        # incremental saves to write after a full savegame, before writing a full one again
+        self.savegame_codec = "serpent"      # format of the savegame data: "serpent" (python literals, text) or "binary"
+        self.savegame_compression = "zlib"   # compression for the binary savegame format: "zlib", "lzma" or "" (none)
+        self.savegame_lazy_hops = 0          # loading a game postpones locations this many exits away from the player (0=load all)
         self.show_exits_in_look = True       # with the look command, also show exit descriptions automatically?
         self.license_file = ""               # game license file, if applicable
         self.mud_host = ""                   # for mud mode: hostname to bind the server on
         self.mud_port = 0                    # for mud mode: port number to bind the server on
+        self.mud_password_hash = "pbkdf2"    # for mud mode: how the account passwords are hashed, "pbkdf2" or "scrypt"
         self.zones = []                      # type: List[str]  # names of zone modules to load, in this order
         self.server_mode = GameMode.IF       # the actual game mode the server is operating in (will be set at startup time)
+        self.active_region_hops = None       # type: int  # if set, batched behaviors only run this many exits away from players
 
     def __eq__(self, other: Any) -> bool:
         return isinstance(other, StoryConfig) and vars(self) == vars(other)
@@ -5,7 +5,9 @@ Webbrowser based I/O for a single player ('if') story.
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 import json
+import os
 import time
+import zlib
 from socketserver import ThreadingMixIn
 from email.utils import formatdate, parsedate
 from hashlib import md5
@@ -22,7 +24,7 @@ from .. import __version__ as tale_version_str
 from ..driver import Driver
 from ..player import PlayerConnection
 
-__all__ = ["HttpIo", "TaleWsgiApp", "TaleWsgiAppBase", "WsgiStartResponseType"]
+__all__ = ["HttpIo", "TaleWsgiApp", "TaleWsgiAppBase", "WsgiStartResponseType", "StaticAsset"]
 
 WsgiStartResponseType = Callable[..., None]
 
@@ -52,6 +54,60 @@ def squash_parameters(parameters: Dict[str, Any]) -> Dict[str, Any]:
     return parameters
 
 
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """Does the value of an Accept-Encoding request header allow the given content-coding (such as 'gzip')?"""
+    wildcard = False
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == coding:
+            return quality > 0
+        if name == "*":
+            wildcard = quality > 0
+    return wildcard
+
+
+class StaticAsset:
+    """
+    A static web asset that is prepared once to be served many times: the body encoded
+    as it is sent, a gzipped version of it (if that is worthwhile) and the caching headers.
+    Memory mapped resources have no body here, they're streamed from the file.
+    """
+    gzip_min_size = 256
+    compressible_types = {"application/javascript", "application/x-javascript", "image/svg+xml",
+                          "image/x-icon", "image/vnd.microsoft.icon"}
+
+    def __init__(self, resource: vfs.Resource, etag: str) -> None:
+        self.resource = resource
+        self.etag = etag
+        self.gzip_etag = etag[:-1] + '-gzip"'
+        self.last_modified = formatdate(resource.mtime) if resource.mtime else ""
+        self.last_modified_parsed = parsedate(self.last_modified) if resource.mtime else None
+        self.gzip_body = None   # type: Optional[bytes]
+        if resource.is_text:
+            self.content_type = resource.mimetype + "; charset=utf-8"
+            self.body = resource.text.encode("utf-8")
+        else:
+            self.content_type = resource.mimetype
+            self.body = b"" if resource.is_mapped else resource.data
+        if len(self.body) >= self.gzip_min_size and (resource.is_text or resource.mimetype in self.compressible_types):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # gzip format, without a timestamp
+            gzipped = compressor.compress(self.body) + compressor.flush()
+            if len(gzipped) < len(self.body) * 0.9:
+                self.gzip_body = gzipped
+
+    def matches(self, if_none_match: str) -> bool:
+        return if_none_match == '*' or self.etag in if_none_match or self.gzip_etag in if_none_match
+
+
 class HttpIo(iobase.IoAdapterBase):
     """
     I/O adapter for a http/browser based interface.
@@ -191,8 +247,34 @@ class TaleWsgiAppBase:
     Generic wsgi functionality that is not tied to a particular
     single or multiplayer web server.
     """
+    static_chunk_size = 64 * 1024   # memory mapped static files are streamed in pieces of this size
+
     def __init__(self, driver: Driver) -> None:
         self.driver = driver
+        self.static_assets = {}     # type: Dict[str, StaticAsset]
+        self.load_static_assets()
+
+    def load_static_assets(self) -> None:
+        """Prepares the static web assets up front, rather than when they're first requested."""
+        try:
+            names = os.listdir(os.path.join(os.path.dirname(vfs.__file__), "web"))
+        except OSError:
+            return   # tale is not in a regular directory (zip file?), assets are prepared on first use instead
+        for name in names:
+            if self.wsgi_is_asset_allowed(name):
+                try:
+                    self.static_asset("web/" + name)
+                except IOError:
+                    pass
+
+    def static_asset(self, path: str) -> StaticAsset:
+        """Returns the prepared static asset, it is prepared again if the underlying resource changed."""
+        resource = vfs.internal_resources[path]
+        asset = self.static_assets.get(path)
+        if asset is None or asset.resource is not resource:
+            asset = StaticAsset(resource, self.etag(id(vfs.internal_resources), resource.mtime, path))
+            self.static_assets[path] = asset
+        return asset
 
     def __call__(self, environ: Dict[str, Any], start_response: WsgiStartResponseType) -> Iterable[bytes]:
         method = environ.get("REQUEST_METHOD")
@@ -323,28 +405,33 @@ class TaleWsgiAppBase:
                                   # ('Transfer-Encoding', 'chunked'),    not allowed by wsgi
                                   ('X-Accel-Buffering', 'no')   # nginx
                                   ])
-        yield (":" + ' ' * 2050 + "\n\n").encode("utf-8")   # padding for older browsers
+        yield self.eventsource_padding
         while self.driver.is_running():
             if conn.io and conn.player:
                 conn.io.wait_html_available(timeout=15)   # keepalives every 15 sec
             if not conn.io or not conn.player:
                 break
-            html = conn.io.get_html_to_browser()
-            special = conn.io.get_html_special()
-            if html or special:
-                if conn.io.dont_echo_next_cmd:
-                    special.append("noecho")
-                response = {
-                    "text": "\n".join(html),
-                    "special": special,
-                    "turns": conn.player.turns,
-                    "location": conn.player.location.title if conn.player.location else "???"
-                }
-                result = "event: text\nid: {event_id}\ndata: {data}\n\n"\
-                    .format(event_id=str(time.time()), data=json.dumps(response))
-                yield result.encode("utf-8")
-            else:
-                yield "data: keepalive\n\n".encode("utf-8")
+            yield self.eventsource_message(conn)
+
+    eventsource_padding = (":" + ' ' * 2050 + "\n\n").encode("utf-8")   # padding for older browsers
+
+    def eventsource_message(self, conn: PlayerConnection) -> bytes:
+        """Returns the next event-stream message for the connection: new html text, or a keepalive."""
+        html = conn.io.get_html_to_browser()
+        special = conn.io.get_html_special()
+        if html or special:
+            if conn.io.dont_echo_next_cmd:
+                special.append("noecho")
+            response = {
+                "text": "\n".join(html),
+                "special": special,
+                "turns": conn.player.turns,
+                "location": conn.player.location.title if conn.player.location else "???"
+            }
+            result = "event: text\nid: {event_id}\ndata: {data}\n\n"\
+                .format(event_id=str(time.time()), data=json.dumps(response))
+            return result.encode("utf-8")
+        return "data: keepalive\n\n".encode("utf-8")
 
     def wsgi_handle_tabcomplete(self, environ: Dict[str, Any], parameters: Dict[str, str],
                                 start_response: WsgiStartResponseType) -> Iterable[bytes]:
@@ -420,31 +507,40 @@ class TaleWsgiAppBase:
         return '"' + md5("-".join(str(c) for c in components).encode("ascii")).hexdigest() + '"'
 
     def wsgi_serve_static(self, path: str, environ: Dict[str, Any], start_response: WsgiStartResponseType) -> Iterable[bytes]:
-        headers = []
-        resource = vfs.internal_resources[path]
-        if resource.mtime:
-            mtime_formatted = formatdate(resource.mtime)
-            etag = self.etag(id(vfs.internal_resources), resource.mtime, path)
+        asset = self.static_asset(path)
+        headers = [('Content-Type', asset.content_type)]
+        etag = asset.etag
+        body = asset.body
+        if asset.gzip_body is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+            if accepts_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''), 'gzip'):
+                headers.append(('Content-Encoding', 'gzip'))
+                etag = asset.gzip_etag
+                body = asset.gzip_body
+        if asset.last_modified:
             if_modified = environ.get('HTTP_IF_MODIFIED_SINCE')
             if if_modified:
-                if parsedate(if_modified) >= parsedate(mtime_formatted):
+                if_modified_parsed = parsedate(if_modified)
+                if if_modified_parsed and if_modified_parsed >= asset.last_modified_parsed:
                     # the resource wasn't modified since last requested
                     return self.wsgi_not_modified(start_response)
             if_none = environ.get('HTTP_IF_NONE_MATCH')
-            if if_none and (if_none == '*' or etag in if_none):
+            if if_none and asset.matches(if_none):
                 return self.wsgi_not_modified(start_response)
             headers.append(("ETag", etag))
-            headers.append(("Last-Modified", formatdate(resource.mtime)))
-        if resource.is_text:
-            # text
-            headers.append(('Content-Type', resource.mimetype + "; charset=utf-8"))
-            data = resource.text.encode("utf-8")
-        else:
-            # binary
-            headers.append(('Content-Type', resource.mimetype))
-            data = resource.data
+            headers.append(("Last-Modified", asset.last_modified))
+        resource = asset.resource
+        if resource.is_mapped:
+            # stream the file rather than copying it into memory as a whole
+            headers.append(('Content-Length', str(len(resource))))
+            start_response('200 OK', headers)
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if file_wrapper:
+                return file_wrapper(resource.open(), self.static_chunk_size)   # the server may use sendfile
+            return (bytes(chunk) for chunk in resource.chunks(self.static_chunk_size))
+        headers.append(('Content-Length', str(len(body))))
         start_response('200 OK', headers)
-        return [data]
+        return [body]
 
 
 class TaleWsgiApp(TaleWsgiAppBase):
@@ -0,0 +1,322 @@
+"""
+Webbrowser based I/O for a multi player ('mud') server, running on an asyncio event loop.
+Instead of parking a thread on every open event-stream, all browser connections
+are served by a single event loop that also runs the game loop.
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+import asyncio
+import io
+import sys
+import threading
+import traceback
+from http.client import responses as http_responses
+from typing import Dict, Iterable, Any, List, Tuple, Optional, Callable, Sequence
+from urllib.parse import unquote
+
+from .if_browser_io import WsgiStartResponseType
+from .mud_browser_io import MudHttpIo, TaleMudWsgiApp, SessionMiddleware, MemorySessionFactory
+from .. import __version__ as tale_version_str
+from ..driver import Driver
+from ..player import PlayerConnection
+
+__all__ = ["AsyncMudHttpIo", "AsyncTaleMudWsgiApp", "AsyncHttpServer", "LoopEvent", "EventSourceStream"]
+
+
+class LoopEvent:
+    """
+    Event flag that lives on an asyncio event loop, but that can be set from any thread.
+    It mimics the interface of threading.Event, except that wait() is a coroutine.
+    Must be created on the thread that runs the event loop.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.loop_thread = threading.current_thread()
+        self.event = asyncio.Event()
+
+    def set(self) -> None:
+        if threading.current_thread() is self.loop_thread:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def clear(self) -> None:
+        self.event.clear()
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+    async def wait(self, timeout: float=None) -> bool:
+        if self.event.is_set():
+            await asyncio.sleep(0)   # always give other tasks on the loop a chance to run
+            return True
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.event.is_set()
+
+
+class AsyncMudHttpIo(MudHttpIo):
+    """
+    I/O adapter for a http/browser based interface, for the asyncio mud server.
+    The event-stream for the browser awaits new output instead of blocking a thread.
+    """
+    def __init__(self, player_connection: PlayerConnection, loop: asyncio.AbstractEventLoop) -> None:
+        super().__init__(player_connection)
+        self.html_available = LoopEvent(loop)
+
+    def destroy(self) -> None:
+        super().destroy()
+        self.html_available.set()
+
+    def append_html_to_browser(self, text: str) -> None:
+        super().append_html_to_browser(text)
+        self.html_available.set()
+
+    def append_html_special(self, text: str) -> None:
+        super().append_html_special(text)
+        self.html_available.set()
+
+    def render_output(self, paragraphs: Sequence[Tuple[str, bool]], **params: Any) -> Optional[str]:
+        result = super().render_output(paragraphs, **params)
+        if paragraphs:
+            self.html_available.set()
+        return result
+
+    def output_no_newline(self, text: str) -> None:
+        super().output_no_newline(text)
+        self.html_available.set()
+
+    async def async_wait_html_available(self, timeout: float=None) -> None:
+        await self.html_available.wait(timeout)
+        self.html_available.clear()
+
+
+class EventSourceStream:
+    """
+    The response body of an event-stream request in the asyncio web server.
+    The server awaits the chunks one by one, until None is returned.
+    """
+    def __init__(self, app: TaleMudWsgiApp, conn: PlayerConnection) -> None:
+        self.app = app
+        self.conn = conn
+        self.started = False
+
+    async def next_chunk(self) -> Optional[bytes]:
+        if not self.started:
+            self.started = True
+            return self.app.eventsource_padding
+        conn = self.conn
+        if not self.app.driver.is_running():
+            return None
+        if conn.io and conn.player:
+            await conn.io.async_wait_html_available(timeout=15)   # keepalives every 15 sec
+        if not conn.io or not conn.player or not self.app.driver.is_running():
+            return None
+        return self.app.eventsource_message(conn)
+
+
+class AsyncTaleMudWsgiApp(TaleMudWsgiApp):
+    """
+    The wsgi app for the asyncio mud server. The event-stream is not produced by a blocking
+    generator here, but by an EventSourceStream that the asyncio web server consumes.
+    """
+    @classmethod
+    def create_app_server(cls, driver: Driver, *,             # type: ignore
+                          use_ssl: bool=False, ssl_certs: Tuple[str, str, str]=None) -> 'AsyncHttpServer':
+        wsgi_app = SessionMiddleware(cls(driver, use_ssl, ssl_certs), MemorySessionFactory())
+        server = AsyncHttpServer(wsgi_app, driver.story.config.mud_host, driver.story.config.mud_port,
+                                 use_ssl=use_ssl, ssl_certs=ssl_certs)
+        return server
+
+    def wsgi_handle_eventsource(self, environ: Dict[str, Any], parameters: Dict[str, str],
+                                start_response: WsgiStartResponseType) -> Iterable[bytes]:
+        session = environ["wsgi.session"]
+        conn = session.get("player_connection")
+        if not conn:
+            return self.wsgi_internal_server_error_json(start_response, "not logged in")
+        if not conn.player or not conn.io:
+            raise SessionMiddleware.CloseSession("{\"error\": \"no longer a valid connection\"}", "application/json")
+        start_response('200 OK', [('Content-Type', 'text/event-stream; charset=utf-8'),
+                                  ('Cache-Control', 'no-cache'),
+                                  ('X-Accel-Buffering', 'no')   # nginx
+                                  ])
+        return EventSourceStream(self, conn)    # type: ignore
+
+
+class AsyncHttpServer:
+    """
+    A minimal HTTP/1.1 server on top of asyncio streams, that serves a wsgi app.
+    Regular requests are handled by calling the wsgi app directly on the event loop
+    (the app and the game loop run on the same thread, so no locking is needed).
+    EventSourceStream responses are streamed asynchronously.
+    Set use_ssl to True to enable HTTPS mode instead of unencrypted HTTP.
+    """
+    request_queue_size = 200
+    max_content_length = 1000000
+    server_software = "Tale/" + tale_version_str
+    ssl_cert_locations = ("./certs/localhost_cert.pem", "./certs/localhost_key.pem", "")    # certfile, keyfile, certpassword
+
+    def __init__(self, app: Callable, host: str, port: int, *,
+                 use_ssl: bool=False, ssl_certs: Tuple[str, str, str]=None) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        if ssl_certs:
+            self.ssl_cert_locations = ssl_certs
+        self.server = None  # type: asyncio.AbstractServer
+        self.server_address = (host, port)  # type: Tuple[str, int]
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Start listening on the event loop (which must not be running yet)."""
+        ssl_context = None
+        if self.use_ssl:
+            print("\n\nUsing SSL\n\n")
+            import ssl
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(self.ssl_cert_locations[0], self.ssl_cert_locations[1] or None,
+                                        self.ssl_cert_locations[2] or None)
+        self.server = loop.run_until_complete(asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                                   ssl=ssl_context, backlog=self.request_queue_size))
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+
+    def close(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.server:
+            self.server.close()
+            loop.run_until_complete(self.server.wait_closed())
+            self.server = None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                request = await self.read_request(reader)
+                if not request:
+                    break
+                keep_alive = await self.handle_request(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, UnicodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, List[Tuple[str, str]], bytes]]:
+        """Reads a http request. Returns tuple (method, path, http version, headers, body) or None when the client is gone."""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, version = line.decode("iso-8859-1").split()
+        headers = []   # type: List[Tuple[str, str]]
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("iso-8859-1").partition(":")
+            headers.append((name.strip(), value.strip()))
+        body = b""
+        content_length = int(dict((n.lower(), v) for n, v in headers).get("content-length", 0))
+        if content_length > self.max_content_length:
+            raise ValueError("Maximum content length exceeded")
+        if content_length:
+            body = await reader.readexactly(content_length)
+        return method, target, version, headers, body
+
+    def make_environ(self, method: str, target: str, version: str, headers: List[Tuple[str, str]],
+                     body: bytes, peername: Any) -> Dict[str, Any]:
+        path, _, query = target.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "iso-8859-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.server_address[0],
+            "SERVER_PORT": str(self.server_address[1]),
+            "SERVER_PROTOCOL": version,
+            "SERVER_SOFTWARE": self.server_software,
+            "REMOTE_ADDR": peername[0] if peername else "",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "https" if self.use_ssl else "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": False,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False
+        }   # type: Dict[str, Any]
+        for name, value in headers:
+            name = name.upper().replace("-", "_")
+            if name == "CONTENT_TYPE":
+                environ[name] = value
+            elif name != "CONTENT_LENGTH":
+                key = "HTTP_" + name
+                environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+    async def handle_request(self, request: Tuple[str, str, str, List[Tuple[str, str]], bytes],
+                             writer: asyncio.StreamWriter) -> bool:
+        """Handle a single request. Returns True if the connection can be kept alive for another request."""
+        method, target, version, headers, body = request
+        environ = self.make_environ(method, target, version, headers, body, writer.get_extra_info("peername"))
+        keep_alive = version == "HTTP/1.1" and environ.get("HTTP_CONNECTION", "").lower() != "close"
+        response = []   # type: List[Any]
+
+        def start_response(status: str, response_headers: List[Tuple[str, str]], exc_info: Any=None) -> None:
+            response[:] = [status, response_headers]
+
+        try:
+            result = self.app(environ, start_response)
+            if isinstance(result, EventSourceStream):
+                # stream the response, it stays open until the stream ends or the client disconnects
+                writer.write(self.response_head(response[0], response[1] + [("Connection", "close")]))
+                while True:
+                    chunk = await result.next_chunk()
+                    if chunk is None:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+                return False
+            if any(name.lower() == "content-length" for name, _ in response[1]):
+                # the app knows the size in advance, write the body as it comes instead of collecting it first
+                writer.write(self.response_head(response[0], response[1] + [("Connection", "keep-alive" if keep_alive else "close")]))
+                try:
+                    for chunk in result:
+                        writer.write(chunk)
+                        await writer.drain()
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception:
+                    # too late for an error response, the best we can do is to drop the connection
+                    print("ERROR IN ASYNC WEB SERVER:\n", "".join(traceback.format_exc()), file=sys.stderr)
+                    return False
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()   # type: ignore
+                return keep_alive
+            try:
+                data = b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()   # type: ignore
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception:
+            print("ERROR IN ASYNC WEB SERVER:\n", "".join(traceback.format_exc()), file=sys.stderr)
+            response = ["500 Internal server error", [("Content-Type", "text/plain")]]
+            data = b"Error 500: Internal server error"
+            keep_alive = False
+        status, response_headers = response
+        response_headers = list(response_headers)
+        response_headers.append(("Content-Length", str(len(data))))
+        response_headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+        writer.write(self.response_head(status, response_headers) + data)
+        await writer.drain()
+        return keep_alive
+
+    def response_head(self, status: str, headers: List[Tuple[str, str]]) -> bytes:
+        if " " not in status:
+            status += " " + http_responses.get(int(status), "")
+        lines = ["HTTP/1.1 " + status, "Server: " + self.server_software]
+        lines.extend("%s: %s" % header for header in headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
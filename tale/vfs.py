@@ -5,14 +5,18 @@ Virtual file system.
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 
+import collections
+import contextlib
 import errno
 import io
 import mimetypes
+import mmap
 import os
 import pathlib
 import pkgutil
 import sys
-from typing import Union, IO, Any, Iterable
+import threading
+from typing import Union, IO, Any, Iterable, Iterator, Tuple, Optional, MutableMapping
 
 __all__ = ["VfsError", "VirtualFileSystem", "internal_resources"]
 
@@ -36,27 +40,55 @@ def is_text(mimetype: str) -> bool:
 
 
 class Resource:
-    """Simple container of a resource name, its data (string or binary) and the mime type"""
-    def __init__(self, name: str, data: Union[str, bytes], mimetype: str="application/octet-stream", mtime: float=0.0) -> None:
+    """
+    Simple container of a resource name, its data (string or binary) and the mime type.
+    Binary data can also be a memory mapped file (see is_mapped), use view() or chunks()
+    to access that without copying the file's contents into memory. The file is unmapped when
+    the resource (and every memoryview on it) is no longer referenced.
+    """
+    def __init__(self, name: str, data: Union[str, bytes, mmap.mmap], mimetype: str="application/octet-stream",
+                 mtime: float=0.0, path: str=None) -> None:
         self.is_text = is_text(mimetype)
         if self.is_text:
             if not isinstance(data, str):
                 raise TypeError("text data required for this mimetype")
         else:
-            if not isinstance(data, (bytes, bytearray)):
+            if not isinstance(data, (bytes, bytearray, mmap.mmap)):
                 raise TypeError("bytes or bytearray data requires for this mimetype")
         self.name = name
         self.mimetype = mimetype
         self.mtime = mtime
+        self.path = path    # the file the data was read from, if known
+        self.is_mapped = isinstance(data, mmap.mmap)
         self.__data = data
 
     @property
     def data(self) -> bytes:
-        """the (binary) data of this resource"""
+        """the (binary) data of this resource. For a memory mapped resource, this makes a copy of the file's contents."""
         if self.is_text:
             raise VfsError("this is a text resource, not binary")
+        if self.is_mapped:
+            return self.__data[:]   # type: ignore
         return self.__data      # type: ignore
 
+    def view(self) -> memoryview:
+        """a (read-only) memoryview on the binary data of this resource, without copying it"""
+        if self.is_text:
+            raise VfsError("this is a text resource, not binary")
+        return memoryview(self.__data)    # type: ignore
+
+    def chunks(self, chunk_size: int=64 * 1024) -> Iterator[memoryview]:
+        """iterates over the binary data of this resource in memoryviews of (at most) the given size"""
+        view = self.view()
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+
+    def open(self) -> IO[bytes]:
+        """returns a new binary file io stream to read the data from (the file itself, for memory mapped resources)"""
+        if self.is_mapped and self.path:
+            return io.open(self.path, "rb")
+        return io.BytesIO(self.data)
+
     @property
     def text(self) -> str:
         """the (text) data of this resource"""
@@ -84,7 +116,20 @@ class VirtualFileSystem:
     It supports automatic decompression of .gz, .xz and .bz2 compressed files (as long as they have that extension).
     It automatically returns the contents of a compressed version of a requested file if the file
     itself doesn't exist but there is a compressed version of it available.
+    Recently read resources are kept in a cache, that checks the file's modification time and size
+    on every access (resources in a zip file or other package loader without file stats are assumed to never change).
+    Large binary files are memory mapped instead of read into memory, if the vfs is read-only
+    (a writable vfs could truncate a file underneath its mapping). The cache never closes a mapping itself,
+    because a resource that drops out of the cache may still be in use elsewhere: the file is unmapped
+    when the last reference to the resource is gone.
+    Beware that the files must not be truncated by something else while they're mapped: reading from the
+    part of a mapping that's no longer backed by the file, kills the process with SIGBUS. The cache notices
+    that a file changed on the next access, and then maps the file again.
     """
+    cache_max_items = 200
+    cache_max_size = 16 * 1024 * 1024   # total size of the cached resources (bytes or characters)
+    mmap_threshold = 256 * 1024     # binary files of at least this size are memory mapped, 0 disables this
+
     def __init__(self, root_package: str=None, root_path: Union[str, pathlib.Path]=None,
                  readonly: bool=True, everythingtext: bool=False) -> None:
         if root_package is not None and root_path is not None:
@@ -111,6 +156,13 @@ class VirtualFileSystem:
                 raise VfsError("root package cannot be accessed")
             self.root = root_package
             self.use_pkgutil = True
+        self._loader = None   # the package loader, looked up on first use
+        # resource name -> (resource, physical path, file stamp when it was read)
+        self._cache = collections.OrderedDict()   # type: MutableMapping[str, Tuple[Resource, str, Optional[Tuple[Any, ...]]]]
+        self._cache_size = 0
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def validate_path(self, path: str) -> str:
         """
@@ -132,6 +184,62 @@ class VirtualFileSystem:
 
     def __getitem__(self, name: str) -> Resource:
         """Reads the resource data (text or binary) for the given name and returns it as a Resource object"""
+        with self._cache_lock:
+            entry = self._cache.get(name)
+        if entry:
+            resource, path, stamp = entry
+            if stamp is None or self._file_stamp(path) == stamp:
+                with self._cache_lock:
+                    if name in self._cache:
+                        self._cache.move_to_end(name)
+                    self.cache_hits += 1
+                return resource
+        resource, path, stamp = self._load(name)
+        with self._cache_lock:
+            self.cache_misses += 1
+            self._uncache(name)
+            cost = self._cache_cost(resource)
+            if cost <= self.cache_max_size // 4:
+                self._cache[name] = (resource, path, stamp)
+                self._cache_size += cost
+                while len(self._cache) > self.cache_max_items or self._cache_size > self.cache_max_size:
+                    self._uncache(next(iter(self._cache)))
+        return resource
+
+    def _uncache(self, name: str) -> None:
+        entry = self._cache.pop(name, None)
+        if entry:
+            self._cache_size -= self._cache_cost(entry[0])
+
+    @staticmethod
+    def _cache_cost(resource: Resource) -> int:
+        return 0 if resource.is_mapped else len(resource)    # a memory mapped file doesn't take up memory of its own
+
+    def clear_cache(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_size = 0
+
+    def cache_info(self) -> Tuple[int, int, int, int]:
+        """returns the number of cached resources, their total size, and the number of cache hits and misses"""
+        with self._cache_lock:
+            return len(self._cache), self._cache_size, self.cache_hits, self.cache_misses
+
+    def _file_stamp(self, path: str) -> Optional[Tuple[Any, ...]]:
+        """The modification time and size of the file. None if the loader can't tell, it's then assumed to never change."""
+        try:
+            if self.use_pkgutil:
+                stats = self._loader.path_stats(path)    # type: ignore
+                return stats["mtime"], stats.get("size")
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except AttributeError:
+            return None
+        except OSError:
+            return ("missing",)
+
+    def _load(self, name: str) -> Tuple[Resource, str, Optional[Tuple[Any, ...]]]:
+        """Reads the resource, returns it with the path of the file it was read from and the file's stamp before it was read"""
         original_name = name
         phys_path = self.validate_path(name)
         mimetype, compressor = mimetypes.guess_type(name, False)
@@ -147,11 +255,19 @@ class VirtualFileSystem:
             # package resource access
             # we can't use pkgutil.get_data directly, because we also need the mtime
             # so we do some of the work that get_data does ourselves...
-            loader = pkgutil.get_loader(self.root)
+            if not self._loader:
+                self._loader = pkgutil.get_loader(self.root)
+            loader = self._loader
             rootmodule = sys.modules[self.root]
             parts = name.split('/')
             parts.insert(0, os.path.dirname(rootmodule.__file__))
             name = os.path.join(*parts)
+            if os.path.isfile(name):
+                # the package is a regular directory (not a zip file), large files can be mapped directly
+                stamp = self._file_stamp(name)
+                mapped = self._map_file(name, mimetype, compressor)
+                if mapped is not None:
+                    return Resource(name, mapped, mimetype, loader.path_stats(name)["mtime"], name), name, stamp   # type: ignore
             try:
                 data = loader.get_data(name)    # type: ignore
                 if not data:
@@ -162,39 +278,55 @@ class VirtualFileSystem:
                     try:
                         data = loader.get_data(name + suffix)    # type: ignore
                         if data:
-                            return self[original_name + suffix]
+                            return self._load(original_name + suffix)
                     except FileNotFoundError:
                         pass
                 raise x
-            else:
-                data = loader.get_data(name)   # type: ignore
-                if not data:
-                    raise FileNotFoundError(errno.ENOENT, name)
+            stamp = self._file_stamp(name)
             try:
                 mtime = loader.path_stats(name)["mtime"]        # type: ignore
             except AttributeError:
                 mtime = 0.0   # not all loaders support getting the modification time...
             if encoding:
                 with io.StringIO(data.decode(encoding), newline=None) as f_s:
-                    return Resource(name, f_s.read(), mimetype, mtime)
+                    return Resource(name, f_s.read(), mimetype, mtime), name, stamp
             else:
                 if compressor:
                     data = self._uncompress(compressor, data, is_text(mimetype))
-                return Resource(name, data, mimetype, mtime)
+                return Resource(name, data, mimetype, mtime), name, stamp
         else:
             # direct filesystem access
             if not os.path.isfile(phys_path):
                 # if the file cannot be found directly, attempt to read a compressed version of it
                 for suffix in mimetypes.encodings_map:
                     if os.path.exists(phys_path + suffix):
-                        return self[original_name + suffix]
+                        return self._load(original_name + suffix)
+            stamp = self._file_stamp(phys_path)
+            mapped = self._map_file(phys_path, mimetype, compressor)
+            if mapped is not None:
+                return Resource(name, mapped, mimetype, os.path.getmtime(phys_path), phys_path), phys_path, stamp
             with io.open(phys_path, mode=mode, encoding=encoding) as f_b:
                 mtime = os.path.getmtime(phys_path)
                 data = f_b.read()
                 if compressor:
                     assert not encoding, "compressed data should not have encoding"
                     data = self._uncompress(compressor, data, is_text(mimetype))
-                return Resource(name, data, mimetype, mtime)
+                return Resource(name, data, mimetype, mtime), phys_path, stamp
+
+    def _map_file(self, path: str, mimetype: str, compressor: Optional[str]) -> Optional[mmap.mmap]:
+        """
+        Memory maps the file if it's a large enough uncompressed binary file (and the vfs is read-only), else returns None.
+        The file must not be truncated while it's mapped, see the class docstring.
+        """
+        if compressor or is_text(mimetype) or not self.readonly or self.mmap_threshold <= 0:
+            return None
+        try:
+            if os.path.getsize(path) < self.mmap_threshold:
+                return None
+            with io.open(path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None     # can't be mapped, read it normally
 
     def __setitem__(self, name: str, data: Union[Resource, str, bytes]) -> None:
         """
@@ -215,16 +347,22 @@ class VirtualFileSystem:
         if self.readonly:
             raise VfsError("attempt to write a read-only vfs")
         phys_path = self.validate_path(name)
+        self._forget(name)
         try:
             os.remove(phys_path)
         except IOError:
             pass
 
+    def _forget(self, name: str) -> None:
+        with self._cache_lock:
+            self._uncache(name)
+
     def open_write(self, name: str, mimetype: str=None, append: bool=False) -> IO[Any]:
         """returns a writable file io stream"""
         if self.readonly:
             raise VfsError("attempt to write to a read-only vfs")
         phys_path = self.validate_path(name)
+        self._forget(name)
         dirname = os.path.dirname(phys_path)
         try:
             if dirname:
@@ -237,6 +375,27 @@ class VirtualFileSystem:
             return io.open(phys_path, mode="at" if append else "wt", encoding="utf-8", newline="\n")
         return io.open(phys_path, mode="ab" if append else "wb")
 
+    @contextlib.contextmanager
+    def open_write_atomic(self, name: str, mimetype: str=None) -> Iterator[IO[Any]]:
+        """
+        Context manager that gives a writable file io stream, like open_write.
+        The data goes into a temporary file first, that only replaces the resource once it has been written completely.
+        If something goes wrong halfway, the existing resource is left untouched.
+        """
+        phys_path = self.validate_path(name)
+        temp_name = name + ".tmp"
+        mimetype = mimetype or mimetypes.guess_type(name)[0] or ""
+        try:
+            with self.open_write(temp_name, mimetype) as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            del self[temp_name]
+            raise
+        os.replace(self.validate_path(temp_name), phys_path)
+        self._forget(name)
+
     def contents(self, path: str=".") -> Iterable[str]:
         """Returns the files in the given path. Only works on path based vfs, not for package based vfs."""
         if self.use_pkgutil:
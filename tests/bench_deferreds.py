@@ -0,0 +1,53 @@
+"""
+Microbenchmark for firing periodic deferreds (not part of the unit tests).
+Compares the cost of calling a deferred with and without the cached resolved callable / ctx check.
+Run with:  python -m tests.bench_deferreds
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import time
+
+from tale import base, driver, mud_context, util
+from tests.supportstuff import FakeDriver
+
+
+class Mob(base.Living):
+    def init(self) -> None:
+        self.moves = 0
+
+    @util.call_periodically(5, 10)
+    def do_wander(self, ctx: util.Context) -> None:
+        self.moves += 1
+
+
+def fire_all(deferreds, ctx, uncached):
+    ctx.driver.deferreds.clear()    # firing the periodic deferreds enqueues them again
+    start = time.perf_counter()
+    for d in deferreds:
+        if uncached:
+            # simulate the old behavior: resolve the action by name and inspect its signature every time
+            d._resolved_action = None
+            driver._accepts_ctx_cache.clear()
+        d(ctx=ctx)
+    return time.perf_counter() - start
+
+
+def main(num_mobs=50000, rounds=3):
+    fake_driver = FakeDriver()
+    mud_context.driver = fake_driver
+    ctx = util.Context(fake_driver, fake_driver.game_clock, None, None)
+    mobs = [Mob("mob%d" % i, "n") for i in range(num_mobs)]
+    deferreds = list(fake_driver.deferreds)
+    assert len(deferreds) == num_mobs
+    print("firing %d periodic mob deferreds, best of %d rounds:" % (num_mobs, rounds))
+    for uncached in (True, False):
+        best = min(fire_all(deferreds, ctx, uncached) for _ in range(rounds))
+        print("  %-10s %8.3f sec total   %6.2f usec per deferred"
+              % ("uncached" if uncached else "cached", best, best / num_mobs * 1e6))
+    assert all(mob.moves == 2 * rounds for mob in mobs)
+
+
+if __name__ == "__main__":
+    main()
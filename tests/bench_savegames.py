@@ -0,0 +1,93 @@
+"""
+Benchmark for the savegame codecs on the Circle world: savegame size, save time and load time.
+The unit tests use it too (test_stories), run it directly to see the numbers:  python -m tests.bench_savegames
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+from tale import base, mud_context, player, savegames, vfs
+from tale.story import StoryConfig
+from tests.supportstuff import FakeDriver
+
+
+def build_circle_world(zone_vnums: Sequence[int]=None) -> Dict[str, Any]:
+    """
+    Create the Circle world (rooms, mobs, items, shops) and return the arguments for TaleSerializer.serialize.
+    Only the given zones are populated (and the rooms they lead to), or the complete world if no zones are given.
+    The stories/circle directory must be on the import path.
+    """
+    fake_driver = FakeDriver()
+    fake_driver.user_resources = vfs.VirtualFileSystem(root_path=tempfile.mkdtemp(), readonly=False)   # for the bulletin boards
+    mud_context.driver = fake_driver
+    mud_context.config = StoryConfig()
+    mud_context.resources = fake_driver.resources
+    import zones
+    zones.init_zones(fake_driver)
+    if zone_vnums is None:
+        zones.populate_all_zones()
+    else:
+        for vnum in zone_vnums:
+            zones.populate_zone(vnum)
+    julie = player.Player("julie", "f")
+    zones.make_location(3001).insert(julie, julie)
+    # only collect what belongs to the circle world, the registry may contain other stuff as well
+    locations = list(zones.converted_rooms.values())
+    exits = [e for loc in locations for e in loc.exits.values()]
+    livings = [l for loc in locations for l in loc.livings]
+    owners = set(locations) | set(livings)
+    items = []   # type: List[base.Item]
+    for item in base.MudObjRegistry.all_items.values():
+        owner = item.contained_in
+        while isinstance(owner, base.Item):
+            owner = owner.contained_in
+        if owner in owners:
+            items.append(item)
+    return {
+        "story": StoryConfig(),
+        "player": julie,
+        "items": items,
+        "livings": livings,
+        "locations": locations,
+        "exits": list(set(exits)),
+        "deferreds": list(fake_driver.deferreds),
+        "clock": fake_driver.game_clock
+    }
+
+
+def measure(world: Dict[str, Any], codec: str, compression: str="zlib") -> Tuple[int, float, float, Any]:
+    """Returns (size, save time, load time, loaded data) for saving the world with the given codec."""
+    serializer = savegames.TaleSerializer(codec, compression)
+    start = time.perf_counter()
+    data = serializer.serialize(**world)
+    save_time = time.perf_counter() - start
+    start = time.perf_counter()
+    state = savegames.TaleDeserializer().deserialize(data)
+    load_time = time.perf_counter() - start
+    return len(data), save_time, load_time, state
+
+
+def main() -> None:
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "stories" / "circle"))
+    world = build_circle_world()
+    print("\n{:d} locations, {:d} exits, {:d} livings, {:d} items\n".format(
+        len(world["locations"]), len(world["exits"]), len(world["livings"]), len(world["items"])))
+    print("codec    compression      size    save    load   speed")
+    serpent_time = 0.0
+    for codec, compression in [("serpent", "zlib"), ("binary", "zlib"), ("binary", "lzma"), ("binary", "")]:
+        size, save_time, load_time, _ = measure(world, codec, compression)
+        if codec == "serpent":
+            compression = "gzip"    # the text format is always gzipped
+            serpent_time = save_time + load_time
+        speed = serpent_time / (save_time + load_time)     # save+load compared to serpent
+        print("{:8s} {:11s} {:9d}  {:5.3f}s  {:5.3f}s  {:5.1f}x".format(codec, compression or "-", size, save_time, load_time, speed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Unittests for the web browser i/o
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import gzip
+import unittest
+
+from tale.tio.if_browser_io import TaleWsgiAppBase, accepts_encoding
+
+
+class TestStaticAssets(unittest.TestCase):
+    def setUp(self):
+        self.app = TaleWsgiAppBase(None)
+
+    def get(self, path, **headers):
+        response = []
+        environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/tale/static/" + path}
+        environ.update(("HTTP_" + name, value) for name, value in headers.items())
+        body = b"".join(self.app(environ, lambda status, headers: response.extend([status, dict(headers)])))
+        return response[0], response[1], body
+
+    def test_accepts_encoding(self):
+        self.assertTrue(accepts_encoding("gzip, deflate, br", "gzip"))
+        self.assertTrue(accepts_encoding("deflate, GZIP;q=0.5", "gzip"))
+        self.assertTrue(accepts_encoding("*", "gzip"))
+        self.assertFalse(accepts_encoding("", "gzip"))
+        self.assertFalse(accepts_encoding("deflate", "gzip"))
+        self.assertFalse(accepts_encoding("gzip;q=0, *", "gzip"))
+        self.assertFalse(accepts_encoding("*;q=0", "gzip"))
+
+    def test_preloaded(self):
+        self.assertIn("web/script.js", self.app.static_assets)
+        self.assertIn("web/style.css", self.app.static_assets)
+        asset = self.app.static_assets["web/style.css"]
+        self.assertIs(asset, self.app.static_asset("web/style.css"))
+        self.assertIsNotNone(asset.gzip_body)
+        self.assertIsNone(self.app.static_assets["web/logo.gif"].gzip_body, "images are compressed already")
+
+    def test_serve_gzipped(self):
+        status, headers, plain = self.get("style.css")
+        self.assertEqual("200 OK", status)
+        self.assertEqual("Accept-Encoding", headers["Vary"])
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(str(len(plain)), headers["Content-Length"])
+        status, gz_headers, gzipped = self.get("style.css", ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual("200 OK", status)
+        self.assertEqual("gzip", gz_headers["Content-Encoding"])
+        self.assertEqual(str(len(gzipped)), gz_headers["Content-Length"])
+        self.assertLess(len(gzipped), len(plain))
+        self.assertEqual(plain, gzip.decompress(gzipped))
+        self.assertNotEqual(headers["ETag"], gz_headers["ETag"])
+        status, headers, body = self.get("logo.gif", ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertNotIn("Vary", headers)
+        self.assertTrue(body.startswith(b"GIF"))
+
+    def test_not_modified(self):
+        _, headers, _ = self.get("style.css")
+        _, gz_headers, _ = self.get("style.css", ACCEPT_ENCODING="gzip")
+        self.assertEqual("304 Not Modified", self.get("style.css", IF_NONE_MATCH=headers["ETag"])[0])
+        self.assertEqual("304 Not Modified", self.get("style.css", IF_NONE_MATCH=gz_headers["ETag"])[0])
+        self.assertEqual("304 Not Modified", self.get("style.css", IF_MODIFIED_SINCE=headers["Last-Modified"])[0])
+        self.assertEqual("200 OK", self.get("style.css", IF_NONE_MATCH='"something-else"')[0])
+        self.assertEqual("200 OK", self.get("style.css", IF_MODIFIED_SINCE="garbage")[0])
+        self.assertEqual("404 Not Found", self.get("nonexisting.css")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
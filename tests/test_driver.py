@@ -5,6 +5,7 @@ Unittests for the driver
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 
+import concurrent.futures
 import datetime
 import heapq
 import os
@@ -15,6 +16,9 @@ import tale.demo
 import tale.driver
 import tale.driver_if
 import tale.driver_mud
+import tale.driver_mud_async
+import tale.player
+import tale.pubsub
 import tale.util
 from tale.cmds import cmd, wizcmd, disabled_in_gamemode
 from tale.story import GameMode
@@ -61,6 +65,36 @@ class TestDriverCreation(unittest.TestCase):
         self.assertIsNone(d.resources)
         self.assertIsNone(d.user_resources)
 
+    def testMudAsync(self):
+        d = tale.driver_mud_async.AsyncMudDriver(True)
+        self.assertEqual(GameMode.MUD, d.game_mode)
+        self.assertTrue(d.restricted)
+        self.assertIsNone(d.loop)
+        self.assertIsNone(d.story)
+
+
+class TestDialogs(unittest.TestCase):
+    def test_wait_for_background_work(self):
+        d = tale.driver.Driver()
+        conn = tale.player.PlayerConnection(tale.player.Player("julie", "f"))
+        future = concurrent.futures.Future()    # type: concurrent.futures.Future
+        results = []
+
+        def dialog():
+            finished = yield "wait", future
+            results.append(finished.result())
+
+        d._continue_dialog(conn, dialog(), None)
+        dialog_gen, validator, _ = d.waiting_for_input[conn]
+        with self.assertRaises(ValueError):
+            validator("input typed meanwhile is refused")
+        tale.pubsub.sync("driver-async-dialogs")
+        self.assertEqual([], results)
+        future.set_result(42)
+        tale.pubsub.sync("driver-async-dialogs")
+        self.assertEqual([42], results)
+        self.assertNotIn(conn, d.waiting_for_input)
+
 
 class TestDeferreds(unittest.TestCase):
     def testSortable(self):
@@ -86,7 +120,7 @@ class TestDeferreds(unittest.TestCase):
         with self.assertRaises(ValueError):
             driver.defer("blerp", thing.move)
         driver.defer(3601, thing.move)
-        deferred = driver.deferreds[0]
+        deferred = list(driver.deferreds)[0]
         after = deferred.due_gametime - now
         self.assertEqual(3601, after.seconds)
 
@@ -97,7 +131,7 @@ class TestDeferreds(unittest.TestCase):
         driver.game_clock = tale.util.GameDateTime(now, 1)
         due = driver.game_clock.plus_realtime(datetime.timedelta(seconds=3601))
         driver.defer(due, thing.move)
-        deferred = driver.deferreds[0]
+        deferred = list(driver.deferreds)[0]
         after = deferred.due_gametime - now
         self.assertEqual(3601, after.seconds)
 
@@ -119,6 +153,34 @@ class TestDeferreds(unittest.TestCase):
             dues.append(heapq.heappop(heap).due_gametime)
         self.assertEqual([t1, t2, t3, t4, t5], dues)
 
+    def testDeferredQueue(self):
+        t1 = datetime.datetime(1995, 1, 1, 12, 0, 0)
+        thing1 = Thing()
+        thing2 = Thing()
+        q = tale.driver.DeferredQueue()
+        d1 = tale.driver.Deferred(t1 + datetime.timedelta(seconds=10), thing1.append, [], None)
+        d2 = tale.driver.Deferred(t1 + datetime.timedelta(seconds=2.5), thing1.append, [], None)
+        d3 = tale.driver.Deferred(t1 + datetime.timedelta(seconds=2.1), thing2.append, [], None)
+        d4 = tale.driver.Deferred(t1 + datetime.timedelta(seconds=1), thing2.append, [], None)
+        for d in [d1, d2, d3, d4]:
+            q.push(d)
+        self.assertEqual(4, len(q))
+        self.assertEqual([d4, d3, d2, d1], sorted(q))
+        self.assertEqual([], q.pop_due(t1))
+        self.assertEqual([d4], q.pop_due(t1 + datetime.timedelta(seconds=2)))
+        self.assertEqual([d3], q.pop_due(t1 + datetime.timedelta(seconds=2.2)))   # only part of the bucket is due
+        self.assertEqual(2, len(q))
+        q.remove_owner(thing1)
+        self.assertEqual(0, len(q))
+        self.assertEqual([], q.pop_due(t1 + datetime.timedelta(days=1)))
+        for d in [d1, d2, d3, d4]:
+            q.push(d)
+        q.remove_owner(thing2)
+        self.assertEqual([d2, d1], q.pop_due(t1 + datetime.timedelta(hours=1)))
+        self.assertEqual(0, len(q))
+        self.assertEqual({}, q.buckets)
+        self.assertEqual({}, q.owners)
+
     def testCallable(self):
         def scoped_function():
             pass
@@ -132,6 +194,23 @@ class TestDeferreds(unittest.TestCase):
         d(ctx=ctx)
         d = tale.driver.Deferred(due, module_level_func_without_ctx, [], None)
         d(ctx=ctx)
+        self.assertIsNone(d._resolved_action)
+        d = tale.driver.Deferred(due, t.append, [43], None, periodical=(10, 20))
+        previous_driver = tale.mud_context.driver
+        tale.mud_context.driver = ctx.driver
+        ctx.driver.game_clock = tale.util.GameDateTime(due)
+        try:
+            d(ctx=ctx)
+            self.assertEqual(t.append, d._resolved_action)
+            d(ctx=ctx)
+        finally:
+            tale.mud_context.driver = previous_driver
+        self.assertEqual([42, 43, 43], t.x)
+        self.assertTrue(tale.driver.accepts_ctx(t.append))
+        self.assertTrue(tale.driver.accepts_ctx(module_level_func))
+        self.assertFalse(tale.driver.accepts_ctx(module_level_func_without_ctx))
+        self.assertFalse(tale.driver.accepts_ctx(len))
+        self.assertIn(module_level_func, tale.driver._accepts_ctx_cache)
         with self.assertRaises(ValueError):
             tale.driver.Deferred(due, scoped_function, [], None)
         with self.assertRaises(ValueError):
@@ -217,6 +296,127 @@ def func4(player, parsed, ctx):
     pass
 
 
+class TestBehaviors(unittest.TestCase):
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.ctx = tale.util.Context(self.driver, self.driver.game_clock, None, None)
+
+    def test_batch(self):
+        batch = tale.driver.BehaviorBatch("append", 5)
+        things = [Thing() for _ in range(20)]
+        for t in things:
+            batch.add(t, 1.0)
+        self.assertEqual(20, len(batch))
+        triggered = []
+        for _ in range(5):
+            triggered.extend(batch.due_objects())
+        self.assertEqual(20, len(triggered))
+        self.assertEqual(set(map(id, things)), set(map(id, triggered)))   # every object exactly once per period
+        for t in things[:10]:
+            batch.remove(t)
+        batch.remove(things[0])
+        self.assertEqual(10, len(batch))
+        self.assertNotIn(things[0], batch)
+        self.assertIn(things[15], batch)
+        triggered = []
+        for _ in range(5):
+            triggered.extend(batch.due_objects())
+        self.assertEqual(set(map(id, things[10:])), set(map(id, triggered)))
+        for t in things:
+            batch.add(t, 0.0)
+        self.assertEqual([], sum((batch.due_objects() for _ in range(5)), []))
+
+    def test_run(self):
+        class Mob(tale.base.Living):
+            def init(self):
+                self.wanders = 0
+
+            def wander(self, ctx):
+                assert ctx.driver is not None
+                self.wanders += 1
+
+        mobs = [Mob("mob", "m") for _ in range(10)]
+        for mob in mobs:
+            self.driver.register_behavior(mob, "wander", 3.0)
+        with self.assertRaises(ValueError):
+            self.driver.register_behavior(mobs[0], "fly", 3.0)
+        self.assertEqual(10, len(self.driver.behaviors))
+        for _ in range(6):
+            self.driver.behaviors.run(self.ctx)
+        self.assertTrue(all(mob.wanders == 2 for mob in mobs))
+        tale.mud_context.driver = self.driver
+        mobs[0].destroy(self.ctx)
+        self.assertEqual(9, len(self.driver.behaviors))
+
+    def test_active_region(self):
+        class Mob(tale.base.Living):
+            def init(self):
+                self.wanders = 0
+                self.fast_forwarded = 0.0
+
+            def wander(self, ctx):
+                self.wanders += 1
+
+            def fast_forward(self, inactive_time, ctx):
+                self.fast_forwarded = inactive_time
+
+        tale.mud_context.driver = self.driver
+        rooms = [tale.base.Location("room%d" % i) for i in range(6)]
+        for r1, r2 in zip(rooms, rooms[1:]):
+            tale.base.Exit.connect(r1, "east", "", None, r2, "west", "", None)
+        region = tale.driver.ActiveRegion(2)
+        activated = region.update([rooms[0]])
+        self.assertEqual({rooms[0], rooms[1], rooms[2]}, set(activated))
+        self.assertEqual({}, region.update([rooms[0]]), "no changes if players didn't move")
+        activated = region.update([rooms[3], None])
+        self.assertEqual({rooms[3], rooms[4], rooms[5]}, set(activated))
+        self.assertNotIn(rooms[0], region)
+        self.assertIn(rooms[1], region)
+        self.assertTrue(self.driver.is_active_location(rooms[0]))
+        self.driver.active_region = region
+        self.assertFalse(self.driver.is_active_location(rooms[0]))
+        near, far = Mob("near", "m"), Mob("far", "m")
+        rooms[5].insert(near, None)
+        rooms[0].insert(far, None)
+        for mob in (near, far):
+            self.driver.register_behavior(mob, "wander", 1.0)
+        self.driver.behaviors.run(self.ctx, region)
+        self.assertEqual(1, near.wanders)
+        self.assertEqual(0, far.wanders)
+        region.inactive_since[rooms[0]] -= 100
+        self.driver.all_players = {"p": tale.player.PlayerConnection(tale.player.Player("julie", "f"))}
+        rooms[0].insert(self.driver.all_players["p"].player, None)
+        self.driver._update_active_region(self.ctx)
+        self.assertGreaterEqual(far.fast_forwarded, 100.0)
+        self.assertEqual(0.0, near.fast_forwarded)
+        self.driver.behaviors.run(self.ctx, region)
+        self.assertEqual(1, far.wanders)
+        self.assertEqual(1, near.wanders)
+
+    def testActiveRegionLazyLocations(self):
+        # like the Circle rooms: a location only gets its exits when it's materialized
+        rooms = [tale.base.Location("room%d" % i) for i in range(6)]
+
+        def connect_next(location):
+            index = rooms.index(location)
+            if index + 1 < len(rooms):
+                tale.base.Exit("east", rooms[index + 1], "").bind(location)
+
+        for room in rooms:
+            room._lazy_loader = connect_next
+        region = tale.driver.ActiveRegion(3)
+        activated = region.update([rooms[0]])
+        self.assertEqual({rooms[0], rooms[1], rooms[2], rooms[3]}, set(activated), "the region must span 3 lazy hops")
+        self.assertTrue(all(room._lazy_loader is None for room in rooms[:4]))
+        self.assertIsNotNone(rooms[4]._lazy_loader, "locations outside of the region stay lazy")
+        self.assertEqual({}, region.update([rooms[0]]))
+        # a location in the region that is lazy again (its saved state is loaded later), is materialized
+        rooms[2]._lazy_loader = lambda location: location.exits.clear()
+        self.assertEqual({}, region.update([rooms[0]]))
+        self.assertIsNone(rooms[2]._lazy_loader)
+        self.assertEqual({rooms[0], rooms[1], rooms[2]}, region.locations, "the region must follow the changed exits")
+
+
 class TestCommands(unittest.TestCase):
     def setUp(self):
         self.cmds = tale.driver.Commands()
@@ -243,6 +443,65 @@ class TestCommands(unittest.TestCase):
         wiz = self.cmds.get([None])
         self.assertEqual({"verb2"}, set(wiz.keys()))
 
+    def testCommandsCached(self):
+        wiz = self.cmds.get(["wizard"])
+        self.assertIs(wiz, self.cmds.get({"wizard"}))
+        with self.assertRaises(TypeError):
+            wiz["verb5"] = func1    # type: ignore
+        version = self.cmds.version
+        self.cmds.add("verb5", func1, "wizard")
+        self.assertGreater(self.cmds.version, version)
+        self.assertIn("verb5", self.cmds.get(["wizard"]))
+        self.assertNotIn("verb5", wiz)
+
+    def testVerbTable(self):
+        driver = FakeDriver()
+        tale.mud_context.driver = driver
+        room = tale.base.Location("room")
+        julie = tale.player.Player("julie", "f")
+        room.insert(julie, None)
+        command_verbs, custom_verbs, all_verbs = driver.verb_table(julie)
+        self.assertEqual(frozenset(), custom_verbs)
+        self.assertEqual(set(command_verbs), all_verbs)
+        self.assertIs(all_verbs, driver.verb_table(julie)[2], "table should be cached")
+        computer = tale.base.Item("computer")
+        computer.verbs = {"hack": "hack the computer"}
+        room.insert(computer, None)
+        self.assertEqual({"hack"}, driver.verb_table(julie)[1])
+        computer.verbs = {"type": "type on the keyboard"}
+        self.assertEqual({"type"}, driver.verb_table(julie)[1])
+        room.remove(computer, julie)
+        self.assertEqual(frozenset(), driver.verb_table(julie)[1])
+        julie.insert(computer, julie)
+        self.assertEqual({"type"}, driver.verb_table(julie)[1])
+        self.assertIn("type", driver.verb_table(julie)[2])
+        julie.remove(computer, julie)
+        room.verbs = {"jump": "jump around"}
+        self.assertEqual({"jump"}, driver.verb_table(julie)[1])
+        self.assertEqual(set(driver.current_custom_verbs(julie)), driver.verb_table(julie)[1])
+        self.assertNotIn("!wiretap", driver.verb_table(julie)[0])
+        julie.privileges.add("wizard")
+        self.assertIn("!wiretap", driver.verb_table(julie)[0])
+        door = tale.base.Exit("door", tale.base.Location("hall"), "a door")
+        room.add_exits([door])
+        door.verbs = {"knock": "knock on the door"}
+        self.assertEqual({"jump", "knock"}, driver.verb_table(julie)[1], "exit verb changes must be noticed")
+        self.assertEqual({(frozenset(), room.vnum), (frozenset({"wizard"}), room.vnum)}, set(driver._verb_tables))
+
+    def testVerbTableCacheSize(self):
+        driver = FakeDriver()
+        driver.verb_tables_max_size = 3
+        tale.mud_context.driver = driver
+        julie = tale.player.Player("julie", "f")
+        rooms = [tale.base.Location("room%d" % i) for i in range(5)]
+        for room in rooms:
+            julie.move(room)
+            driver.verb_table(julie)
+        self.assertEqual([room.vnum for room in rooms[2:]], [vnum for _, vnum in driver._verb_tables])
+        julie.move(rooms[2])
+        driver.verb_table(julie)
+        self.assertEqual([rooms[3].vnum, rooms[4].vnum, rooms[2].vnum], [vnum for _, vnum in driver._verb_tables])
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
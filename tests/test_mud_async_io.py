@@ -0,0 +1,107 @@
+"""
+Unittests for the asyncio web server of the mud driver
+
+'Tale' mud driver, mudlib and interactive fiction framework
+Copyright by Irmen de Jong (irmen@razorvine.net)
+"""
+
+import asyncio
+import threading
+import unittest
+
+from tale.tio.mud_async_io import AsyncHttpServer, LoopEvent, EventSourceStream
+
+
+class CountingStream(EventSourceStream):
+    def __init__(self, count):
+        super().__init__(None, None)
+        self.count = count
+
+    async def next_chunk(self):
+        if self.count == 0:
+            return None
+        self.count -= 1
+        await asyncio.sleep(0)
+        return b"data: chunk\n\n"
+
+
+def wsgi_app(environ, start_response):
+    path = environ["PATH_INFO"]
+    if path == "/stream":
+        start_response("200 OK", [("Content-Type", "text/event-stream")])
+        return CountingStream(3)
+    if path == "/sized":
+        start_response("200 OK", [("Content-Type", "application/octet-stream"), ("Content-Length", "12")])
+        return (chunk for chunk in [b"abcd", b"efgh", b"ijkl"])
+    if path == "/error":
+        raise ValueError("crash")
+    body = environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [("%s %s %s " % (environ["REQUEST_METHOD"], path, environ["QUERY_STRING"])).encode("ascii"), body]
+
+
+class TestAsyncIo(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = AsyncHttpServer(wsgi_app, "localhost", 0)
+        self.server.start(self.loop)
+
+    def tearDown(self):
+        self.server.close(self.loop)
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def request(self, *requests):
+        async def client():
+            reader, writer = await asyncio.open_connection(*self.server.server_address)
+            for r in requests:
+                writer.write(r)
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+            return data
+        return self.loop.run_until_complete(asyncio.wait_for(client(), 5))
+
+    def test_request_keepalive(self):
+        response = self.request(b"GET /hello?a=1 HTTP/1.1\r\nHost: localhost\r\n\r\n",
+                                b"POST /input HTTP/1.1\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello")
+        first, second = response.split(b"HTTP/1.1 200 OK")[1:]
+        self.assertIn(b"Connection: keep-alive", first)
+        self.assertTrue(first.endswith(b"GET /hello a=1 "))
+        self.assertIn(b"Content-Length: 18", second)
+        self.assertIn(b"Connection: close", second)
+        self.assertTrue(second.endswith(b"POST /input  hello"))
+
+    def test_error(self):
+        response = self.request(b"GET /error HTTP/1.1\r\n\r\n")
+        self.assertTrue(response.startswith(b"HTTP/1.1 500 Internal server error"))
+
+    def test_stream(self):
+        response = self.request(b"GET /stream HTTP/1.1\r\n\r\n")
+        self.assertIn(b"Content-Type: text/event-stream", response)
+        self.assertNotIn(b"Content-Length", response)
+        self.assertEqual(3, response.count(b"data: chunk\n\n"))
+
+    def test_sized_response(self):
+        response = self.request(b"GET /sized HTTP/1.1\r\n\r\n", b"GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n")
+        first, second = response.split(b"HTTP/1.1 200 OK")[1:]
+        self.assertEqual(1, first.count(b"Content-Length"))
+        self.assertIn(b"Connection: keep-alive", first)
+        self.assertTrue(first.endswith(b"\r\n\r\nabcdefghijkl"))
+        self.assertTrue(second.endswith(b"GET /hello  "))
+
+    def test_loop_event(self):
+        event = LoopEvent(self.loop)
+        self.assertFalse(self.loop.run_until_complete(event.wait(0.01)))
+        t = threading.Thread(target=event.set)
+        t.start()
+        t.join()
+        self.assertTrue(self.loop.run_until_complete(event.wait(5)))
+        self.assertTrue(event.is_set())
+        event.clear()
+        self.assertFalse(event.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -821,6 +821,35 @@ class TestLiving(unittest.TestCase):
         self.assertEqual(["Julie farts.", "Julie takes a note."], listener.messages)
         self.assertEqual(1, j.inventory_size)
 
+    def test_lazy_wiretap(self):
+        room = Location("room")
+        j = Living("julie", "f")
+        room.insert(j, None)
+        num_topics = len(pubsub.all_topics)
+        room.tell("nobody is listening")
+        j.tell("nobody is listening")
+        self.assertEqual(num_topics, len(pubsub.all_topics), "tell shouldn't create wiretap topics")
+        self.assertNotIn(room.vnum, MudObjRegistry.wiretapped)
+        listener = PubsubCollector()
+        tap = room.get_wiretap()
+        self.assertIs(tap, room.get_wiretap())
+        self.assertIs(room, MudObjRegistry.wiretapped[room.vnum])
+        room.tell("hello")
+        pubsub.sync()
+        self.assertEqual([], listener.messages)
+        tap.subscribe(listener)
+        room.tell("hello")
+        pubsub.sync()
+        self.assertEqual(["hello"], listener.messages)
+        room.drop_wiretap()
+        self.assertNotIn(tap.name, pubsub.all_topics)
+        self.assertNotIn(room.vnum, MudObjRegistry.wiretapped)
+        room.tell("hello again")
+        pubsub.sync()
+        self.assertEqual(["hello"], listener.messages)
+        self.assertIsNot(tap, room.get_wiretap())
+        room.drop_wiretap()
+
 
 class TestAggressiveNpc(unittest.TestCase):
     def test_init_inventory(self):
@@ -1255,6 +1284,40 @@ class TestMudObject(unittest.TestCase):
         self.assertIs(e1, MudObjRegistry.all_exits[e1.vnum])
         self.assertIs(n1, MudObjRegistry.all_livings[n1.vnum])
 
+    def test_registry_indexes(self):
+        class Gem(Item):
+            pass
+        ctx = Context(mud_context.driver, None, None, None)
+        hall = Location("hall")
+        gem1 = Gem("gem")
+        self.assertIsNone(gem1.prototype)
+        self.assertEqual(0, MudObjRegistry.count(Item, "test-gem"))
+        gem1.prototype = "test-gem"
+        self.assertEqual("test-gem", gem1.prototype)
+        gem2 = gem1.clone()
+        self.assertEqual("test-gem", gem2.prototype)
+        fox = Living("fox", "f")
+        fox.prototype = "test-gem"    # prototypes are per base class
+        self.assertEqual(2, MudObjRegistry.count(Item, "test-gem"))
+        self.assertEqual({gem1, gem2}, set(MudObjRegistry.instances(Item, "test-gem")))
+        self.assertEqual([fox], MudObjRegistry.instances(Living, "test-gem"))
+        self.assertEqual(2, MudObjRegistry.count_class(Gem))
+        self.assertGreaterEqual(MudObjRegistry.count_class(Item, subclasses=True), MudObjRegistry.count_class(Item) + 2)
+        self.assertIn(gem1, MudObjRegistry.instances_of_class(Item, subclasses=True))
+        self.assertNotIn(gem1, MudObjRegistry.instances_of_class(Item))
+        hall.insert(gem1, None)
+        fox.insert(gem2, fox)
+        hall.insert(fox, None)
+        self.assertEqual({hall: [gem1, gem2]}, {loc: sorted(objs, key=lambda o: o.vnum)
+                                               for loc, objs in MudObjRegistry.whereabouts(Item, "test-gem").items()})
+        gem1.prototype = "test-ruby"
+        self.assertEqual([gem2], MudObjRegistry.instances(Item, "test-gem"))
+        self.assertEqual([gem1], MudObjRegistry.instances(Item, "test-ruby"))
+        fox.destroy(ctx)    # also destroys what it carries
+        self.assertEqual(0, MudObjRegistry.count(Item, "test-gem"))
+        self.assertEqual(0, MudObjRegistry.count(Living, "test-gem"))
+        self.assertEqual(1, MudObjRegistry.count_class(Gem))
+
     def test_story_data(self):
         i = Item("thing")
         self.assertEqual({}, i.story_data)
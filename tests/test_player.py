@@ -5,7 +5,9 @@ Unittests for Mud base objects
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 
+import hashlib
 import pathlib
+import sqlite3
 import sys
 import tempfile
 import time
@@ -502,6 +504,13 @@ class TestPlayerConnection(unittest.TestCase):
             self.assertEqual("input text", x)
             self.assertEqual("  first this text\ninputprompt ", sys.stdout.getvalue())  # should have outputted the buffered text
 
+    def test_input_wakes_driver(self):
+        player = Player("julie", "f")
+        tale.mud_context.driver.wakeup.clear()
+        player.store_input_line("look")
+        self.assertTrue(player.input_is_available.is_set())
+        self.assertTrue(tale.mud_context.driver.wakeup.is_set())
+
     def test_peek_output(self):
         player = Player("fritz", "m")
         pc = PlayerConnection(player, ConsoleIo(None))
@@ -819,9 +828,145 @@ class TestMudAccounts(unittest.TestCase):
             accounts.save_story_data("testname", account.story_data)
             account = accounts.get("testname")
             self.assertEqual({"test": 42, "thing": [1.2, 3.4]}, account.story_data)
+            accounts.close()
         finally:
             dbfile.unlink()
 
+    def test_connection_pool(self):
+        dbfile = pathlib.Path(tempfile.gettempdir()) / "tale_test_accdb_{0:f}.sqlite".format(time.time())
+        try:
+            accounts = MudAccounts(str(dbfile))
+            stats = Stats.from_race("elf", gender='f')
+            accounts.create("testname", "s3cr3t", "test@invalid", stats, {"wizard"})
+            accounts.save_story_data("testname", {"test": 1})
+            accounts.flush()
+            accounts.save_story_data("testname", {"test": 2})
+            accounts.flush()
+            self.assertEqual(1, len(accounts._pool))
+            pooled = accounts._pool[0]
+            with accounts._sqlite_connect() as conn:
+                self.assertIs(pooled, conn)
+                self.assertEqual("wal", conn.execute("PRAGMA journal_mode").fetchone()[0])
+                with accounts._sqlite_connect() as conn2:
+                    self.assertIsNot(conn, conn2, "a connection is used by one at a time")
+                self.assertEqual(1, conn.execute("SELECT COUNT(*) FROM StoryData").fetchone()[0])
+            self.assertEqual(2, len(accounts._pool))
+            with self.assertRaises(ValueError):
+                with accounts._sqlite_connect() as conn:
+                    conn.execute("UPDATE Account SET banned=1")
+                    raise ValueError("rollback")
+            account = accounts.get("testname")
+            self.assertFalse(account.banned)
+            self.assertEqual({"wizard"}, account.privileges)
+            self.assertEqual({"test": 2}, account.story_data)
+            self.assertEqual(stats.hp, account.stats.hp)
+            accounts.create("othername", "s3cr3t", "test@invalid", Stats.from_race("human", gender='m'))
+            self.assertEqual(["othername", "testname"], [a.name for a in accounts.all_accounts()])
+            self.assertEqual(["testname"], [a.name for a in accounts.all_accounts(having_privilege="wizard")])
+            accounts.close()
+            self.assertEqual([], accounts._pool)
+            # a database in memory must be shared by all connections of the pool
+            accounts = MudAccounts(":memory:")
+            accounts.create("testname", "s3cr3t", "test@invalid", stats)
+            with accounts._sqlite_connect():
+                self.assertEqual("testname", accounts.get("testname").name)
+            accounts.close()
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                path = pathlib.Path(str(dbfile) + suffix)
+                if path.exists():
+                    path.unlink()
+
+    def test_cache_write_behind(self):
+        wizard = Living("wizz", gender="f")
+        wizard.privileges.add("wizard")
+        accounts = MudAccounts(":memory:")
+        accounts.flush_interval = 1000
+        stats = Stats.from_race("elf", gender='f')
+        accounts.create("testname", "s3cr3t", "test@invalid", stats)
+        account = accounts.get("testname")
+        self.assertIn("testname", accounts._cache)
+        account.privileges.add("wizard")
+        self.assertEqual(set(), accounts.get("testname").privileges, "must get a copy, not the cached account itself")
+        accounts.update_privileges("testname", account.privileges, wizard)
+        self.assertNotIn("testname", accounts._cache, "must be invalidated")
+        self.assertEqual({"wizard"}, accounts.get("testname").privileges)
+        accounts.ban("testname", wizard)
+        self.assertTrue(accounts.get("testname").banned)
+        accounts.valid_password("testname", "s3cr3t")
+        with self.assertRaises(ValueError):
+            accounts.valid_password("testname", "wrong")
+        with self.assertRaises(ValueError):
+            accounts.valid_password("nobody", "s3cr3t")
+        # login times and story data are written later, but are visible right away
+        accounts.logged_in("testname")
+        accounts.save_story_data("testname", {"test": 42})
+        with self.assertRaises(LookupError):
+            accounts.save_story_data("nobody", {})
+        self.assertIsNotNone(accounts._flush_timer)
+        with accounts._sqlite_connect() as conn:
+            self.assertIsNone(conn.execute("SELECT logged_in FROM Account").fetchone()[0])
+            self.assertEqual(0, conn.execute("SELECT COUNT(*) FROM StoryData").fetchone()[0])
+        account = accounts.get("testname")
+        self.assertIsNotNone(account.logged_in)
+        self.assertEqual({"test": 42}, account.story_data)
+        accounts._cache.clear()
+        self.assertEqual({"test": 42}, accounts.get("testname").story_data)
+        self.assertEqual(account.logged_in, accounts.all_accounts()[0].logged_in)
+        accounts.flush()
+        with accounts._sqlite_connect() as conn:
+            self.assertEqual(account.logged_in, conn.execute("SELECT logged_in FROM Account").fetchone()[0])
+            self.assertEqual(1, conn.execute("SELECT COUNT(*) FROM StoryData").fetchone()[0])
+        accounts.close()
+        self.assertIsNone(accounts._flush_timer)
+
+    def test_close_failed_flush(self):
+        accounts = MudAccounts(":memory:")
+        accounts.flush_interval = 1000
+        accounts.create("testname", "s3cr3t", "test@invalid", Stats.from_race("elf", gender='f'))
+        accounts.save_story_data("testname", {"test": 42})
+        with accounts._sqlite_connect() as conn:
+            conn.execute("DROP TABLE StoryData")
+        self.assertEqual(1, len(accounts._pool))
+        with self.assertRaises(sqlite3.Error):
+            accounts.close()
+        self.assertEqual([], accounts._pool, "the connections must be closed anyway")
+        self.assertIn("testname", accounts._pending_story_data, "the write must not be thrown away silently")
+
+    def test_password_hashing(self):
+        pw, salt = MudAccounts._pwhash("secret", "some salt")
+        self.assertTrue(pw.startswith("pbkdf2$100000$"))
+        self.assertEqual(("pbkdf2", (100000,)), MudAccounts._parse_pwhash(pw))
+        pw, salt = MudAccounts._pwhash("secret", "some salt", method="sha1")
+        self.assertEqual(("sha1", ()), MudAccounts._parse_pwhash(pw))
+        with self.assertRaises(ValueError):
+            MudAccounts._pwhash("secret", method="md5")
+        with self.assertRaises(ValueError):
+            MudAccounts(":memory:", "md5")
+        accounts = MudAccounts(":memory:")
+        stats = Stats.from_race("elf", gender='f')
+        accounts.create("testname", "s3cr3t", "test@invalid", stats)
+        # old style password hashes are upgraded when the password is verified
+        with accounts._sqlite_connect() as conn:
+            conn.execute("UPDATE Account SET pw_hash=?, pw_salt=?", (pw, salt))
+        accounts._invalidate("testname")
+        accounts.valid_password("testname", "secret")
+        self.assertTrue(accounts.get("testname").pw_hash.startswith("pbkdf2$"))
+        accounts.valid_password("testname", "secret")
+        # hashing is done on a worker thread
+        future = accounts.submit(accounts.valid_password, "testname", "wrong")
+        with self.assertRaises(ValueError):
+            future.result()
+        accounts.submit(accounts.change_password_email, "testname", "secret", "n3wsecret").result()
+        accounts.valid_password("testname", "n3wsecret")
+        accounts.close()
+        if hasattr(hashlib, "scrypt"):
+            accounts = MudAccounts(":memory:", "scrypt")
+            accounts.create("testname", "s3cr3t", "test@invalid", stats)
+            self.assertTrue(accounts.get("testname").pw_hash.startswith("scrypt$16384$8$1$"))
+            accounts.valid_password("testname", "s3cr3t")
+            accounts.close()
+
 
 class WrappedConsoleIO(ConsoleIo):
     def __init__(self, connection: PlayerConnection) -> None:
@@ -6,10 +6,12 @@ Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 
 import gc
+import threading
 import time
 import unittest
 
-from tale.pubsub import topic, unsubscribe_all, Listener, sync, pending
+from tale import pubsub
+from tale.pubsub import topic, unsubscribe_all, Listener, sync, pending, stats
 
 
 class Subber(Listener):
@@ -186,6 +188,105 @@ class TestPubsub(unittest.TestCase):
         s.send("event")
         self.assertLess(s.idle_time, 0.1)
 
+    def test_wakeup(self):
+        s = topic("testA")
+        s.wakeup = threading.Event()
+        try:
+            self.assertFalse(s.wakeup.is_set())
+            s.send("event")
+            self.assertTrue(s.wakeup.is_set())
+        finally:
+            s.wakeup = None
+        sync()
+
+    def test_unsubscribe_all_index(self):
+        s1 = topic("testA")
+        s2 = topic("testB")
+        subber = Subber("sub1")
+        s1.subscribe(subber)
+        s2.subscribe(subber)
+        self.assertEqual({"testA", "testB"}, pubsub._subscriptions[subber])
+        s2.unsubscribe(subber)
+        self.assertEqual({"testA"}, pubsub._subscriptions[subber])
+        s2.subscribe(subber)
+        unsubscribe_all(subber)
+        self.assertNotIn(subber, pubsub._subscriptions)
+        self.assertEqual(0, len(s1.subscribers))
+        self.assertEqual(0, len(s2.subscribers))
+        s3 = topic("testC")
+        s3.subscribe(subber)
+        s3.destroy()
+        self.assertEqual(set(), pubsub._subscriptions[subber])
+        unsubscribe_all(subber)
+
+    def test_bounded_queue(self):
+        sync()
+        s = topic("testbounded", max_pending=3)
+        self.assertIs(s, topic("testbounded", max_pending=10))
+        subber = Subber("sub1")
+        s.subscribe(subber)
+        try:
+            self.assertEqual(3, s.max_pending)
+            for i in range(5):
+                s.send(i)
+            self.assertEqual(3, pending()["testbounded"][0])
+            sync()
+            self.assertEqual([("testbounded", 2), ("testbounded", 3), ("testbounded", 4)], subber.messages)
+            self.assertEqual(2, stats("testbounded")["testbounded"].dropped)
+            with self.assertRaises(RuntimeError):
+                s.max_pending = None
+        finally:
+            s.destroy()
+        s = topic("testunbounded")
+        try:
+            self.assertIsNone(s.max_pending)
+            for i in range(20000):
+                s.send(i)
+            self.assertEqual(20000, pending()["testunbounded"][0])
+            self.assertEqual(0, stats("testunbounded")["testunbounded"].dropped)
+        finally:
+            s.events.clear()
+            s.destroy()
+
+    def test_stats(self):
+        s = topic("teststats")
+        subber = Subber("sub1")
+        s.subscribe(subber)
+        try:
+            for i in range(10):
+                s.send(i)
+            s.sync()
+            s.send(99, True)
+            st = stats()["teststats"]
+            self.assertEqual(11, st.total_events)
+            self.assertEqual(10, st.max_queue_depth)
+            self.assertEqual(0, st.dropped)
+            self.assertGreater(st.dispatch_time, 0.0)
+            self.assertGreaterEqual(st.events_per_sec, 0.0)
+        finally:
+            s.destroy()
+
+    def test_threaded_send(self):
+        s = topic("testthreads")
+        subber = Subber("sub1")
+        s.subscribe(subber)
+
+        def sender():
+            for i in range(1000):
+                s.send(i)
+        try:
+            threads = [threading.Thread(target=sender) for _ in range(4)]
+            for t in threads:
+                t.start()
+            while any(t.is_alive() for t in threads):
+                s.sync()
+            for t in threads:
+                t.join()
+            s.sync()
+            self.assertEqual(4000, len(subber.messages))
+        finally:
+            s.destroy()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,13 +5,14 @@ Unit tests for serialization
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 import os
+import tempfile
 import unittest
 import datetime
 
-from tale import mud_context, races, base, player, util, hints, driver
+from tale import mud_context, races, base, player, util, hints, driver, vfs
 from tale.items import basic, bank, board
 from tale.story import *
-from tale.savegames import TaleSerializer, TaleDeserializer
+from tale.savegames import TaleSerializer, TaleDeserializer, SaveCheckpoint, BinaryCodec, SavegameWriter
 
 from tests.supportstuff import FakeDriver, Thing
 
@@ -313,6 +314,7 @@ class TestSerializing(unittest.TestCase):
         assert x1["periodical"] is None
         assert x1["owner"] == "class:tests.supportstuff.Thing"
         assert x1["due_gametime"] == now.isoformat()
+        assert "_resolved_action" not in x1
         assert x2["action"] == "getcwd"
         assert x2["owner"] in ("module:os", "module:nt", "module:posix")
         assert x3["action"] == "module_level_func"
@@ -380,6 +382,217 @@ class TestSerializing(unittest.TestCase):
         assert "posts" not in x, "default serpent doesn't serialize properties"
         assert x["dummy"] == "dummyvalue"
 
+    def test_checkpoint_changes(self):
+        ser = TaleSerializer()
+        p = player.Player("julie", "f")
+        room = base.Location("room")
+        thing = base.Item("thing")
+        rat = base.Living("rat", "n")
+        door = base.Door("north", room, "a door", opened=False)
+        room.insert(rat, None)
+        checkpoint = SaveCheckpoint(ser.snapshot(None, p, [thing], [rat], [room], [door], [], None))
+        delta = checkpoint.delta(ser.snapshot(None, p, [thing], [rat], [room], [door], [], None))
+        self.assertEqual(([], [], [], []), (delta["items"], delta["livings"], delta["locations"], delta["exits"]))
+        # plain attribute assignments are picked up without the game code having to mark the objects
+        thing.value = 42
+        rat.aggressive = True
+        rat.following = p
+        door.opened = True
+        delta = checkpoint.delta(ser.snapshot(None, p, [thing], [rat], [room], [door], [], None))
+        self.assertEqual([thing.vnum], [i["vnum"] for i in delta["items"]])
+        self.assertEqual([rat.vnum], [l["vnum"] for l in delta["livings"]])
+        self.assertEqual([], delta["locations"])
+        self.assertEqual([door.vnum], [e["vnum"] for e in delta["exits"]])
+        self.assertEqual("julie", delta["player"]["name"])
+        room.remove(rat, None)
+        delta = checkpoint.delta(ser.snapshot(None, p, [thing], [], [room], [door], [], None))
+        self.assertEqual([room.vnum], [loc["vnum"] for loc in delta["locations"]])
+        self.assertEqual({"items": [], "livings": [rat.vnum], "locations": [], "exits": []}, delta["removed"])
+
+    def test_delta(self):
+        ser = TaleSerializer()
+        deser = TaleDeserializer()
+        p = player.Player("julie", "f")
+        apple = base.Item("apple")
+        pear = base.Item("pear")
+        plum = base.Item("plum")
+        snapshot = ser.snapshot(None, p, [apple, pear], [], [], [], [], None)
+        full = ser.encode(snapshot)
+        checkpoint = SaveCheckpoint(snapshot)
+        self.assertEqual(0, checkpoint.num_deltas)
+        checksum = TaleSerializer.checksum(full)
+        apple.value = 1.5
+        delta = checkpoint.delta(ser.snapshot(None, p, [apple, plum], [], [], [], [], None))
+        self.assertEqual([apple.vnum, plum.vnum], [i["vnum"] for i in delta["items"]])
+        self.assertEqual([pear.vnum], delta["removed"]["items"])
+        self.assertEqual([], delta["removed"]["livings"])
+        delta1 = ser.delta_record(ser.encode(delta), checksum)
+        stale = ser.delta_record(ser.encode(delta), checksum + 1)
+        plum.value = 3.0
+        delta = checkpoint.delta(ser.snapshot(None, p, [apple, plum], [], [], [], [], None))
+        self.assertEqual([plum.vnum], [i["vnum"] for i in delta["items"]])
+        delta2 = ser.delta_record(ser.encode(delta), checksum)
+        # the delta for another savegame is skipped, the last record is incomplete (interrupted while saving) and is ignored
+        deltas = deser.deserialize_deltas(stale + delta1 + delta2 + delta1[:30], checksum)
+        self.assertEqual(2, len(deltas))
+        reader = deser.reader(full)
+        for delta in deltas:
+            reader.apply_delta(delta)
+        self.assertEqual(sorted([apple.vnum, plum.vnum]), reader.vnums("items"))
+        self.assertEqual(1.5, reader.take("items", apple.vnum)["value"])
+        self.assertEqual(3.0, reader.take("items", plum.vnum)["value"])
+        self.assertEqual("julie", reader.value("player")["name"])
+        self.assertNotIn("removed", reader.values)
+        with self.assertRaises(ValueError):
+            deser.deserialize_deltas(b"garbage" * 10, checksum)
+
+    def test_background_writer(self):
+        resources = vfs.VirtualFileSystem(root_path=tempfile.mkdtemp(), readonly=False)
+        ser = TaleSerializer("binary")
+        p = player.Player("julie", "f")
+        apple = base.Item("apple")
+        snapshot = ser.snapshot(None, p, [apple], [], [], [], [], None)
+        checkpoint = SaveCheckpoint(snapshot)
+        done = []
+        writer = SavegameWriter(ser, resources, "test.savegame", snapshot, checkpoint, False, done.append)
+        apple.value = 99.0     # changes after the snapshot was taken are not in the savegame
+        writer.start()
+        writer.join()
+        self.assertEqual([writer], done)
+        self.assertIsNone(writer.error)
+        self.assertEqual(("done", 1.0), (writer.stage, writer.progress))
+        full = resources["test.savegame"].data
+        self.assertEqual(TaleSerializer.checksum(full), checkpoint.checksum)
+        self.assertEqual(0.0, TaleDeserializer().deserialize(full)["items"][0]["value"])
+        writer = SavegameWriter(ser, resources, "test.savegame", checkpoint.delta(ser.snapshot(None, p, [apple], [], [], [], [], None)),
+                                checkpoint, True, done.append)
+        writer.run()
+        deltas = TaleDeserializer().deserialize_deltas(resources["test.savegame.delta"].data, checkpoint.checksum)
+        self.assertEqual(99.0, deltas[0]["items"][0]["value"])
+        # a write that fails halfway leaves the previous savegame intact
+        writer = SavegameWriter(ser, resources, "test.savegame", ser.snapshot(None, p, [], [], [], [], [], None),
+                                checkpoint, False, done.append)
+
+        def crashing_write(out, data):
+            out.write(data[:10])
+            raise IOError("disk full")
+        writer.write = crashing_write
+        writer.run()
+        self.assertEqual("failed", writer.stage)
+        self.assertIsInstance(writer.error, IOError)
+        self.assertEqual(full, resources["test.savegame"].data)
+        self.assertEqual(["test.savegame", "test.savegame.delta"], sorted(resources.contents()))
+
+    def test_binary_codec(self):
+        p = player.Player("julie", "f")
+        box = base.Container("box")
+        box.init_inventory([base.Item("apple"), basic.Money("money", 12.5)])
+        loc = base.Location("hall")
+        loc.insert(p, p)
+        loc.insert(box, None)
+        args = (StoryConfig(), p, list(box.inventory) + [box], [], [loc], [], [], util.GameDateTime(datetime.datetime(2020, 1, 2)))
+        deser = TaleDeserializer()
+        text = deser.deserialize(TaleSerializer().serialize(*args))
+        for compression in ("zlib", "lzma", ""):
+            data = TaleSerializer("binary", compression).serialize(*args)
+            self.assertTrue(data.startswith(b"TALEBIN1"))
+            self.assertEqual(text, deser.deserialize(data))
+        with self.assertRaises(ValueError):
+            TaleSerializer("pickle")
+        with self.assertRaises(ValueError):
+            TaleSerializer("binary", "bzip2")
+        codec = BinaryCodec(compression="")
+        data = {"int": 2 ** 70, "neg": -42, "nan": float("nan"), "tuple": (1, "a"), "set": {1, 2}, "empty": set(),
+                "bytes": b"\x00\xff", "nested": [{"x": None, "y": True, "z": False}], "date": datetime.date(2020, 1, 2),
+                "delta": datetime.timedelta(seconds=30), "ref": (42, "name", "tale.base.Item", "tale.base.Item")}
+        result = codec.decode(codec.encode(data))
+        self.assertNotEqual(result.pop("nan"), result.pop("nan", 0))
+        self.assertEqual({"int": 2 ** 70, "neg": -42, "tuple": (1, "a"), "set": {1, 2}, "empty": (),
+                          "bytes": b"\x00\xff", "nested": [{"x": None, "y": True, "z": False}], "date": "2020-01-02",
+                          "delta": 30.0, "ref": (42, "name", "tale.base.Item", "tale.base.Item")}, result)
+
+    def test_reader(self):
+        p = player.Player("julie", "f")
+        box = basic.Boxlike("box")
+        apple = base.Item("apple")
+        box.init_inventory([apple])
+        box.opened = False
+        loc = base.Location("hall")
+        loc.insert(p, p)
+        loc.insert(box, None)
+        args = (StoryConfig(), p, [apple, box], [], [loc], [], [], util.GameDateTime(datetime.datetime(2020, 1, 2)))
+        deser = TaleDeserializer()
+        for codec in ("serpent", "binary"):
+            reader = deser.reader(TaleSerializer(codec).serialize(*args))
+            self.assertEqual(sorted([apple.vnum, box.vnum]), reader.vnums("items"))
+            self.assertIn(("locations", loc.vnum), reader)
+            self.assertEqual({"items": {(box.vnum, "box", "tale.items.basic.Boxlike", "tale.base.Item")}},
+                             reader.fields("locations", loc.vnum, {"items", "nonexisting"}))
+            self.assertEqual({(apple.vnum, "apple", "tale.base.Item", "tale.base.Item")},
+                             reader.fields("items", box.vnum, {"inventory"})["inventory"], "contents of a closed box must be saved too")
+            self.assertIn(("items", box.vnum), reader, "fields must leave the record in the reader")
+            record = reader.take("items", apple.vnum)
+            self.assertEqual("apple", record["name"])
+            self.assertNotIn(("items", apple.vnum), reader)
+            self.assertEqual("julie", reader.value("player")["name"])
+            self.assertEqual({"story_config", "clock", "deferreds"}, set(reader.values))
+
+    def test_postponed_locations(self):
+        from tale.savegames import SavegameLoader
+        p = player.Player("julie", "f")
+        hall, kitchen, cellar = base.Location("hall"), base.Location("kitchen"), base.Location("cellar")
+        exits = list(base.Exit.connect(hall, "kitchen", "to the kitchen", None, kitchen, "hall", "to the hall", None))
+        exits += base.Exit.connect(kitchen, "cellar", "to the cellar", None, cellar, "kitchen", "to the kitchen", None)
+        rat = base.Living("rat", "n")
+        cheese = base.Item("cheese")
+        stone = base.Item("stone")
+        rat.insert(cheese, rat)
+        cellar.insert(rat, rat)
+        cellar.insert(stone, None)
+        hall.insert(p, p)
+        args = (StoryConfig(), p, [cheese, stone], [rat], [hall, kitchen, cellar], exits, [], util.GameDateTime(datetime.datetime(2020, 1, 2)))
+        deser = TaleDeserializer()
+        for codec in ("serpent", "binary"):
+            data = TaleSerializer(codec).serialize(*args)
+            # the cellar is 2 exits away from the player, it is only loaded when it's needed
+            stone.value = 99.0
+            loader = SavegameLoader(deser.reader(data), deser)
+            loader.postpone_far_locations(hall, 1, [], None)
+            self.assertIn(cellar.vnum, loader.postponed)
+            self.assertNotIn(kitchen.vnum, loader.postponed)
+            loader.load()
+            loader.install()
+            self.assertEqual(99.0, stone.value)
+            self.assertEqual([], loader.reader.vnums("exits"))
+            self.assertIn(("locations", cellar.vnum), loader.reader)
+            self.assertNotIn(("locations", kitchen.vnum), loader.reader)
+            stone.move(kitchen)    # first loads the saved cellar, which resets the stone, then the stone is moved
+            self.assertIsNone(cellar._lazy_loader)
+            self.assertEqual(0, stone.value)
+            self.assertIs(stone.contained_in, kitchen)
+            self.assertIs(rat.location, cellar)
+            self.assertEqual({cheese}, rat.inventory)
+            self.assertEqual([], loader.reader.vnums("items"))
+            stone.move(cellar)
+            # something that is loaded right away holds the cheese that's in the cellar now: load the cellar right away too
+            loader = SavegameLoader(deser.reader(data), deser)
+            loader.postpone_far_locations(hall, 1, [{"inventory": {(cheese.vnum, "cheese", "tale.base.Item", "tale.base.Item")}}], None)
+            self.assertNotIn(cellar.vnum, loader.postponed)
+            # the saved contents are different from the current contents of the cellar
+            cellar.remove(stone, None)
+            loader = SavegameLoader(deser.reader(data), deser)
+            loader.postpone_far_locations(hall, 1, [], None)
+            self.assertNotIn(cellar.vnum, loader.postponed)
+            cellar.insert(stone, None)
+
+    def test_loader_references(self):
+        from tale.savegames import SavegameLoader
+        value = {"inventory": {(12, "cheese", "tale.base.Item", "tale.base.Item")},
+                 "location": (13, "cellar", "tale.base.Location", "tale.base.Location"),
+                 "story_data": {"quote": (14, "four", "string", "values"), "pair": [(15, "x")]},
+                 "following": [(16, "julie", "tale.player.Player", "tale.player.Player")]}
+        self.assertEqual({12, 13, 16}, set(SavegameLoader.references(value)))
+
 
 if __name__ == '__main__':
     unittest.main()
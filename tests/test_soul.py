@@ -945,6 +945,41 @@ class TestSoul(unittest.TestCase):
             tale.verbdefs.NONLIVING_OK_VERBS = ORIG_NONLIVING_OK_VERBS
             tale.verbdefs.MOVEMENT_VERBS = ORIG_MOVEMENT_VERBS
 
+    def test_name_index(self):
+        soul = tale.base.Soul()
+        player = tale.player.Player("julie", "f")
+        room = tale.base.Location("somewhere")
+        player.move(room)
+        rat = tale.base.Living("rat", "n", race="rodent")
+        room.insert(rat, None)
+        gem = tale.base.Item("gem", "red gem")
+        room.insert(gem, None)
+        parsed = soul.parse(player, "kick rat")
+        self.assertEqual([rat], list(parsed.who_info))
+        rat.aliases = {"vermin"}
+        parsed = soul.parse(player, "kick vermin")
+        self.assertEqual([rat], list(parsed.who_info))
+        rat.init_names("mouse", None, None, None)
+        parsed = soul.parse(player, "kick mouse")
+        self.assertEqual([rat], list(parsed.who_info))
+        rat.aliases = set()
+        with self.assertRaises(tale.errors.ParseError):
+            soul.parse(player, "kick vermin")
+        room.remove(rat, None)
+        with self.assertRaises(tale.errors.ParseError):
+            soul.parse(player, "kick mouse")
+        parsed = soul.parse(player, "look at gem", external_verbs={"look"})
+        self.assertEqual([gem], list(parsed.who_info))
+        # an item in the inventory takes precedence over an item with the same name in the room
+        gem2 = tale.base.Item("gem", "blue gem")
+        player.insert(gem2, player)
+        parsed = soul.parse(player, "look at gem", external_verbs={"look"})
+        self.assertEqual([gem2], list(parsed.who_info))
+        player.remove(gem2, player)
+        parsed = soul.parse(player, "look at gem", external_verbs={"look"})
+        self.assertEqual([gem], list(parsed.who_info))
+        self.assertNotIn("gem", player._inventory_names)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
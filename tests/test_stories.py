@@ -4,8 +4,10 @@ Unit tests for demo story
 'Tale' mud driver, mudlib and interactive fiction framework
 Copyright by Irmen de Jong (irmen@razorvine.net)
 """
+import gc
 import pathlib
 import sys
+import tempfile
 import unittest
 
 import tale
@@ -32,6 +34,12 @@ class StoryCaseBase:
         for m in list(sys.modules.keys()):
             if m.startswith("zones") or m == "story":
                 del sys.modules[m]
+        # get rid of the story's objects too, or they would still be counted in the MudObjRegistry.
+        # (the cache of periodicals keeps the story's classes, and with that all of its modules, alive,
+        # and the driver keeps the players, and with that the world they're in, alive)
+        tale.util._periodicals_from_class.cache_clear()
+        mud_context.driver = None
+        gc.collect()
 
 
 class TestZedStory(StoryCaseBase, unittest.TestCase):
@@ -101,6 +109,113 @@ class TestCircleStory(StoryCaseBase, unittest.TestCase):
         self.assertEqual("pile", o.name)
         self.assertEqual(23574.0, o.value, "money object must have value>0")
 
+    def test_lazy_zones(self):
+        from tale import player
+        from tale.vfs import VirtualFileSystem
+        mud_context.driver.user_resources = VirtualFileSystem(root_path=tempfile.mkdtemp(), readonly=False)
+        import zones
+        zones.init_zones(mud_context.driver)
+        self.assertEqual(set(), zones.populated_zones)
+        temple = zones.make_location(3001)
+        self.assertEqual({}, temple.exits, "exits are made when the location is materialized")
+        self.assertEqual(set(), zones.populated_zones)
+        julie = player.Player("julie", "f")
+        temple.insert(julie, julie)
+        self.assertIn(30, zones.populated_zones, "entering a room populates its zone")
+        self.assertEqual({"north", "east", "south", "west", "down"}, set(temple.exits))
+        altar = temple.exits["north"].target
+        self.assertEqual(3054, altar.circle_vnum)
+        self.assertLess(len(zones.converted_rooms), 200, "only zone 30 and its surroundings must be created")
+        fountain = zones.make_location(3014)
+        self.assertTrue(fountain.livings or fountain.items, "zone 30 must be populated")
+        zones.populate_all_zones()
+        self.assertEqual(1878, len(zones.converted_rooms))
+
+    def test_zone_resets(self):
+        from tale import player, util
+        from tale.vfs import VirtualFileSystem
+        mud_context.driver.user_resources = VirtualFileSystem(root_path=tempfile.mkdtemp(), readonly=False)
+        import zones
+        from zones.circledata import circle_zones
+        from zones.circledata.circle_mobs import count_mobs
+        from zones.circledata.circle_items import count_items
+        from tale.base import Living, Item, MudObjRegistry
+        zones.init_zones(mud_context.driver)
+        julie = player.Player("julie", "f")
+        zones.make_location(3001).insert(julie, julie)
+        self.assertEqual(1, count_mobs(3000), "the wizard of zone 30 has max_exist 1")
+        in_world = [item for item in MudObjRegistry.instances(Item, 3020) if item.contained_in]
+        self.assertLess(len(in_world), MudObjRegistry.count(Item, 3020), "the weaponsmith's forsale stock exists too")
+        self.assertEqual(len(in_world), count_items(3020), "the forsale stock isn't in the world")
+        self.assertNotIn(30, circle_zones.reset_stats, "populating a zone isn't a reset")
+        circle_zones.reset_zone(30)
+        self.assertEqual(1, count_mobs(3000), "a reset must not exceed max_exist")
+        self.assertEqual(1, circle_zones.reset_stats[30][0])
+        wizard = MudObjRegistry.instances(Living, 3000)[0]
+        ctx = util.Context.from_global()
+        wizard.location.remove(wizard, None)
+        wizard.destroy(ctx)
+        self.assertEqual(0, count_mobs(3000))
+        num_deferreds = len(mud_context.driver.deferreds)
+        circle_zones.pulse_zone(ctx)
+        self.assertEqual(num_deferreds, len(mud_context.driver.deferreds), "zone 30 is not due yet")
+        for vnum in (30, 9):
+            circle_zones.populated_zones.add(vnum)
+            circle_zones.last_reset[vnum] = circle_zones.last_reset.get(vnum, 0) - 3600
+        julie.location = zones.make_location(915)   # zone 9 resets only when deserted
+        mud_context.driver.all_players["julie"] = player.PlayerConnection(julie)
+        circle_zones.pulse_zone(ctx)
+        self.assertEqual({30}, circle_zones.scheduled_resets)
+        self.assertEqual(num_deferreds + 1, len(mud_context.driver.deferreds))
+        circle_zones.reset_zone(30, ctx)
+        self.assertEqual(1, count_mobs(3000), "the reset must bring back the wizard")
+        self.assertEqual(set(), circle_zones.scheduled_resets)
+
+    def test_world_cache(self):
+        from tale.vfs import VirtualFileSystem
+        from zones.circledata import world_cache, parse_wld_files, parse_zon_files
+        cache = VirtualFileSystem(root_path=tempfile.mkdtemp(), readonly=False)
+        self.assertFalse(world_cache.load_world(cache), "first time the world must be parsed")
+        self.assertTrue(world_cache.load_world(cache), "already loaded")
+        temple = parse_wld_files._rooms[3001]
+        parse_wld_files._rooms.clear()
+        parse_zon_files._zones.clear()
+        self.assertTrue(world_cache.load_world(cache))
+        self.assertEqual(1878, len(parse_wld_files.get_rooms()))
+        self.assertEqual(30, len(parse_zon_files.get_zones()))
+        self.assertEqual(temple.name, parse_wld_files._rooms[3001].name)
+        self.assertEqual(temple.exits["north"].roomlink, parse_wld_files._rooms[3001].exits["north"].roomlink)
+        parse_wld_files._rooms.clear()
+        with cache.open_write("circle_world.cache") as f:
+            f.write(world_cache.CACHE_HEADER + b"0" * 40 + b"\n")
+        self.assertFalse(world_cache.load_world(cache), "outdated cache must not be used")
+        self.assertEqual(1878, len(parse_wld_files.get_rooms()))
+
+    def test_parallel_parse(self):
+        from zones.circledata import world_cache
+
+        def contents(world):
+            return [(list(parsed), [vars(r) if hasattr(r, "circle_vnum") else r.name for r in parsed.values()]) for parsed in world]
+
+        serial = contents(parse() for _, _, parse in world_cache._parsers.values())
+        for module, name, _ in world_cache._parsers.values():
+            getattr(module, name).clear()
+        timings = world_cache.parse_world(2)
+        self.assertIn("wld/30.wld", timings)
+        self.assertIn("zon/30.zon", timings)
+        parallel = contents(getattr(module, name) for module, name, _ in world_cache._parsers.values())
+        self.assertEqual(serial, parallel, "parallel parsing must give the same result, in the same order")
+
+    def test_savegame_codecs(self):
+        # the speed of the codecs is compared by the benchmark itself:  python -m tests.bench_savegames
+        from tests.bench_savegames import build_circle_world, measure
+        world = build_circle_world([30, 31, 32, 33])     # just Midgaard
+        self.assertTrue(world["items"] and world["livings"], "Midgaard must be populated")
+        serpent_size, _, _, serpent_state = measure(world, "serpent")
+        binary_size, _, _, binary_state = measure(world, "binary", "zlib")
+        self.assertEqual(serpent_state, binary_state, "both codecs must load the same data")
+        self.assertLess(binary_size, serpent_size)
+
 
 class TestBuiltinDemoStory(StoryCaseBase, unittest.TestCase):
     directory = pathlib.Path("demo-story-dummy-path")
@@ -6,7 +6,9 @@ Copyright by Irmen de Jong (irmen@razorvine.net)
 """
 import datetime
 import os
+import tempfile
 import unittest
+import weakref
 
 from tale import util, mud_context
 from tale.base import Item, Container, Location
@@ -453,8 +455,96 @@ class TestVfs(unittest.TestCase):
         with vfs.open_write("unittest.txt", append=True) as f:
             f.write("appended")
         self.assertEqual("overwrittenappended", vfs["unittest.txt"].text)
+        with vfs.open_write_atomic("unittest.txt") as f:
+            f.write("replaced")
+        self.assertEqual("replaced", vfs["unittest.txt"].text)
+        with self.assertRaises(ZeroDivisionError):
+            with vfs.open_write_atomic("unittest.txt") as f:
+                f.write("partial")
+                1 // 0
+        self.assertEqual("replaced", vfs["unittest.txt"].text)
+        with self.assertRaises(IOError):
+            _ = vfs["unittest.txt.tmp"]
         del vfs["unittest.txt"]
 
+    def test_vfs_cache(self):
+        vfs = VirtualFileSystem(root_path=tempfile.mkdtemp(), readonly=False)
+        vfs["cached.txt"] = "first"
+        rsc = vfs["cached.txt"]
+        self.assertIs(rsc, vfs["cached.txt"])
+        self.assertEqual((1, 5, 1, 1), vfs.cache_info())
+        with open(vfs.validate_path("cached.txt"), "w") as f:
+            f.write("changed by someone else")
+        self.assertEqual("changed by someone else", vfs["cached.txt"].text)
+        vfs["cached.txt"] = "written"
+        self.assertEqual("written", vfs["cached.txt"].text)
+        del vfs["cached.txt"]
+        with self.assertRaises(IOError):
+            _ = vfs["cached.txt"]
+        vfs.cache_max_items = 2
+        for name in ("a.txt", "b.txt", "c.txt"):
+            vfs[name] = name
+            _ = vfs[name]
+        self.assertEqual(["b.txt", "c.txt"], list(vfs._cache))
+        _ = vfs["b.txt"]
+        vfs["d.txt"] = "d"
+        _ = vfs["d.txt"]
+        self.assertEqual(["b.txt", "d.txt"], list(vfs._cache), "least recently used must go first")
+        vfs.clear_cache()
+        self.assertEqual(0, vfs.cache_info()[0])
+        # package resources
+        vfs = VirtualFileSystem(root_package="tale")
+        rsc = vfs["tio/quill_pen_paper.gif"]
+        self.assertIs(rsc, vfs["tio/quill_pen_paper.gif"])
+        self.assertEqual(1, vfs.cache_hits)
+
+    def test_vfs_mmap(self):
+        root = tempfile.mkdtemp()
+        data = bytes(range(256)) * 100
+        with open(os.path.join(root, "big.bin"), "wb") as f:
+            f.write(data)
+        with open(os.path.join(root, "small.bin"), "wb") as f:
+            f.write(b"small")
+        with open(os.path.join(root, "big.txt"), "w") as f:
+            f.write("text" * 10000)
+        vfs = VirtualFileSystem(root_path=root)
+        vfs.mmap_threshold = 1000
+        rsc = vfs["big.bin"]
+        self.assertTrue(rsc.is_mapped)
+        self.assertEqual(len(data), len(rsc))
+        self.assertEqual(data, rsc.data)
+        self.assertEqual(99, rsc[99])
+        view = rsc.view()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(data[1000:1010], view[1000:1010].tobytes())
+        chunks = list(rsc.chunks(10000))
+        self.assertEqual([10000, 10000, 5600], [len(c) for c in chunks])
+        self.assertEqual(data, b"".join(chunks))
+        with rsc.open() as f:
+            self.assertEqual(data, f.read())
+        self.assertEqual((1, 0, 0, 1), vfs.cache_info(), "mapped files don't count towards the cache size")
+        self.assertFalse(vfs["small.bin"].is_mapped)
+        self.assertEqual(b"small", b"".join(vfs["small.bin"].chunks()))
+        self.assertFalse(vfs["big.txt"].is_mapped)
+        with self.assertRaises(VfsError):
+            vfs["big.txt"].view()
+        # a mapped resource that drops out of the cache can still be used, it's unmapped when it's no longer referenced
+        vfs.clear_cache()
+        self.assertEqual(data, rsc.data)
+        self.assertEqual(data[:10], view[:10].tobytes())
+        vfs.cache_max_items = 1
+        rsc = vfs["big.bin"]
+        self.assertFalse(vfs["small.bin"].is_mapped)
+        self.assertNotIn("big.bin", vfs._cache, "must be evicted")
+        self.assertEqual(data[:10], rsc.data[:10])
+        self.assertEqual(len(data), len(rsc))
+        rsc_ref = weakref.ref(rsc)
+        del rsc
+        self.assertIsNone(rsc_ref())
+        vfs = VirtualFileSystem(root_path=root, readonly=False)
+        vfs.mmap_threshold = 1000
+        self.assertFalse(vfs["big.bin"].is_mapped, "writable vfs must not map files")
+
     def test_vfs_read_files(self):
         vfs = VirtualFileSystem(root_path=".", readonly=True)
         # text file